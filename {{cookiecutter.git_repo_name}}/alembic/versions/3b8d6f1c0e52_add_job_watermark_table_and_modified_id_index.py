@@ -0,0 +1,44 @@
+"""add job_watermark table and user modified, id index for incremental scripts
+
+Revision ID: 3b8d6f1c0e52
+Revises: 9c4e7b2d1a86
+Create Date: 2026-10-17 19:08:21.402317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8d6f1c0e52'
+down_revision = '9c4e7b2d1a86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_modified_id', 'user', ['modified', 'id'], unique=False)
+    op.create_table(
+        'job_watermark',
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('modified', sa.DateTime(), nullable=False),
+        sa.Column('deleted', sa.Boolean(), server_default='0', nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job', sa.String(length=64), nullable=False),
+        sa.Column('last_modified', sa.DateTime(), nullable=True),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_watermark_job'), 'job_watermark', ['job'], unique=True)
+    op.create_index('ix_job_watermark_deleted_created_id', 'job_watermark', ['deleted', 'created', 'id'],
+                    unique=False)
+    op.create_index('ix_job_watermark_modified_id', 'job_watermark', ['modified', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_job_watermark_modified_id', table_name='job_watermark')
+    op.drop_index('ix_job_watermark_deleted_created_id', table_name='job_watermark')
+    op.drop_index(op.f('ix_job_watermark_job'), table_name='job_watermark')
+    op.drop_table('job_watermark')
+    op.drop_index('ix_user_modified_id', table_name='user')
@@ -0,0 +1,47 @@
+"""create user table
+
+Revision ID: 5a1f3c9e2b7d
+Revises:
+Create Date: 2026-10-17 09:12:44.318201
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1f3c9e2b7d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user',
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('modified', sa.DateTime(), nullable=False),
+        sa.Column('deleted', sa.Boolean(), server_default='0', nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sub', sa.String(length=36), nullable=False),
+        sa.Column('full_name', sa.String(length=32), nullable=True),
+        sa.Column('given_name', sa.String(length=32), nullable=True),
+        sa.Column('email', sa.String(length=64), nullable=False),
+        sa.Column('age', sa.Integer(), nullable=True),
+        sa.Column('gender', sa.Integer(), nullable=True),
+        sa.Column('timezone', sa.String(length=32), nullable=True),
+        sa.Column('notifications_enabled', sa.Boolean(), nullable=True),
+        sa.Column('email_enabled', sa.Boolean(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('is_superuser', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_user_email'), 'user', ['email'], unique=True)
+    op.create_index(op.f('ix_user_sub'), 'user', ['sub'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_sub'), table_name='user')
+    op.drop_index(op.f('ix_user_email'), table_name='user')
+    op.drop_table('user')
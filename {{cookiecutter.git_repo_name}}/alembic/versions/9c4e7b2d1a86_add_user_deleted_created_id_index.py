@@ -0,0 +1,24 @@
+"""add user deleted, created, id index for list queries and cursor pagination
+
+Revision ID: 9c4e7b2d1a86
+Revises: 5a1f3c9e2b7d
+Create Date: 2026-10-17 09:31:05.774920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e7b2d1a86'
+down_revision = '5a1f3c9e2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_deleted_created_id', 'user', ['deleted', 'created', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_deleted_created_id', table_name='user')
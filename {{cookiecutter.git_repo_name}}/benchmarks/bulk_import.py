@@ -0,0 +1,98 @@
+"""Compare importing users row by row through UserCrud.create with the bulk upsert of scripts.import_users.
+
+`--count` synthetic users (see benchmarks.synthetic_users) are written to an NDJSON file, then imported into
+an empty user table: `per_row` reads, validates and creates them one at a time with a commit each, like a
+loop over `UserCrud.create`; `upsert` runs ImportUsers at each `--chunk-sizes`. `reimport` runs ImportUsers
+again over the loaded table, where every row conflicts on `sub` and nothing changes, and `reimport_changed`
+with every user's age changed. Each run reports rows/s.
+
+Usage:
+    python -m benchmarks.bulk_import --count 100000 --chunk-sizes 500 1000 5000
+    python -m benchmarks.bulk_import --db-url postgresql://localhost/bench --count 1000000 --per-row-count 10000
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.synthetic_users import generate_users
+from scripts.import_users import ImportUsers
+from src.orm.models import Base
+from src.orm.schemas import UserCreate
+from src.services.crud.user_crud import UserCrud
+
+# Columns that aren't part of UserCreate
+DB_COLUMNS = ("id", "created", "modified", "deleted", "version")
+
+
+def write_users(path: str, count: int, seed: int, age: int = None):
+    with open(path, "w") as f:
+        for row in generate_users(count, seed=seed):
+            row = {k: v for k, v in row.items() if k not in DB_COLUMNS}
+            if age is not None:
+                row["age"] = age
+            f.write(json.dumps(row) + "\n")
+
+
+def reset(engine: Engine):
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+
+def per_row(engine: Engine, path: str, count: int) -> Dict[str, Any]:
+    session = sessionmaker(bind=engine)()
+    crud = UserCrud(session)
+    start = time.perf_counter()
+    with open(path) as f:
+        for _, line in zip(range(count), f):
+            crud.create(obj_in=UserCreate(**json.loads(line)))
+    elapsed = time.perf_counter() - start
+    session.close()
+    return {"rows": count, "seconds": round(elapsed, 3), "rows_per_s": round(count / elapsed, 1)}
+
+
+def upsert(engine: Engine, path: str, chunk_size: int) -> Dict[str, Any]:
+    script = ImportUsers(["--config", "settings.toml", path, "--chunk-size", str(chunk_size)],
+                         session_factory=sessionmaker(bind=engine))
+    return script.import_file()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", help="Database to benchmark. Default: a new temporary SQLite file.")
+    parser.add_argument("--count", type=int, default=100000, help="Users to import.")
+    parser.add_argument("--per-row-count", type=int, help="Users imported row by row. Default: --count.")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    directory = tempfile.mkdtemp()
+    engine = create_engine(args.db_url or f"sqlite:///{os.path.join(directory, 'bulk_import.db')}")
+    path, changed_path = os.path.join(directory, "users.ndjson"), os.path.join(directory, "changed.ndjson")
+    write_users(path, args.count, args.seed)
+    write_users(changed_path, args.count, args.seed, age=100)
+    logging.disable(logging.INFO)
+
+    reset(engine)
+    results = {"per_row": per_row(engine, path, args.per_row_count or args.count), "upsert": {}}
+    for chunk_size in args.chunk_sizes:
+        reset(engine)
+        results["upsert"][chunk_size] = upsert(engine, path, chunk_size)
+
+    chunk_size = max(args.chunk_sizes)
+    results["reimport"] = upsert(engine, path, chunk_size)
+    results["reimport_changed"] = upsert(engine, changed_path, chunk_size)
+
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Time BaseCrud/UserCrud methods at growing table sizes and page depths, recording the query plans used.
+
+The user table is grown to each `--sizes` value with synthetic users (see benchmarks.synthetic_users), then
+every operation runs `--repeat` times against random rows. Offset and cursor pagination run at each
+`--depths` row offset. Each operation reports p50/p95/p99 latency and the EXPLAIN plan of every statement
+shape it ran, so a plan that changes with table size (e.g. an index no longer used) shows up next to
+its timings.
+
+Usage:
+    python -m benchmarks.crud_scale --sizes 10000 100000 1000000 --depths 0 1000 100000
+    python -m benchmarks.crud_scale --db-url postgresql://localhost/bench --sizes 1000000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic_users import generate_users, load_users
+from benchmarks.utils import latency_summary
+from src.orm.instrumentation import instrument_queries, statement_shape
+from src.orm.schemas import UserCreate
+from src.orm.slow_query_log import EXPLAIN_PREFIXES, explain
+from src.services.crud.base_crud import encode_cursor
+from src.services.crud.user_crud import UserCrud
+
+
+class PlanCollector:
+    """Stands in for a SlowQueryLog in `instrument_queries`, recording the plan of each statement shape run
+    while `collecting` is set."""
+
+    def __init__(self):
+        self.collecting: Optional[Dict[str, Any]] = None
+
+    def should_capture(self, seconds: float) -> bool:
+        return self.collecting is not None
+
+    def capture(self, conn: Any, statement: str, parameters: Any, executemany: bool, seconds: float,
+                streaming: bool = False):
+        shape = statement_shape(statement)
+        if shape in self.collecting:
+            return
+        if executemany or streaming or conn.dialect.name not in EXPLAIN_PREFIXES or \
+                not statement.lstrip().upper().startswith("SELECT"):
+            self.collecting[shape] = None
+        else:
+            self.collecting[shape] = explain(conn, statement, parameters)
+
+
+def time_operation(session: Session, plans: PlanCollector, operation: Callable[[int], Any],
+                   repeat: int) -> Dict[str, Any]:
+    # Plans are collected on a separate, untimed call
+    plans.collecting = {}
+    operation(-1)
+    session.rollback()
+    collected, plans.collecting = plans.collecting, None
+
+    latencies = []
+    for i in range(repeat):
+        # Empty the identity map so every call queries the database
+        session.expunge_all()
+        start = time.perf_counter()
+        operation(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    session.rollback()
+
+    return {**latency_summary(latencies), "plans": collected}
+
+
+def benchmark_size(engine: Engine, plans: PlanCollector, size: int, depths: List[int], repeat: int,
+                   limit: int, rng: random.Random, seed: int = 0) -> Dict[str, Any]:
+    session = Session(bind=engine)
+    crud = UserCrud(session)
+    samples = []
+    while len(samples) < repeat + 1:
+        sample = next(generate_users(1, start=rng.randrange(size), seed=seed))
+        # `get` and `update` skip soft deleted rows
+        if not sample["deleted"]:
+            samples.append(sample)
+    # Lookups should time hits, make sure the samples are rows of the table
+    for sample in samples:
+        if crud.get_by_sub(sub=sample["sub"]) is None or crud.get_by_email(email=sample["email"]) is None:
+            raise Exception(f"Sampled user {sample['id']} isn't in the table, was it loaded with another seed?")
+    new_users = ({**row, "email": f"new.{row['email']}"}
+                 for row in generate_users(repeat + 1, start=size + rng.randrange(10 ** 9), seed=seed))
+    results = {}
+
+    operations = {
+        "get": lambda i: crud.get(id=samples[i]["id"]),
+        "get_by_sub": lambda i: crud.get_by_sub(sub=samples[i]["sub"]),
+        "get_by_email": lambda i: crud.get_by_email(email=samples[i]["email"]),
+        # Like `crud.create`, which always commits, but flushed and rolled back after the run so the table
+        # keeps the rows the next size's `load_users` expects
+        "create": lambda i: (session.add(crud.model(**UserCreate(**next(new_users)).dict())), session.flush()),
+        # Load and update, like PATCH /users/{user_id}. Flushed but rolled back after the run.
+        "update": lambda i: (
+            crud.update(db_obj=crud.get(id=samples[i]["id"]), obj_in={"age": rng.randint(18, 90)}, commit=False),
+            session.flush(),
+        ),
+    }
+    for depth in depths:
+        if depth >= size:
+            continue
+        # A cursor at `depth` rows, as if the client had paged that far
+        row = next(generate_users(1, start=depth - 1, seed=seed)) if depth else None
+        cursor = encode_cursor(row["created"], row["id"]) if row else ""
+        operations[f"get_multi(offset={depth})"] = lambda i, depth=depth: crud.get_multi(offset=depth, limit=limit)
+        operations[f"get_page(depth={depth})"] = lambda i, cursor=cursor: crud.get_page(cursor=cursor, limit=limit)
+
+    for name, operation in operations.items():
+        results[name] = time_operation(session, plans, operation, repeat)
+
+    session.close()
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", help="Database to benchmark. Default: a new temporary SQLite file.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--depths", type=int, nargs="+", default=[0, 1000, 100000],
+                        help="Row offsets to paginate from.")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per operation.")
+    parser.add_argument("--limit", type=int, default=100, help="Page size.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    db_url = args.db_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'crud_scale.db')}"
+    engine = create_engine(db_url)
+    plans = PlanCollector()
+    instrument_queries(engine, plans)
+    logging.disable(logging.INFO)
+
+    rng = random.Random(args.seed)
+    results = {}
+    for size in sorted(args.sizes):
+        start = time.perf_counter()
+        load_users(engine, size, seed=args.seed)
+        results[size] = {
+            "load_s": round(time.perf_counter() - start, 1),
+            "operations": benchmark_size(engine, plans, size, args.depths, args.repeat, args.limit, rng,
+                                         args.seed),
+        }
+
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
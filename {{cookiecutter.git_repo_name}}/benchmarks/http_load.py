@@ -0,0 +1,219 @@
+"""Load test the users endpoints of the app in src/main.py, reporting requests/s and latency percentiles.
+
+The app runs in-process behind httpx's ASGI transport, against a file-backed SQLite database seeded with
+`--users` users, so the results measure the app and its database rather than the network. Auth is stubbed
+the way tests/conftest.py does it: requests are authenticated as a seeded superuser, or as the sub in the
+`X-Bench-Sub` header (used to create and update users).
+
+Results are printed as JSON. Save them as a baseline, then compare later runs against it: the run fails
+(exit code 1) if any endpoint's throughput drops, or its p50/p95/p99 latency grows, by more than `--tolerance`.
+
+Usage:
+    python -m benchmarks.http_load --requests 500 --concurrency 20
+    python -m benchmarks.http_load --save-baseline benchmarks/baselines/http_load.json
+    python -m benchmarks.http_load --baseline benchmarks/baselines/http_load.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+from uuid import uuid4
+
+import httpx
+from sqlalchemy import create_engine, insert
+from starlette.requests import Request
+
+from benchmarks.synthetic_users import generate_users
+from benchmarks.utils import latency_summary
+
+BENCH_SUB = "00000000-0000-4000-8000-000000000000"
+API = "/api/v1/users"
+
+Scenario = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+def seed(db_url: str, users: int) -> List[Dict[str, Any]]:
+    """Create the tables and insert `users` users plus the benchmark superuser. Returns the inserted rows."""
+    from src.orm.models import Base, User
+
+    engine = create_engine(db_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    rows = list(generate_users(users + 1))
+    for row in rows:
+        # Every user can authenticate and be read
+        row.update(is_active=True, deleted=False)
+    # The first user is the superuser that requests are authenticated as by default
+    rows[0].update(sub=BENCH_SUB, is_superuser=True)
+    with engine.begin() as connection:
+        for i in range(0, len(rows), 1000):
+            connection.execute(insert(User.__table__), rows[i:i + 1000])
+    engine.dispose()
+    return rows
+
+
+def scenarios(rows: List[Dict[str, Any]]) -> Dict[str, Scenario]:
+    from src.services.crud.base_crud import encode_cursor
+
+    ids = [row["id"] for row in rows]
+    subs = [row["sub"] for row in rows]
+    # Cursors into the first pages, like a dashboard paging through users
+    cursors = [""] + [encode_cursor(row["created"], row["id"]) for row in rows[99:1000:100]]
+
+    def create_user(client: httpx.AsyncClient, i: int) -> Awaitable[httpx.Response]:
+        sub = str(uuid4())
+        return client.post(f"{API}/", headers={"X-Bench-Sub": sub}, json={
+            "sub": sub,
+            "full_name": "New Bench User",
+            "given_name": "New",
+            "email": f"{sub}@email.com",
+            "timezone": "Europe/London",
+        })
+
+    return {
+        "GET /users/": lambda client, i: client.get(f"{API}/", params={"offset": i % 10 * 100, "limit": 100}),
+        "GET /users/?cursor": lambda client, i: client.get(
+            f"{API}/", params={"cursor": cursors[i % len(cursors)], "limit": 100}
+        ),
+        "GET /users/me": lambda client, i: client.get(f"{API}/me"),
+        "GET /users/{user_id}": lambda client, i: client.get(f"{API}/{ids[i % len(ids)]}"),
+        # One user per request, concurrent writes to the same user would fail the version check with 409
+        "PATCH /users/me": lambda client, i: client.patch(
+            f"{API}/me", headers={"X-Bench-Sub": subs[i % len(subs)]}, json={"age": i % 100}
+        ),
+        "POST /users/": create_user,
+    }
+
+
+def stub_auth(request: Request):
+    from src.api.JWTBearer import JWTAuthorizationCredentials
+
+    return JWTAuthorizationCredentials(
+        claims={"sub": request.headers.get("x-bench-sub", BENCH_SUB)},
+        jwt_token="bench",
+        header={"Authorization": "Bearer bench"},
+        signature="bench",
+        message="bench",
+    )
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int,
+                       concurrency: int) -> Dict[str, Any]:
+    latencies = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            if i >= requests:
+                return
+            start = time.perf_counter()
+            response = await scenario(client, i)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "requests_per_s": round(requests / elapsed, 1),
+        **latency_summary(latencies),
+    }
+
+
+async def run(app: Any, selected: Dict[str, Scenario], requests: int, concurrency: int,
+              warmup: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, scenario in selected.items():
+            await run_scenario(client, scenario, warmup, min(concurrency, max(warmup, 1)))
+            results[name] = await run_scenario(client, scenario, requests, concurrency)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float) -> List[str]:
+    """Describe every endpoint metric that regressed past `tolerance` relative to the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if result["errors"]:
+            regressions.append(f"{name}: {result['errors']} failed requests")
+
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result["requests_per_s"] < expected["requests_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {result['requests_per_s']} requests/s, baseline {expected['requests_per_s']}"
+            )
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if result[key] > expected[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {result[key]}, baseline {expected[key]}")
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000, help="Number of users to seed.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint.")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per endpoint.")
+    parser.add_argument("--endpoints", nargs="+", help="Endpoints to run, e.g. 'GET /users/me'. Default: all.")
+    parser.add_argument("--db", help="SQLite file to seed. Default: a new temporary file.")
+    parser.add_argument("--baseline", help="JSON results to compare against.")
+    parser.add_argument("--save-baseline", help="Write the results to this file.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative regression before the run fails.")
+    args = parser.parse_args(args)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    db_url = f"sqlite:///{db_path}"
+    # The app's engines are created from settings at import, so point them at the seeded database first
+    os.environ["DATABASE_URL"] = db_url
+    # Per-request and SQL logs would dominate the measurements
+    logging.disable(logging.INFO)
+
+    rows = seed(db_url, args.users)
+
+    from src.api.deps import auth
+    from src.main import app
+
+    app.dependency_overrides[auth] = stub_auth
+    available = scenarios(rows)
+    unknown = set(args.endpoints or ()) - set(available)
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+    selected = {name: available[name] for name in args.endpoints or available}
+
+    results = asyncio.run(run(app, selected, args.requests, args.concurrency, args.warmup))
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:\n" + "\n".join(regressions), file=sys.stderr)
+            raise SystemExit(1)
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
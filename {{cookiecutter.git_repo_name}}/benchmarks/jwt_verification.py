@@ -0,0 +1,110 @@
+"""Compare event-loop latency while JWTBearer verifies concurrent requests inline vs in a thread/process pool.
+
+A heartbeat coroutine sleeps for `--tick` ms in a loop and records how late it wakes up. That lag is how
+long any other coroutine on the worker would have been stalled. Each request uses a distinct token and
+the verified-token cache is disabled, so every request does a full signature check.
+
+Usage: python -m benchmarks.jwt_verification --requests 2000 --concurrency 100 --modes inline thread process
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+from starlette.requests import Request
+
+from benchmarks.utils import percentile
+from src.api.JWTBearer import JWKS, JWTBearer
+
+
+def make_keys(key_size: int):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_jwk = jwk.construct(pem, "RS256").public_key().to_dict()
+    return pem, JWKS(keys=[{**{k: str(v) for k, v in public_jwk.items()}, "kid": "bench"}])
+
+
+def make_request(token: str) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+    })
+
+
+async def run_mode(bearer: JWTBearer, tokens: List[str], concurrency: int, tick: float) -> Dict[str, float]:
+    lags = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(tick)
+            lags.append((time.perf_counter() - start - tick) * 1000)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def authenticate(token: str):
+        async with semaphore:
+            await bearer(make_request(token))
+
+    # Warm up lazily created pools and per-process key caches
+    await asyncio.gather(*(authenticate(token) for token in tokens[:bearer.verify_workers]))
+
+    monitor = asyncio.ensure_future(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(authenticate(token) for token in tokens))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await monitor
+
+    return {
+        "requests_per_s": round(len(tokens) / elapsed, 1),
+        "loop_lag_p50_ms": round(statistics.median(lags), 3) if lags else 0.0,
+        "loop_lag_p99_ms": round(percentile(lags, 99), 3),
+        "loop_lag_max_ms": round(max(lags), 3) if lags else 0.0,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4, help="Pool size for thread/process modes.")
+    parser.add_argument("--key-size", type=int, default=2048)
+    parser.add_argument("--tick", type=float, default=1, help="Heartbeat interval in ms.")
+    parser.add_argument("--modes", nargs="+", default=["inline", "thread", "process"],
+                        choices=["inline", "thread", "process"])
+    args = parser.parse_args(args)
+
+    pem, jwks = make_keys(args.key_size)
+    exp = int(time.time()) + 3600
+    tokens = [
+        jwt.encode({"sub": str(i), "exp": exp}, pem, algorithm="RS256", headers={"kid": "bench"})
+        for i in range(args.requests)
+    ]
+
+    results = {}
+    for mode in args.modes:
+        bearer = JWTBearer(jwks, token_cache_size=0, verify_in=None if mode == "inline" else mode,
+                           verify_workers=args.workers)
+        try:
+            results[mode] = asyncio.run(run_mode(bearer, tokens, args.concurrency, args.tick / 1000))
+        finally:
+            bearer.shutdown()
+
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
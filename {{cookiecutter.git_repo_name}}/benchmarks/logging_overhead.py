@@ -0,0 +1,108 @@
+"""Measure the per-call overhead of a log call in each init_logging mode.
+
+Each mode configures logging with init_logging, with stdout pointed at a file so every write is a real
+blocking write, then times `--calls` INFO calls from a request-like function. `call_us` is the average
+time spent in the log call itself, i.e. what a request pays. For queued modes, `drain_s` is the time the
+background thread then needed to write out the backlog, and `dropped` the records lost to a full queue.
+A local file is a fast sink, `--write-delay-us` adds latency to every write to see how each mode copes
+with a slow one.
+
+Usage:
+    python -m benchmarks.logging_overhead --calls 100000 --modes text text_no_caller queue_json
+    python -m benchmarks.logging_overhead --calls 10000 --write-delay-us 50
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, TextIO
+
+import src.core.logging as core_logging
+from src.core.logging import init_logging
+
+MODES: Dict[str, Dict[str, Any]] = {
+    "text": {},
+    "text_no_caller": {"caller": False},
+    "json": {"log_format": "json", "caller": False},
+    "json_caller": {"log_format": "json"},
+    "queue_text": {"queue": True},
+    "queue_json": {"queue": True, "log_format": "json", "caller": False},
+    "rate_limited": {"rate_limits": {"bench": 1000}},
+    "sampled": {"sample_rates": {"bench": 0.01}},
+}
+
+
+def handle_request(logger: logging.Logger, i: int):
+    logger.info("Handled request %s for user %s", i, "00000000-0000-4000-8000-000000000000")
+
+
+class SlowStream:
+    """File that takes `delay` seconds per write, like a pipe to a log collector that's falling behind."""
+
+    def __init__(self, f: TextIO, delay: float):
+        self.f = f
+        self.delay = delay
+
+    def write(self, data: str) -> int:
+        if self.delay:
+            time.sleep(self.delay)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def run_mode(options: Dict[str, Any], calls: int, queue_size: int, path: str, write_delay: float) -> Dict[str, Any]:
+    stdout = sys.stdout
+    with open(path, "w") as f:
+        # The handler resolves ext://sys.stdout when it's configured
+        sys.stdout = SlowStream(f, write_delay)
+        try:
+            init_logging(env="prod", root_level="INFO", queue_size=queue_size, **options)
+            logger = logging.getLogger("bench")
+
+            start = time.perf_counter()
+            for i in range(calls):
+                handle_request(logger, i)
+            elapsed = time.perf_counter() - start
+
+            dropped = getattr(logging.getLogger().handlers[0], "dropped", 0)
+            drain_start = time.perf_counter()
+            core_logging.stop_logging()
+            drain = time.perf_counter() - drain_start
+        finally:
+            # Back to plain synchronous stdout logging for the next mode
+            sys.stdout = stdout
+            init_logging(env="prod", root_level="INFO")
+
+    return {
+        "call_us": round(elapsed / calls * 1e6, 3),
+        "drain_s": round(drain, 3),
+        "dropped": dropped,
+        "bytes_written": os.path.getsize(path),
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--queue-size", type=int, default=0, help="Queue size of queued modes, 0 for unbounded.")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--write-delay-us", type=float, default=0,
+                        help="Extra latency of each write to stdout, to simulate a slow log sink.")
+    args = parser.parse_args(args)
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.log")
+    write_delay = args.write_delay_us / 1e6
+    results = {
+        mode: run_mode(MODES[mode], args.calls, args.queue_size, path, write_delay) for mode in args.modes
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Generate valid synthetic users and bulk load them, e.g. to benchmark queries on millions of rows.
+
+Usage: python -m benchmarks.synthetic_users --db-url sqlite:///users.db --count 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator
+from uuid import UUID
+
+import pytz
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.engine import Engine
+
+from src.orm.models import Base, User
+
+FIRST_NAMES = ["Ada", "Alan", "Grace", "Linus", "Margaret", "Dennis", "Barbara", "Ken", "Frances", "Edsger"]
+LAST_NAMES = ["Lovelace", "Turing", "Hopper", "Torvalds", "Hamilton", "Ritchie", "Liskov", "Thompson", "Allen"]
+TIMEZONES = list(pytz.common_timezones)
+EPOCH = datetime(2020, 1, 1)
+
+
+def generate_users(count: int, start: int = 0, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Yield `count` user rows with ids `start + 1` onwards. Each row only depends on its row number and `seed`,
+    so a row generated on its own is the same as in a bulk load, e.g. to look up rows known to be loaded.
+    Subs and emails are unique: a sub is 64 random bits followed by the row number. Rows are created one
+    second apart, so `(created, id)` order matches id order, like rows inserted over time.
+    """
+    for i in range(start, start + count):
+        rng = random.Random(seed * 1_000_003 + i)
+        first_name = rng.choice(FIRST_NAMES)
+        created = EPOCH + timedelta(seconds=i)
+        yield {
+            "id": i + 1,
+            "sub": str(UUID(int=rng.getrandbits(64) << 64 | i, version=4)),
+            "full_name": f"{first_name} {rng.choice(LAST_NAMES)}",
+            "given_name": first_name,
+            "email": f"{first_name.lower()}.{i}@example.com",
+            "age": rng.randint(18, 90),
+            "gender": rng.randint(0, 2),
+            "timezone": rng.choice(TIMEZONES),
+            "notifications_enabled": rng.random() < 0.8,
+            "email_enabled": rng.random() < 0.6,
+            "is_active": rng.random() < 0.95,
+            "is_superuser": False,
+            "created": created,
+            "modified": created,
+            # A few soft deleted rows, so the `deleted == False` filter has something to skip
+            "deleted": rng.random() < 0.02,
+            "version": 1,
+        }
+
+
+def user_count(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return connection.execute(select(func.coalesce(func.max(User.id), 0))).scalar()
+
+
+def load_users(engine: Engine, count: int, chunk_size: int = 10000, seed: int = 0) -> int:
+    """Grow the user table to `count` rows with multi-row inserts, one transaction per chunk. Returns rows added."""
+    Base.metadata.create_all(engine)
+    start = user_count(engine)
+    if start >= count:
+        return 0
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            # Durability doesn't matter for benchmark data
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+            connection.exec_driver_sql("PRAGMA synchronous=OFF")
+
+    rows = generate_users(count - start, start=start, seed=seed)
+    added = 0
+    while added < count - start:
+        chunk = [row for _, row in zip(range(chunk_size), rows)]
+        with engine.begin() as connection:
+            connection.execute(insert(User.__table__), chunk)
+        added += len(chunk)
+    return added
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", required=True, help="e.g. sqlite:///users.db or postgresql://localhost/bench")
+    parser.add_argument("--count", type=int, default=1_000_000, help="Total users the table should have.")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    engine = create_engine(args.db_url)
+    start = time.perf_counter()
+    added = load_users(engine, args.count, args.chunk_size, args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"Added {added} users in {elapsed:.1f}s ({added / elapsed if elapsed else 0:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import statistics
+from typing import Dict, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def latency_summary(latencies_ms: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max of latencies in milliseconds, rounded for reports."""
+    return {
+        "p50_ms": round(statistics.median(latencies_ms), 3) if latencies_ms else 0.0,
+        "p95_ms": round(percentile(latencies_ms, 95), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3),
+        "max_ms": round(max(latencies_ms), 3) if latencies_ms else 0.0,
+    }
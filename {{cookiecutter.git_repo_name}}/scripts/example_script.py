@@ -1,6 +1,25 @@
-from src.core.script import Script
+import logging
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from src.core.script import Chunk, Script, id_ranges
+from src.orm.models import User
 from src.orm.session import SessionLocal
 
+logger = logging.getLogger(__name__)
+
+
+def count_mixed_case_emails(session: Session, chunk: Chunk) -> int:
+    """
+    Process one chunk of users, here only reading them. Module-level, so it can also run with
+    `--executor process`.
+    """
+    return session.execute(
+        select(func.count())
+        .where(User.id >= chunk.start, User.id < chunk.end, User.email != func.lower(User.email))
+    ).scalar()
+
 
 class Example(Script):
     def __init__(self, args=None):
@@ -11,8 +30,12 @@ class Example(Script):
 
     def run(self):
         session = SessionLocal()
-        session.add_all([])
-        session.commit()
+        min_id, max_id = session.query(func.min(User.id), func.max(User.id)).one()
+        session.close()
+
+        # e.g. python -m scripts.example_script -c settings.toml --workers 4 --checkpoint example.checkpoint
+        summary = self.run_chunks(count_mixed_case_emails, id_ranges(min_id, max_id, self.args.chunk_size))
+        logger.info(f"{summary['rows']} users have an email with upper case letters")
 
 
 if __name__ == "__main__":
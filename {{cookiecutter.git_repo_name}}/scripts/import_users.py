@@ -0,0 +1,121 @@
+import csv
+import json
+import logging
+import os
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from pydantic import ValidationError
+
+from src.core.script import Progress, Script
+from src.orm.schemas import UserCreate
+from src.services.crud.user_crud import UserCrud
+
+logger = logging.getLogger(__name__)
+
+
+def read_rows(f: TextIO, format: str) -> Iterator[Tuple[int, Any]]:
+    """
+    Yield `(line number, row)` from a CSV file with a header, or an NDJSON file of one user per line. Lines
+    that aren't valid JSON are yielded as they are, for `validate` to reject.
+    """
+    if format == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            # Empty cells are missing values, which an update leaves as they are
+            yield reader.line_num, {field: value for field, value in row.items() if value != ""}
+        return
+
+    for line_num, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except ValueError:
+            yield line_num, line.rstrip("\n")
+
+
+def validate(line_num: int, row: Any) -> Tuple[Optional[UserCreate], Optional[Dict[str, Any]]]:
+    """The row as a UserCreate, or the rejection to record for it."""
+    if not isinstance(row, dict):
+        return None, {"line": line_num, "row": row, "errors": ["Not a JSON object"]}
+    try:
+        return UserCreate(**row), None
+    except ValidationError as e:
+        return None, {"line": line_num, "row": row, "errors": e.errors()}
+
+
+class ImportUsers(Script):
+    """
+    Create or update users from a CSV or NDJSON file, e.g. a dump of the identity provider's users.
+
+    Rows are read as a stream and validated with UserCreate `--chunk-size` rows at a time. Each chunk of valid
+    rows is upserted on `sub` and committed (see `BaseCrud.bulk_upsert`). Only the fields a row has are
+    written, so a file without e.g. an `age` column leaves existing users' ages as they are. Rows that fail
+    validation or conflict with another user, e.g. on email, are written to the `--rejected` file as NDJSON
+    with their line number and errors, and the import carries on.
+
+    e.g. python -m scripts.import_users -c settings.toml users.csv --chunk-size 5000
+    """
+
+    def add_args(self):
+        self.parser.add_argument("path", help="CSV (with a header) or NDJSON file of users.")
+        self.parser.add_argument("--format", choices=["csv", "ndjson"],
+                                 help="Default: from the file extension, NDJSON unless it's .csv.")
+        self.parser.add_argument("--rejected", help="File the rejected rows are written to. Default: <path>.rejected")
+
+    def run(self):
+        self.import_file()
+
+    def import_file(self) -> Dict[str, Any]:
+        """Import the file and return the number of users imported and rejected, and rows/s."""
+        path = self.args.path
+        format = self.args.format or ("csv" if path.lower().endswith(".csv") else "ndjson")
+        rejected_path = self.args.rejected or f"{path}.rejected"
+        progress = Progress(None, interval=self.progress_interval)
+        rejected = 0
+
+        session = self.session_factory()
+        crud = UserCrud(session)
+        try:
+            with open(path, newline="" if format == "csv" else None) as f, open(rejected_path, "w") as rejects:
+                rows = read_rows(f, format)
+                while True:
+                    chunk = list(islice(rows, self.args.chunk_size))
+                    if not chunk:
+                        break
+
+                    users: List[Tuple[int, UserCreate]] = []
+                    rejections = []
+                    for line_num, row in chunk:
+                        user, rejection = validate(line_num, row)
+                        if user is None:
+                            rejections.append(rejection)
+                        else:
+                            users.append((line_num, user))
+
+                    results = crud.bulk_upsert(objs_in=[user for _, user in users], chunk_size=len(users) or 1)
+                    for (line_num, user), result in zip(users, results):
+                        if not result.success:
+                            rejections.append({"line": line_num, "row": user.dict(), "errors": [result.detail]})
+
+                    for rejection in sorted(rejections, key=lambda rejection: rejection["line"]):
+                        rejects.write(json.dumps(rejection, default=str) + "\n")
+                    rejected += len(rejections)
+                    progress.update(len(chunk) - len(rejections))
+        finally:
+            session.close()
+
+        if not rejected:
+            os.remove(rejected_path)
+        summary = {**progress.summary(), "rejected": rejected}
+        logger.info(f"Imported {summary['rows']} users in {summary['seconds']}s, {summary['rows_per_s']} rows/s, "
+                    f"{rejected} rejected" + (f", see {rejected_path}" if rejected else ""))
+        return summary
+
+
+if __name__ == "__main__":
+    import sys
+
+    cmd = ImportUsers(sys.argv[1:])
+    sys.exit(cmd())
@@ -1,5 +1,9 @@
-import os
-from typing import Dict, Optional, List, Any
+import asyncio
+import hashlib
+import json
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Optional, Any, Union
 
 from fastapi import HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -8,13 +12,9 @@ from jose.utils import base64url_decode
 from pydantic import BaseModel
 from starlette.requests import Request
 
+from src.api.jwks import JWK, JWKS, JWKSProvider
 from src.core import settings
-
-JWK = Dict[str, str]
-
-
-class JWKS(BaseModel):
-    keys: List[JWK]
+from src.core.cache import LRUCache
 
 
 class JWTAuthorizationCredentials(BaseModel):
@@ -25,25 +25,77 @@ class JWTAuthorizationCredentials(BaseModel):
     message: str
 
 
+@lru_cache(maxsize=32)
+def _construct_key(key_json: str) -> Any:
+    return jwk.construct(json.loads(key_json))
+
+
+def verify_signature(public_key: JWK, message: str, signature: str) -> bool:
+    """Verify a token signature in a worker process, where constructed keys are cached per process."""
+    key = _construct_key(json.dumps(public_key, sort_keys=True))
+    return key.verify(message.encode(), base64url_decode(signature.encode()))
+
+
 class JWTBearer(HTTPBearer):
-    def __init__(self, jwks: JWKS = None, auto_error: bool = True):
+    VERIFY_EXECUTORS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+    def __init__(self, jwks: Union[JWKS, JWKSProvider] = None, auto_error: bool = True,
+                 token_cache_size: int = 1024, verify_in: str = None, verify_workers: int = 4):
         super().__init__(auto_error=auto_error)
 
-        self.kid_to_jwk = {jwk["kid"]: jwk for jwk in jwks.keys} if jwks else None
+        if verify_in and verify_in not in self.VERIFY_EXECUTORS:
+            raise ValueError(f"Invalid verify_in: {verify_in}, expected one of {list(self.VERIFY_EXECUTORS)}")
+
+        self.jwks = JWKSProvider(jwks=jwks) if isinstance(jwks, JWKS) else jwks
+        # Verified tokens keyed by digest, each entry expires at the token's `exp` claim.
+        # Set `token_cache_size=0` to disable.
+        self.token_cache = LRUCache(maxsize=token_cache_size) if token_cache_size else None
+        # Run the CPU-bound signature check in a bounded "thread" or "process" pool so it doesn't
+        # stall the event loop. Inline (on the event loop) if not set.
+        self.verify_in = verify_in or None
+        self.verify_workers = verify_workers
+        self._executor: Optional[Executor] = None
 
     def verify_jwk_token(self, jwt_credentials: JWTAuthorizationCredentials) -> bool:
-        try:
-            public_key = self.kid_to_jwk[jwt_credentials.header["kid"]]
-        except KeyError:
+        key = self.jwks.get_public_key(jwt_credentials.header.get("kid"))
+        if not key:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN, detail="JWK public key not found"
             )
 
-        key = jwk.construct(public_key)
         decoded_signature = base64url_decode(jwt_credentials.signature.encode())
 
         return key.verify(jwt_credentials.message.encode(), decoded_signature)
 
+    async def verify_jwk_token_async(self, jwt_credentials: JWTAuthorizationCredentials) -> bool:
+        if not self.verify_in:
+            return self.verify_jwk_token(jwt_credentials)
+
+        loop = asyncio.get_event_loop()
+        if self.verify_in == "process":
+            # Key objects can't be pickled, so worker processes get the JWK and build (and cache) their own.
+            public_key = self.jwks.get_key(jwt_credentials.header.get("kid"))
+            if not public_key:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN, detail="JWK public key not found"
+                )
+            return await loop.run_in_executor(
+                self.executor, verify_signature, public_key, jwt_credentials.message, jwt_credentials.signature
+            )
+        return await loop.run_in_executor(self.executor, self.verify_jwk_token, jwt_credentials)
+
+    @property
+    def executor(self) -> Executor:
+        # Created on first use so importing the app (e.g. on a Lambda cold start) doesn't spawn workers.
+        if self._executor is None:
+            self._executor = self.VERIFY_EXECUTORS[self.verify_in](max_workers=self.verify_workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
     async def __call__(self, request: Request) -> Optional[JWTAuthorizationCredentials]:
         # Allow override for local development by passing query param `sub` with real sub value
         if request.query_params.get("sub") and settings.env == "local":
@@ -65,6 +117,12 @@ class JWTBearer(HTTPBearer):
 
             jwt_token = credentials.credentials
 
+            cache_key = hashlib.sha256(jwt_token.encode()).digest()
+            if self.token_cache is not None:
+                cached_credentials = self.token_cache.get(cache_key)
+                if cached_credentials:
+                    return cached_credentials
+
             message, signature = jwt_token.rsplit(".", 1)
 
             try:
@@ -80,10 +138,18 @@ class JWTBearer(HTTPBearer):
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Could not validate credentials",
                 )
-            if self.kid_to_jwk and not self.verify_jwk_token(jwt_credentials):
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Could not validate credentials",
-                )
+            if self.jwks:
+                # Any fetch needed for this `kid` (first request, rotated keys) runs off the event loop.
+                await self.jwks.prefetch(jwt_credentials.header.get("kid"))
+
+                if not await self.verify_jwk_token_async(jwt_credentials):
+                    raise HTTPException(
+                        status_code=status.HTTP_403_FORBIDDEN,
+                        detail="Could not validate credentials",
+                    )
+
+            expires_at = jwt_credentials.claims.get("exp")
+            if self.token_cache is not None and isinstance(expires_at, (int, float)):
+                self.token_cache.set(cache_key, jwt_credentials, expires_at=expires_at)
 
             return jwt_credentials
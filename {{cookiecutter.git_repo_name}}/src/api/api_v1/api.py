@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 
-from src.api.api_v1.endpoints import users
+from src.api.api_v1.endpoints import stats, users
 
 api_router = APIRouter()
 api_router.include_router(users.router, prefix="/users", tags=["users"])
+api_router.include_router(stats.router, prefix="/stats", tags=["stats"])
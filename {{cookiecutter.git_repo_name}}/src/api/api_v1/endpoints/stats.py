@@ -0,0 +1,29 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends
+
+from src.api import deps
+from src.orm.async_session import async_engine
+from src.orm.session import engine, pool_status
+from src.services.response_cache import response_cache
+from src.services.user_cache import user_cache
+
+router = APIRouter()
+
+
+@router.get("/", dependencies=[Depends(deps.get_current_active_superuser)])
+async def read_stats() -> Any:
+    """
+    Retrieve runtime stats of this worker's connection pools and caches.
+    """
+    return {
+        "pools": {
+            "sync": pool_status(engine),
+            "async": pool_status(async_engine.sync_engine),
+        },
+        "caches": {
+            "token": deps.auth.token_cache.stats() if deps.auth.token_cache else None,
+            "user": user_cache.entries.stats(),
+            "response": response_cache.stats(),
+        },
+    }
@@ -1,109 +1,256 @@
-from typing import Any, List
+import csv
+import io
+import logging
+from typing import Any, AsyncIterator, Iterable, List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
 
 from src.api import deps
 from src.api.JWTBearer import JWTAuthorizationCredentials
+from src.api.conditional import check_if_match, conditional_response, stale_write_error, validator_headers
+from src.api.serializers import get_serializer
 from src.orm import models, schemas
-from src.services.crud.user_crud import UserCrud
+from src.services.crud.user_crud import AsyncUserCrud
+from src.services.response_cache import response_cache
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Users returned by these endpoints are loaded from the database, so they skip response_model validation
+user_serializer = get_serializer(schemas.User)
+user_page_serializer = get_serializer(schemas.UserPage)
 
-@router.get("/", response_model=List[schemas.User], dependencies=[Depends(
-    deps.get_current_active_superuser)])
-def read_users(db: Session = Depends(deps.get_db), offset: int = 0, limit: int = 100) -> Any:
+# Exported fields, in the order of the CSV columns
+EXPORT_FIELDS = [alias for alias, _, _ in user_serializer.fields]
+EXPORT_COLUMNS = [name for _, name, _ in user_serializer.fields]
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+class ExportResponse(StreamingResponse):
+    """
+    Streams the body one chunk at a time. Unlike StreamingResponse it doesn't also listen for a disconnect in a
+    separate task: that task would read `receive` too and could take the disconnect message before
+    `request.is_disconnected()`, which the export checks between batches, sees it.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async for chunk in self.body_iterator:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+
+def privilege(user: models.User) -> str:
+    """Access level that response cache entries are shared by."""
+    return "superuser" if user.is_superuser else "user"
+
+
+def user_response(user: models.User) -> Any:
+    """Serialized user with its `ETag` and `Last-Modified` validators."""
+    response = user_serializer.response(user)
+    response.headers.update(validator_headers(user))
+    return response
+
+
+@router.get("/", response_model=Union[List[schemas.User], schemas.UserPage])
+async def read_users(request: Request, db: AsyncSession = Depends(deps.get_async_db), offset: int = 0,
+                     limit: int = 100, cursor: Optional[str] = None,
+                     current_user: models.User = Depends(deps.get_current_active_superuser)) -> Any:
     """
     Retrieve users.
+
+    Pass `cursor` (empty for the first page) to use cursor pagination instead of `offset`. The response is
+    then a page with `items` and the `next_cursor` to request the following page.
+
+    Responses are cached until a write to the user table, or for `response_cache.ttl` seconds.
+    """
+    cache_key = response_cache.key(request, privilege(current_user))
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    generations = response_cache.generations(models.User.__tablename__)
+
+    crud = AsyncUserCrud(db)
+    if cursor is None:
+        response = user_serializer.response(await crud.get_multi(offset=offset, limit=limit))
+    else:
+        try:
+            users, next_cursor = await crud.get_page(cursor=cursor, limit=limit)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        response = user_page_serializer.response({"items": users, "next_cursor": next_cursor})
+
+    response_cache.set(cache_key, response, [models.User.__tablename__], generations)
+    return response
+
+
+@router.get("/export", dependencies=[Depends(deps.get_current_active_superuser)])
+async def export_users(request: Request, db: AsyncSession = Depends(deps.get_async_db),
+                       format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+                       batch_size: int = Query(1000, ge=1, le=10000)) -> Any:
+    """
+    Export all users as NDJSON (one user per line, in the same shape as the other endpoints) or CSV. To be
+    used by superusers only.
+
+    The response is streamed as users are read through a server-side cursor, `batch_size` at a time, so memory
+    use stays flat however many users there are. Reading stops if the client disconnects.
     """
-    users = UserCrud(db).get_multi(offset=offset, limit=limit)
-    return users
+    batches = AsyncUserCrud(db).stream_batches(columns=EXPORT_COLUMNS, batch_size=batch_size)
+    encode = _ndjson_lines if format == "ndjson" else _csv_lines
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            if format == "csv":
+                yield _csv_encode([EXPORT_FIELDS])
+            async for rows in batches:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, user export stopped")
+                    return
+                yield encode(rows)
+        finally:
+            await batches.aclose()
+
+    return ExportResponse(body(), media_type=EXPORT_MEDIA_TYPES[format],
+                          headers={"Content-Disposition": f'attachment; filename="users.{format}"'})
+
+
+def _ndjson_lines(rows: List[Row]) -> bytes:
+    return b"".join(orjson.dumps(user_serializer.to_dict(row._mapping)) + b"\n" for row in rows)
+
+
+def _csv_lines(rows: List[Row]) -> bytes:
+    return _csv_encode(user_serializer.to_dict(row._mapping).values() for row in rows)
+
+
+def _csv_encode(lines: Iterable[Iterable[Any]]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(lines)
+    return buffer.getvalue().encode()
 
 
 @router.post("/", response_model=schemas.User)
-def create_user(*, db: Session = Depends(deps.get_db), user_in: schemas.UserCreate,
-                credentials: JWTAuthorizationCredentials = Depends(deps.auth)) -> Any:
+async def create_user(*, db: AsyncSession = Depends(deps.get_async_db), user_in: schemas.UserCreate,
+                      credentials: JWTAuthorizationCredentials = Depends(deps.auth)) -> Any:
     """
     Create new user.
+
+    The user is inserted without checking for an existing one first, the unique `sub` and `email` columns
+    reject duplicates.
     """
-    crud = UserCrud(db)
-    user = crud.get_by_sub(sub=user_in.sub)
-    if user:
+    if not credentials.claims.get("sub") == user_in.sub:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="The user with this username already exists in the system.",
+            detail="Credentials do not match input data.",
         )
-    if not credentials.claims.get("sub") == user_in.sub:
+    try:
+        user = await AsyncUserCrud(db).create_unique(obj_in=user_in)
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Credentials do not match input data.",
+            detail="The user with this username already exists in the system.",
         )
-    user = crud.create(obj_in=user_in)
-    return user
+    return user_serializer.response(user)
+
+
+@router.post("/bulk", response_model=List[schemas.BulkResult], dependencies=[Depends(
+    deps.get_current_active_superuser)])
+async def create_users_bulk(*, db: AsyncSession = Depends(deps.get_async_db),
+                            users_in: List[schemas.UserCreate]) -> Any:
+    """
+    Create users in bulk, e.g. to onboard a batch of users. To be used by superusers only.
+    Returns a result per input item, in order, with the new user's id or why it couldn't be created.
+    """
+    return await AsyncUserCrud(db).bulk_create(objs_in=users_in)
+
+
+@router.patch("/bulk", response_model=List[schemas.BulkResult], dependencies=[Depends(
+    deps.get_current_active_superuser)])
+async def update_users_bulk(*, db: AsyncSession = Depends(deps.get_async_db),
+                            users_in: List[schemas.UserBulkUpdate]) -> Any:
+    """
+    Update users in bulk by id. To be used by superusers only.
+    Returns a result per input item, in order, with whether the user was updated.
+    """
+    return await AsyncUserCrud(db).bulk_update(objs_in=[user_in.dict(exclude_unset=True) for user_in in users_in])
 
 
 @router.patch("/me", response_model=schemas.User)
-def update_user_me(*, db: Session = Depends(deps.get_db), user_in: schemas.UserUpdate,
-                   current_user: models.User = Depends(deps.get_current_active_user)) -> Any:
+async def update_user_me(*, request: Request, db: AsyncSession = Depends(deps.get_async_db),
+                         user_in: schemas.UserUpdate,
+                         current_user: models.User = Depends(deps.get_current_active_user)) -> Any:
     """
-    Update own user.
+    Update own user. Send the user's `ETag` in `If-Match` to only update it if it is unchanged.
     """
     if not current_user.is_superuser and user_in.is_superuser:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot set self to superuser.",
         )
+    check_if_match(request, current_user)
 
-    current_user_data = jsonable_encoder(current_user)
-    user_update = schemas.UserUpdate(**current_user_data)
-    update_data = user_in.dict(exclude_unset=True)
-    updated_user = user_update.copy(update=update_data)
-    user = UserCrud(db).update(db_obj=current_user, obj_in=updated_user)
-    return user
+    try:
+        user = await AsyncUserCrud(db).update(db_obj=current_user, obj_in=user_in)
+    except StaleDataError:
+        raise stale_write_error(request)
+    return user_response(user)
 
 
 @router.get("/me", response_model=schemas.User)
-def read_user_me(current_user: models.User = Depends(deps.get_current_active_user)) -> Any:
+async def read_user_me(request: Request, current_user: models.User = Depends(deps.get_current_active_user)) -> Any:
     """
-    Get current user.
+    Get current user. Answers `If-None-Match` with 304 Not Modified if the user is unchanged.
     """
-    return current_user
+    return conditional_response(request, current_user) or user_response(current_user)
 
 
 @router.get("/{user_id}", response_model=schemas.User)
-def read_user_by_id(user_id: int, current_user: models.User = Depends(deps.get_current_active_user),
-                    db: Session = Depends(deps.get_db)) -> Any:
+async def read_user_by_id(request: Request, user_id: int,
+                          current_user: models.User = Depends(deps.get_current_active_user),
+                          db: AsyncSession = Depends(deps.get_async_db)) -> Any:
     """
-    Get a specific user by id.
+    Get a specific user by id. Answers `If-None-Match` with 304 Not Modified if the user is unchanged.
     """
-    crud = UserCrud(db)
-    user = crud.get(id=user_id)
-    if user == current_user:
-        return user
-    if not current_user.is_superuser:
+    crud = AsyncUserCrud(db)
+    user = await crud.get(id=user_id)
+    if user != current_user and not current_user.is_superuser:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="The user doesn't have enough privileges"
         )
-    return user
+    if user is None:
+        # A missing user goes through response_model validation as before
+        return user
+    return conditional_response(request, user) or user_response(user)
 
 
 @router.patch("/{user_id}", response_model=schemas.User, dependencies=[Depends(deps.get_current_active_superuser)])
-def update_user(*, db: Session = Depends(deps.get_db), user_id: int, user_in: schemas.UserUpdate) -> Any:
+async def update_user(*, request: Request, db: AsyncSession = Depends(deps.get_async_db), user_id: int,
+                      user_in: schemas.UserUpdate) -> Any:
     """
     Update a user. To be used by superusers only, e.g. set user as inactive.
+    Send the user's `ETag` in `If-Match` to only update it if it is unchanged.
     """
-    crud = UserCrud(db)
-    user = crud.get(id=user_id)
+    crud = AsyncUserCrud(db)
+    user = await crud.get(id=user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found",
         )
-    current_user_data = jsonable_encoder(user)
-    user_update = schemas.UserUpdate(**current_user_data)
-    update_data = user_in.dict(exclude_unset=True)
-    updated_user = user_update.copy(update=update_data)
-    user = crud.update(db_obj=user, obj_in=updated_user)
-    return user
+    check_if_match(request, user)
+
+    try:
+        user = await crud.update(db_obj=user, obj_in=user_in)
+    except StaleDataError:
+        raise stale_write_error(request)
+    return user_response(user)
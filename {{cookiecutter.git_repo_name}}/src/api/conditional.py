@@ -0,0 +1,96 @@
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.orm.models import Base
+
+
+def etag(obj: Base) -> str:
+    """Strong ETag of a row. `version` is bumped by every write, so `(id, version)` identifies its content."""
+    return f'"{obj.id}-{obj.version}"'
+
+
+def last_modified(obj: Base) -> Optional[str]:
+    if obj.modified is None:
+        return None
+    # `modified` is stored as naive UTC
+    return format_datetime(obj.modified.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def validator_headers(obj: Base) -> dict:
+    headers = {"ETag": etag(obj)}
+    modified = last_modified(obj)
+    if modified:
+        headers["Last-Modified"] = modified
+    return headers
+
+
+def _parse_etags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def is_not_modified(request: Request, obj: Base) -> bool:
+    """
+    Whether the client's cached copy is current, per `If-None-Match` (weak comparison) or, when that header
+    is absent, `If-Modified-Since`.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        current = etag(obj)
+        return any(tag == "*" or tag.replace("W/", "", 1) == current for tag in _parse_etags(if_none_match))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and obj.modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        return obj.modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+    return False
+
+
+def conditional_response(request: Request, obj: Base) -> Optional[Response]:
+    """Return a 304 response if the client's copy of `obj` is current, without serializing `obj`."""
+    if is_not_modified(request, obj):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers(obj))
+    return None
+
+
+def check_if_match(request: Request, obj: Base):
+    """
+    Enforce an `If-Match` precondition before writing to `obj`: the client must have seen its current
+    version (strong comparison), otherwise raise 412 Precondition Failed.
+    """
+    if_match = request.headers.get("if-match")
+    if if_match is None:
+        return
+
+    current = etag(obj)
+    if not any(tag == "*" or tag == current for tag in _parse_etags(if_match)):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The resource was modified since it was read.",
+        )
+
+
+def stale_write_error(request: Request) -> HTTPException:
+    """
+    Error for a write that lost a race, i.e. the versioned UPDATE found a newer `version`. This is a failed
+    precondition if the client sent `If-Match`, and a conflict otherwise.
+    """
+    if request.headers.get("if-match") is not None:
+        return HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The resource was modified since it was read.",
+        )
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="The resource was modified concurrently, retry the request.",
+    )
@@ -1,25 +1,29 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
-import requests
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.api.JWTBearer import JWKS, JWTBearer, JWTAuthorizationCredentials
+from src.api.JWTBearer import JWKSProvider, JWTBearer, JWTAuthorizationCredentials
 from src.core.settings import settings
+from src.orm.async_session import AsyncSessionLocal
 from src.orm.models import User
 from src.orm.session import SessionLocal
-from src.services.crud.user_crud import UserCrud
+from src.services.crud.user_crud import AsyncUserCrud
 
 # Comment out or remove if you have API Gateway custom authorizer set up.
-jwks = JWKS.parse_obj(
-    requests.get(
+# Keys are fetched on first use and cached, set `jwks.path` to load them from a local file instead.
+if settings.jwks.path:
+    jwks = JWKSProvider(path=settings.jwks.path)
+else:
+    jwks = JWKSProvider(
         f"https://cognito-idp.{settings.aws_region}.amazonaws.com/"
-        f"{settings.cognito_user_pool_id}/.well-known/jwks.json"
-    ).json()
-)
+        f"{settings.cognito_user_pool_id}/.well-known/jwks.json",
+        ttl=settings.jwks.ttl,
+        refresh_ahead=settings.jwks.refresh_ahead,
+    )
 
 # For APIG custom authorizer, either remove `jwks` arg or make sure it is set to None`.
-auth = JWTBearer(jwks)
+auth = JWTBearer(jwks, verify_in=settings.jwks.verify_in, verify_workers=settings.jwks.verify_workers)
 
 
 def get_db() -> Generator:
@@ -30,7 +34,13 @@ def get_db() -> Generator:
         db.close()
 
 
-def get_current_user(db: Session = Depends(get_db), credentials: JWTAuthorizationCredentials = Depends(auth)) -> User:
+async def get_async_db() -> AsyncGenerator:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_current_user(db: AsyncSession = Depends(get_async_db),
+                           credentials: JWTAuthorizationCredentials = Depends(auth)) -> User:
     try:
         sub = credentials.claims["sub"]
     except KeyError:
@@ -39,19 +49,19 @@ def get_current_user(db: Session = Depends(get_db), credentials: JWTAuthorizatio
             detail="Could not validate credentials",
         )
 
-    user = UserCrud(db).get_by_sub(sub=sub)
+    user = await AsyncUserCrud(db).get_by_sub_cached(sub=sub)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return user
 
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     if not current_user.is_active:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
     return current_user
 
 
-def get_current_active_superuser(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_superuser(current_user: User = Depends(get_current_user)) -> User:
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="The user doesn't have enough privileges"
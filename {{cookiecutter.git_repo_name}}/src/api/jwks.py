@@ -0,0 +1,163 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+from jose import jwk
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+JWK = Dict[str, str]
+
+
+class JWKS(BaseModel):
+    keys: List[JWK]
+
+
+class JWKSProvider:
+    """Lazily loaded, cached JSON Web Key Set, looked up by `kid`.
+
+    Nothing is fetched until the first token needs a key. Keys are cached for `ttl` seconds and
+    refreshed in a background thread once they are older than `ttl - refresh_ahead`, so requests keep
+    using the current keys while the new set loads. A token with an unknown `kid` triggers one re-fetch
+    to pick up rotated keys. Fetches are single-flight (concurrent callers share one) and at most one
+    is attempted every `min_refetch_interval` seconds, so garbage `kid`s or an unavailable endpoint
+    can't cause a fetch storm. If a fetch fails the previous keys are kept.
+
+    Keys are loaded from exactly one of:
+
+    * `url`: fetched with `http.get(url, timeout=...)`. `http` defaults to `requests` but can be any
+      object with the same interface, e.g. a fake for tests.
+    * `path`: a local JSON file, e.g. for offline development.
+    * `jwks`: a static key set that is never refreshed.
+    """
+
+    def __init__(self, url: str = None, *, path: str = None, jwks: JWKS = None, http: Any = requests,
+                 ttl: int = 3600, refresh_ahead: int = 300, min_refetch_interval: int = 30,
+                 timeout: float = 5):
+        if sum(source is not None for source in (url, path, jwks)) != 1:
+            raise ValueError("Exactly one of url, path or jwks must be provided")
+
+        self.url = url
+        self.path = path
+        self.http = http
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+
+        self._keys: Dict[str, JWK] = {}
+        self._public_keys: Dict[str, Any] = {}
+        self._loaded_at: Optional[float] = None
+        self._last_fetch_at: Optional[float] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._background_lock = threading.Lock()
+
+        if jwks is not None:
+            self._set_keys(jwks)
+
+    @property
+    def is_static(self) -> bool:
+        return self.url is None and self.path is None
+
+    @property
+    def keys(self) -> Dict[str, JWK]:
+        return dict(self._keys)
+
+    def get_key(self, kid: Optional[str]) -> Optional[JWK]:
+        """Return the key for `kid`, fetching the key set first if it is missing, expired or lacks `kid`."""
+        generation = self._generation
+
+        if self.needs_fetch(kid):
+            self._refresh(generation)
+        elif self._is_due_for_refresh():
+            self._refresh_in_background()
+
+        return self._keys.get(kid)
+
+    def get_public_key(self, kid: Optional[str]) -> Optional[Any]:
+        """Return the constructed public key for `kid`, built once per key rather than per request."""
+        key = self.get_key(kid)
+        if key is None:
+            return None
+
+        public_key = self._public_keys.get(kid)
+        if public_key is None:
+            public_key = jwk.construct(key)
+            self._public_keys[kid] = public_key
+        return public_key
+
+    async def prefetch(self, kid: Optional[str]):
+        """Run any blocking fetch needed for `kid` in the threadpool instead of on the event loop."""
+        if self.needs_fetch(kid):
+            await run_in_threadpool(self.get_key, kid)
+
+    def needs_fetch(self, kid: Optional[str]) -> bool:
+        if self.is_static:
+            return False
+        if self._last_fetch_at is None:
+            return True
+        if kid not in self._keys and self._lock.locked():
+            return True  # Wait for the fetch in flight, it may bring this key
+
+        now = time.monotonic()
+        if now - self._last_fetch_at < self.min_refetch_interval:
+            return False
+        return self._loaded_at is None or now - self._loaded_at >= self.ttl or kid not in self._keys
+
+    def refresh(self):
+        """Force a blocking re-fetch of the key set."""
+        self._refresh(self._generation)
+
+    def _is_due_for_refresh(self) -> bool:
+        if self.is_static or self._loaded_at is None:
+            return False
+
+        now = time.monotonic()
+        return (now - self._loaded_at >= self.ttl - self.refresh_ahead
+                and now - self._last_fetch_at >= self.min_refetch_interval)
+
+    def _refresh_in_background(self):
+        if not self._background_lock.acquire(blocking=False):
+            return  # A background refresh is already running
+
+        def _run():
+            try:
+                self._refresh(self._generation)
+            finally:
+                self._background_lock.release()
+
+        threading.Thread(target=_run, name="jwks-refresh", daemon=True).start()
+
+    def _refresh(self, generation: int):
+        with self._lock:
+            if self._generation != generation:
+                return  # Another caller refreshed the keys while we waited for the lock
+
+            self._last_fetch_at = time.monotonic()
+            try:
+                self._set_keys(self._fetch())
+            except Exception:
+                # Best effort, keep serving the previous keys (if any) until the next attempt.
+                logger.exception("Could not load JWKS")
+                self._generation += 1
+
+    def _fetch(self) -> JWKS:
+        if self.path:
+            with open(self.path, "r") as f:
+                return JWKS.parse_obj(json.load(f))
+
+        response = self.http.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return JWKS.parse_obj(response.json())
+
+    def _set_keys(self, jwks: JWKS):
+        self._keys = {key["kid"]: key for key in jwks.keys}
+        self._public_keys = {}
+        self._loaded_at = time.monotonic()
+        self._generation += 1
@@ -0,0 +1,99 @@
+from collections.abc import Mapping
+from datetime import date, datetime, time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+from uuid import UUID
+
+import orjson
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON, ModelField
+from pydantic.utils import lenient_issubclass
+from starlette.responses import Response
+
+# Field types written as they are, orjson encodes them the same way as FastAPI's JSONResponse
+PASSTHROUGH_TYPES = (str, int, float, bool)
+
+
+class OrmSerializer:
+    """Serializes trusted ORM objects straight to JSON bytes in the shape of a response schema.
+
+    With `response_model`, FastAPI validates every returned ORM object into the schema and then runs
+    `jsonable_encoder` over the result. For rows loaded from our own database that work only costs CPU, so
+    an endpoint can opt in to returning `serializer.response(obj)` instead: each field is read from the
+    object and converted by a function chosen once per schema, then the whole body is encoded with orjson.
+    The output is the same as the `response_model` path, keep `response_model` on the route for the docs.
+
+    Objects are not validated, so only use this for data that already satisfies the schema.
+    """
+
+    def __init__(self, schema: Type[BaseModel]):
+        self.schema = schema
+        self.fields: List[Tuple[str, str, Optional[Callable]]] = [
+            (field.alias, field.name, self._converter(field)) for field in schema.__fields__.values()
+        ]
+
+    def to_dict(self, obj: Any) -> Dict[str, Any]:
+        # Dicts, and mappings such as the `_mapping` of a Core row
+        get = obj.get if isinstance(obj, Mapping) else obj.__getattribute__
+        data = {}
+        for alias, name, convert in self.fields:
+            value = get(name)
+            data[alias] = convert(value) if convert is not None and value is not None else value
+        return data
+
+    def dumps(self, obj: Any) -> bytes:
+        """Serialize an object or a list of objects."""
+        if isinstance(obj, (list, tuple)):
+            return orjson.dumps([self.to_dict(item) for item in obj])
+        return orjson.dumps(self.to_dict(obj))
+
+    def response(self, obj: Any, status_code: int = 200) -> Response:
+        return Response(self.dumps(obj), status_code=status_code, media_type="application/json")
+
+    @staticmethod
+    def _converter(field: ModelField) -> Optional[Callable]:
+        type_ = field.type_
+        if lenient_issubclass(type_, BaseModel):
+            convert = get_serializer(type_).to_dict
+        elif lenient_issubclass(type_, UUID):
+            # Validation normalizes the string stored in the database
+            convert = _uuid_to_str
+        elif lenient_issubclass(type_, (datetime, date, time)):
+            convert = _isoformat
+        elif lenient_issubclass(type_, Enum):
+            convert = _enum_value
+        elif lenient_issubclass(type_, PASSTHROUGH_TYPES):
+            convert = None
+        else:
+            raise TypeError(f"Cannot serialize field {field.name} of type {type_} without validation")
+
+        if field.shape == SHAPE_SINGLETON:
+            return convert
+        if field.shape == SHAPE_LIST:
+            if convert is None:
+                return list
+            return lambda values: [convert(value) if value is not None else value for value in values]
+        raise TypeError(f"Cannot serialize field {field.name} with shape {field.shape} without validation")
+
+
+def _uuid_to_str(value: Any) -> str:
+    return str(value if isinstance(value, UUID) else UUID(str(value)))
+
+
+def _isoformat(value: Any) -> str:
+    return value.isoformat()
+
+
+def _enum_value(value: Enum) -> Any:
+    return value.value
+
+
+_serializers: Dict[Type[BaseModel], OrmSerializer] = {}
+
+
+def get_serializer(schema: Type[BaseModel]) -> OrmSerializer:
+    """Return the serializer for `schema`, built on first use."""
+    serializer = _serializers.get(schema)
+    if serializer is None:
+        serializer = _serializers[schema] = OrmSerializer(schema)
+    return serializer
@@ -1,2 +1,2 @@
 from .logging import init_logging
-from .settings import Settings, settings
+from .settings import FrozenSettings, Settings, compile_settings, settings
@@ -1,12 +1,42 @@
+import atexit
+import copy
 import logging.config
 import os
-from typing import Optional, Dict
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue, SimpleQueue
+from typing import Dict, Optional, Union
+
+import orjson
+
+# Where logging looks up the caller (file, line and function) of each record, see `init_logging(caller=...)`
+_SRCFILE = logging._srcfile
+
+_listener: Optional[QueueListener] = None
+_exception_formatter = logging.Formatter()
 
 
 def init_logging(*, env: str = os.getenv("PROJECT_ENV", "local"), root_level: Optional[str] = os.getenv("ROOT_LOG_LEVEL"),
                  disable_existing_loggers: bool = False, loggers: Optional[Dict[str, str]] = None,
-                 is_lambda: bool = False):
-    config = LOGGING_CONFIG
+                 is_lambda: bool = False, log_format: str = "text", caller: bool = True, queue: bool = False,
+                 queue_size: int = 10000, rate_limits: Optional[Dict[str, float]] = None,
+                 sample_rates: Optional[Dict[str, float]] = None):
+    """
+    Configure logging to stdout.
+
+    `log_format` is "text" or "json" (one object per line, see `JsonFormatter`). With `caller=False`, records
+    skip the stack walk that finds the file, line and function of the log call, and formats leave them out.
+    With `queue=True`, log calls only put the record on a queue of `queue_size` records (0 for unbounded), and a
+    background thread writes them out, so a slow stdout never blocks the caller. Records are dropped if the
+    queue is full. `rate_limits` and `sample_rates` map logger names to the records per second they may emit,
+    or the fraction of records they emit, for loggers on hot paths. A name covers its child loggers too, e.g.
+    "sqlalchemy.engine" covers "sqlalchemy.engine.Engine". Warnings and errors are never dropped.
+    """
+    config = copy.deepcopy(LOGGING_CONFIG)
     config["disable_existing_loggers"] = disable_existing_loggers
 
     if root_level and root_level in LEVELS:
@@ -32,11 +62,184 @@ def init_logging(*, env: str = os.getenv("PROJECT_ENV", "local"), root_level: Op
                 'propagate': False
             }
 
+    if log_format == "json":
+        config["formatters"]["json"]["caller"] = caller
+        config["handlers"]["default"]["formatter"] = "json"
+    elif log_format == "text":
+        config["handlers"]["default"]["formatter"] = "standard" if caller else "no_caller"
+    else:
+        raise Exception(f"Invalid log format: {log_format}")
+
+    for module, rate in (rate_limits or {}).items():
+        _add_filter(config, f"rate_limit:{module}", {'()': RateLimitFilter, 'rate': rate, 'name': module})
+    for module, rate in (sample_rates or {}).items():
+        _add_filter(config, f"sample:{module}", {'()': SamplingFilter, 'rate': rate, 'name': module})
+
     if is_lambda and env != "local":
         # Lambda runtime controls logging and sets handler, so we only need to set level.
         logging.getLogger().setLevel(log_level)
-    else:
-        logging.config.dictConfig(config)
+        return
+
+    # Write out anything queued by a previous configuration before replacing its handlers
+    stop_logging()
+    logging._srcfile = _SRCFILE if caller else None
+    logging.config.dictConfig(config)
+    if queue:
+        _start_queue_listener(config["loggers"], queue_size)
+
+
+def stop_logging():
+    """Stop the queue listener, if any, once every queued record is written. Called at exit."""
+    global _listener
+    if _listener is None:
+        return
+    try:
+        _listener.stop()
+    except Full:
+        # The listener is stuck on a blocked stream, leave its daemon thread to write what it can
+        print(f"Logging queue still full after {_listener.stop_timeout}s, not waiting for it", file=sys.stderr)
+    finally:
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def _add_filter(config: dict, name: str, filter_config: dict):
+    # On the handlers rather than the logger: logger filters only see records logged on that exact logger,
+    # not those propagated from its children
+    config["filters"][name] = filter_config
+    for handler_config in config["handlers"].values():
+        handler_config.setdefault("filters", []).append(name)
+
+
+def _start_queue_listener(logger_names, queue_size: int):
+    global _listener
+    loggers = [logging.getLogger(name) for name in logger_names]
+    # The configured loggers share the handlers, so each is listened to once
+    handlers = list(dict.fromkeys(handler for logger in loggers for handler in logger.handlers))
+    queue_handler = DroppingQueueHandler(Queue(queue_size) if queue_size else SimpleQueue())
+    # Rate limits and sampling run before records are queued, so the records they drop don't take queue slots
+    # from warnings and errors
+    for handler in handlers:
+        for log_filter in handler.filters[:]:
+            if log_filter not in queue_handler.filters:
+                queue_handler.addFilter(log_filter)
+            handler.removeFilter(log_filter)
+    for logger in loggers:
+        if logger.handlers:
+            for handler in logger.handlers[:]:
+                logger.removeHandler(handler)
+            logger.addHandler(queue_handler)
+
+    _listener = DrainingQueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records, rather than blocking or raising, when the queue is full."""
+
+    def __init__(self, queue: Union[Queue, SimpleQueue]):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments (which may be mutated once the call returns) and render the traceback on
+        # the caller's thread, the formatting is left to the listener. The base class formats a copy of the
+        # record, but this handler is the only one of the loggers it's attached to, so it's updated in place.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """
+    QueueListener whose `stop` waits up to `stop_timeout` seconds for room for its stop sentinel in a full
+    bounded queue, while the thread drains it, instead of raising `Full` straight away.
+    """
+
+    stop_timeout = 10
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=self.stop_timeout)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with the caller only if `caller` is set."""
+
+    def __init__(self, caller: bool = False):
+        super().__init__()
+        self.caller = caller
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if self.caller:
+            entry["caller"] = f"{record.filename}:{record.lineno}|{record.funcName}()"
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through `rate` records per second on average, in bursts of up to `burst`, below WARNING. Only records
+    of the logger `name` and its children are limited, others always pass.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, name: str = ""):
+        super().__init__(name)
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.dropped = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not super().filter(record):
+            return True
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.dropped += 1
+            return False
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through a random `rate` fraction of the records below WARNING of the logger `name` and its children,
+    and all records of other loggers.
+    """
+
+    def __init__(self, rate: float, name: str = ""):
+        super().__init__(name)
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or not super().filter(record) or random.random() < self.rate
 
 
 LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
@@ -49,7 +252,14 @@ LOGGING_CONFIG = {
         'standard': {
             'format': '%(asctime)-15s|%(levelname)s|%(name)s|%(filename)s:%(lineno)s|%(funcName)s()|%(message)s'
         },
+        'no_caller': {
+            'format': '%(asctime)-15s|%(levelname)s|%(name)s|%(message)s'
+        },
+        'json': {
+            '()': JsonFormatter,
+        },
     },
+    'filters': {},
     'handlers': {
         'default': {
             'formatter': 'standard',
@@ -1,5 +1,17 @@
 import argparse
+import functools
+import json
 import logging.config
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Type
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
 
 from src.core.settings import Settings
 from src.core.slack_connector import SlackConnector
@@ -7,13 +19,167 @@ from src.core.slack_connector import SlackConnector
 logger = logging.getLogger(__name__)
 
 
+class Chunk(NamedTuple):
+    """A range of keys, `start` <= key < `end`. `end` is None for the last chunk of `key_ranges`."""
+    index: int
+    start: Any
+    end: Any
+
+
+def id_ranges(min_id: int, max_id: int, chunk_size: int) -> List[Chunk]:
+    """Split the ids from `min_id` to `max_id` (inclusive) into ranges of `chunk_size` ids."""
+    if min_id is None or max_id is None:
+        return []
+    return [
+        Chunk(index, start, min(start + chunk_size, max_id + 1))
+        for index, start in enumerate(range(min_id, max_id + 1, chunk_size))
+    ]
+
+
+def key_ranges(session: Session, column: Any, chunk_size: int, *criteria: Any) -> List[Chunk]:
+    """
+    Split the rows matching `criteria` into ranges of `chunk_size` rows by `column`, which must be unique (e.g. a
+    primary key). Unlike `id_ranges`, chunks are even when ids are sparse, and the key needn't be an integer.
+    Each boundary is found with an index range scan of `chunk_size` rows.
+    """
+    start = session.execute(select(func.min(column)).where(*criteria)).scalar()
+    chunks = []
+    while start is not None:
+        end = session.execute(
+            select(column).where(column >= start, *criteria).order_by(column).offset(chunk_size).limit(1)
+        ).scalar()
+        chunks.append(Chunk(len(chunks), start, end))
+        start = end
+    return chunks
+
+
+class Checkpoint:
+    """
+    The chunks a run has finished, saved to a JSON file at `path` after each one, so a failed run can be
+    restarted and skip them. Chunks are identified by their range, so if the table grew in between only the
+    last chunk, whose range changed, is processed again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def key(chunk: Chunk) -> str:
+        return json.dumps([chunk.start, chunk.end], default=str)
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.done = set(json.load(f)["done"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {e!r}")
+
+    def is_done(self, chunk: Chunk) -> bool:
+        return self.key(chunk) in self.done
+
+    def mark_done(self, chunk: Chunk):
+        with self._lock:
+            self.done.add(self.key(chunk))
+            # Write and rename, so a crash mid-write leaves the previous checkpoint intact
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"done": sorted(self.done)}, f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = set()
+
+
+class Progress:
+    """
+    Counts finished chunks and rows, and logs progress, throughput and ETA every `interval` seconds. Pass
+    `chunks=None` when the number of chunks isn't known up front, progress is then logged without an ETA.
+    """
+
+    def __init__(self, chunks: Optional[int], skipped: int = 0, interval: float = 10):
+        self.chunks = chunks
+        self.skipped = skipped
+        self.interval = interval
+        self.done = 0
+        self.rows = 0
+        self.start = time.monotonic()
+        self._logged = self.start
+
+    def update(self, rows: int):
+        self.done += 1
+        self.rows += rows
+        now = time.monotonic()
+        if now - self._logged >= self.interval or self.done == self.chunks:
+            self._logged = now
+            elapsed = now - self.start
+            rate = f"{self.rows} rows, {self.rows / elapsed if elapsed else 0:.0f} rows/s"
+            if self.chunks is None:
+                logger.info(f"{self.done} chunks done, {rate}")
+                return
+            eta = elapsed / self.done * (self.chunks - self.done)
+            logger.info(f"{self.done}/{self.chunks} chunks done ({self.done / self.chunks:.0%}), {rate}, ETA {eta:.0f}s")
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.start
+        return {
+            "chunks": self.done,
+            "skipped_chunks": self.skipped,
+            "rows": self.rows,
+            "seconds": round(elapsed, 3),
+            "rows_per_s": round(self.rows / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+def default_session() -> Session:
+    from src.orm.session import SessionLocal
+
+    return SessionLocal()
+
+
+def _run_chunk(session: Session, process_chunk: Callable[[Session, Chunk], Optional[int]], chunk: Chunk) -> int:
+    try:
+        rows = process_chunk(session, chunk)
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        # Keep the worker's session, but not the objects it loaded
+        session.close()
+    return rows or 0
+
+
+# The session of a worker process, see `_init_process_worker`
+_process_session: Optional[Session] = None
+
+
+def _init_process_worker(session_factory: Callable[[], Session]):
+    global _process_session
+    _process_session = session_factory()
+
+
+def _run_chunk_in_process(process_chunk: Callable[[Session, Chunk], Optional[int]], chunk: Chunk) -> int:
+    return _run_chunk(_process_session, process_chunk, chunk)
+
+
 class Script:
-    def __init__(self, args=None):
+    # Seconds between progress logs of `run_chunks`
+    progress_interval = 10
+
+    def __init__(self, args=None, session_factory: Callable[[], Session] = default_session):
         self.parser = argparse.ArgumentParser()
         self._configure_args()
         self.args = self.parser.parse_args(args or [])
         self.settings = Settings(self.args.config) if getattr(self.args, "config", None) else None
         self.slack_connector = SlackConnector(self.settings)
+        self.session_factory = session_factory
 
     def __call__(self, *args, **kwargs):
         try:
@@ -22,11 +188,20 @@ class Script:
             msg = f"Generic error caught running Script. Update code to catch this further down. {e}"
             logger.exception(msg)
             self.slack_connector.send_slack_alert(msg)
+        finally:
+            # Alerts are sent in the background, make sure they go out before the script exits
+            self.slack_connector.close()
 
     def _configure_args(self):
         self.parser.add_argument(
             "--config", "-c", help="A .ini config file.", required=True, default=None
         )
+        self.parser.add_argument("--workers", type=int, default=1, help="Chunks processed in parallel.")
+        self.parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                                 help="Run chunks in threads, or in processes for CPU bound work.")
+        self.parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per chunk.")
+        self.parser.add_argument("--checkpoint", help="File recording finished chunks, to resume a failed run.")
+        self.parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over.")
         self.add_args()
 
     def add_args(self):
@@ -35,3 +210,148 @@ class Script:
 
     def run(self):
         pass
+
+    def run_chunks(self, process_chunk: Callable[[Session, Chunk], Optional[int]],
+                   chunks: List[Chunk]) -> Dict[str, Any]:
+        """
+        Run `process_chunk(session, chunk)` for each chunk, e.g. from `id_ranges` or `key_ranges`, on
+        `--workers` threads or processes (`--executor`), and return the number of rows and rows/s. The
+        function returns the number of rows it processed. Each worker has its own session, and the session
+        is committed after each chunk, or rolled back if the chunk fails.
+
+        With `--checkpoint`, finished chunks are recorded in that file and skipped when the script is run
+        again, until a run finishes every chunk and the file is removed. After a chunk fails, the chunks not
+        yet started are cancelled, and an exception is raised once the running ones finish.
+
+        With `--executor process`, workers are started with "spawn", so `process_chunk` must be a module-level
+        function and the script's `session_factory` must be picklable too.
+        """
+        checkpoint = Checkpoint(self.args.checkpoint) if self.args.checkpoint else None
+        if checkpoint and self.args.restart:
+            checkpoint.remove()
+        todo = [chunk for chunk in chunks if not (checkpoint and checkpoint.is_done(chunk))]
+        if len(todo) < len(chunks):
+            logger.info(f"Resuming from {self.args.checkpoint}, {len(chunks) - len(todo)} chunks already done")
+        progress = Progress(len(todo), skipped=len(chunks) - len(todo), interval=self.progress_interval)
+
+        sessions = []
+        if self.args.executor == "process":
+            pool = ProcessPoolExecutor(
+                self.args.workers, mp_context=get_context("spawn"),
+                initializer=_init_process_worker, initargs=(self.session_factory,),
+            )
+            run = functools.partial(_run_chunk_in_process, process_chunk)
+        else:
+            pool = ThreadPoolExecutor(self.args.workers, thread_name_prefix=type(self).__name__)
+            local = threading.local()
+            # Set by the first failure, so workers don't start chunks that are about to be cancelled
+            stopping = threading.Event()
+
+            def run(chunk: Chunk) -> int:
+                if stopping.is_set():
+                    raise CancelledError()
+                if not hasattr(local, "session"):
+                    local.session = self.session_factory()
+                    sessions.append(local.session)
+                try:
+                    return _run_chunk(local.session, process_chunk, chunk)
+                except BaseException:
+                    stopping.set()
+                    raise
+
+        failed = []
+        try:
+            with pool:
+                futures: Dict[Future, Chunk] = {pool.submit(run, chunk): chunk for chunk in todo}
+                for future in as_completed(futures):
+                    chunk = futures[future]
+                    try:
+                        rows = future.result()
+                    except CancelledError:
+                        continue
+                    except Exception:
+                        logger.exception(f"Chunk {chunk.index} ({chunk.start} to {chunk.end}) failed")
+                        failed.append(chunk)
+                        for pending in futures:
+                            pending.cancel()
+                        continue
+
+                    if checkpoint:
+                        checkpoint.mark_done(chunk)
+                    progress.update(rows)
+        finally:
+            for session in sessions:
+                session.close()
+
+        if failed:
+            raise Exception(
+                f"{len(failed)} chunks failed, {progress.done} of {len(todo)} done."
+                + (f" Run again to resume from {self.args.checkpoint}." if checkpoint else "")
+            )
+        if checkpoint:
+            checkpoint.remove()
+
+        summary = progress.summary()
+        logger.info(f"Processed {summary['rows']} rows in {summary['seconds']}s, {summary['rows_per_s']} rows/s")
+        return summary
+
+    def run_incremental(self, job: str, model: Type[Any],
+                        process_batch: Callable[[Session, List[Any]], Optional[int]],
+                        batch_size: Optional[int] = None, settle_seconds: float = 60) -> Dict[str, Any]:
+        """
+        Run `process_batch(session, rows)` over the rows of `model` changed since the job's last run, rather
+        than the whole table, and return the number of rows and rows/s.
+
+        The job's high-water mark is the `(modified, id)` of the last row it processed, kept in the
+        `job_watermark` table. Changed rows, soft deleted ones included, are read after the mark in batches of
+        `batch_size` (default `--chunk-size`) rows, in `(modified, id)` order (see
+        `BaseCrud.get_changed_since`). The mark is advanced in the same transaction as each batch, so a batch
+        is committed together with its new mark or not at all, and a failed run resumes after the last
+        committed batch.
+
+        `modified` is set by the writer's clock when it flushes, so a transaction that commits late can make
+        rows appear behind the mark. Rows modified in the last `settle_seconds` are left for the next run to
+        give those transactions time to commit. Rows `process_batch` changes in `model` itself get a new
+        `modified` and are processed again on the next run.
+        """
+        from src.services.crud.base_crud import BaseCrud
+        from src.services.crud.watermark_crud import WatermarkCrud
+
+        batch_size = batch_size or self.args.chunk_size
+        until = datetime.utcnow() - timedelta(seconds=settle_seconds)
+        progress = Progress(None, interval=self.progress_interval)
+        session = self.session_factory()
+        crud = BaseCrud(model, session)
+        watermarks = WatermarkCrud(session)
+        try:
+            watermark = watermarks.get_or_create(job=job)
+            logger.info(f"Processing {model.__tablename__} rows of {job} changed after "
+                        f"({watermark.last_modified}, {watermark.last_id})")
+            while True:
+                rows = crud.get_changed_since(
+                    modified=watermark.last_modified, id=watermark.last_id, until=until, limit=batch_size
+                )
+                if not rows:
+                    break
+
+                # Read before processing, which may change the rows
+                last_modified, last_id = rows[-1].modified, rows[-1].id
+                try:
+                    processed = process_batch(session, rows)
+                    watermarks.advance(watermark=watermark, modified=last_modified, id=last_id)
+                    session.commit()
+                except BaseException:
+                    session.rollback()
+                    raise
+                progress.update(len(rows) if processed is None else processed)
+
+                if len(rows) < batch_size:
+                    break
+            # Commit the watermark of a new job with no changes yet
+            session.commit()
+        finally:
+            session.close()
+
+        summary = progress.summary()
+        logger.info(f"Processed {summary['rows']} rows in {summary['seconds']}s, {summary['rows_per_s']} rows/s")
+        return summary
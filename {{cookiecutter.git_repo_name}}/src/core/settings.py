@@ -1,8 +1,12 @@
 import boto3
+import hashlib
+import json
 import logging
 import os
 import re
-from typing import Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from botocore.exceptions import ClientError
 from box import Box
@@ -11,6 +15,61 @@ from tomlkit import parse, items
 
 logger = logging.getLogger(__name__)
 
+# Where a setting's value comes from, see `Settings._source_from_config`
+Source = Tuple[Any, ...]
+
+
+class SSMParameterCache:
+    """Local cache of resolved SSM parameters, so warm restarts can skip SSM.
+
+    The file is encrypted with Fernet using `key` (generate one with `Fernet.generate_key()`), and each
+    parameter is only used for `ttl` seconds after it was fetched.
+    """
+
+    def __init__(self, path: str, key: str, ttl: int = 900):
+        from cryptography.fernet import Fernet
+
+        self.path = path
+        self.ttl = ttl
+        self._fernet = Fernet(key)
+
+    def load(self) -> Dict[str, str]:
+        return {name: value for name, (value, fetched_at) in self._entries().items()}
+
+    def save(self, fetched: Dict[str, str]):
+        """Add freshly fetched parameters. Parameters already cached keep the time they were fetched at."""
+        entries = self._entries()
+        now = time.time()
+        entries.update({name: (value, now) for name, value in fetched.items()})
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._fernet.encrypt(json.dumps(entries).encode()))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # Best effort, the cache is only an optimization
+            logger.warning(f"Could not write SSM parameter cache {self.path}: {e!r}")
+
+    def _entries(self) -> Dict[str, Tuple[str, float]]:
+        """Cached `(value, fetched_at)` of the parameters fetched less than `ttl` seconds ago."""
+        from cryptography.fernet import InvalidToken
+
+        if not os.path.exists(self.path):
+            return {}
+
+        try:
+            with open(self.path, "rb") as f:
+                entries = json.loads(self._fernet.decrypt(f.read()))
+        except (InvalidToken, ValueError, OSError) as e:
+            logger.warning(f"Ignoring unreadable SSM parameter cache {self.path}: {e!r}")
+            return {}
+
+        now = time.time()
+        return {
+            name: (value, fetched_at) for name, (value, fetched_at) in entries.items() if now - fetched_at < self.ttl
+        }
+
 
 class Settings:
     """Settings class that can be accessed using either dict notation (settings.get('abc')) or
@@ -27,12 +86,34 @@ class Settings:
         items.Float: float,
     }
 
-    INTERNAL_ATTRS = ["_store", "_ssm", "env"]
+    INTERNAL_ATTRS = ["_store", "_ssm", "_ssm_cache", "_pending_ssm", "_sources", "_env_vars", "env"]
+
+    # Types that environment variable overrides of nested settings are cast to
+    CASTS = {"str": str, "bool": bool, "int": int, "float": float}
 
-    def __init__(self, config_filepath: str = None, env: str = os.getenv("PROJECT_ENV", "local")):
+    # Maximum number of names per SSM GetParameters call
+    SSM_BATCH_SIZE = 10
+    SSM_MAX_WORKERS = 8
+
+    def __init__(self, config_filepath: str = None, env: str = os.getenv("PROJECT_ENV", "local"),
+                 ssm_client: Any = None, ssm_cache: Optional[SSMParameterCache] = None):
         self._store = Box()
         self.env = env
-        self._ssm = boto3.client("ssm", region_name="us-east-1")
+        # Created on first use, so settings without `ssm:` values never create a boto3 client.
+        # Pass a stub client to resolve parameters offline.
+        self._ssm = ssm_client
+        self._pending_ssm: Dict[Tuple[Optional[str], str], str] = {}
+        # Every (parent, name, source) set by `load`, in order, so the same settings can be rebuilt from a
+        # snapshot without parsing the file. Sources name env vars and SSM parameters, never their values.
+        self._sources: List[Tuple[Optional[str], str, Optional[Source]]] = []
+        # Environment variables that were consulted (set or not) while loading
+        self._env_vars = set()
+
+        if ssm_cache is None and os.getenv("SSM_CACHE_PATH") and os.getenv("SSM_CACHE_KEY"):
+            ssm_cache = SSMParameterCache(
+                os.getenv("SSM_CACHE_PATH"), os.getenv("SSM_CACHE_KEY"), int(os.getenv("SSM_CACHE_TTL", 900))
+            )
+        self._ssm_cache = ssm_cache
 
         # Load from .env file if exists. Will set env variables for use in .ini files.
         load_dotenv(find_dotenv(usecwd=True), verbose=True)
@@ -57,50 +138,151 @@ class Settings:
                 for k, v in items.items():
                     self._set_value_from_config(k, v)
 
+        self._resolve_ssm_parameters()
+
+    def load_sources(self, sources: List[Tuple[Optional[str], str, Optional[Source]]]):
+        """Rebuild settings from the `sources` recorded by a previous `load`, without reading the file."""
+        self.clear()
+        for parent, name, source in sources:
+            self._set_from_source(name, tuple(source) if source else None, parent)
+
+        self._resolve_ssm_parameters()
+
+    @property
+    def sources(self) -> List[Tuple[Optional[str], str, Optional[Source]]]:
+        return list(self._sources)
+
+    @property
+    def env_vars(self) -> List[str]:
+        return sorted(self._env_vars)
+
+    def compile(self) -> "FrozenSettings":
+        """Immutable snapshot of the current settings, see `FrozenSettings`."""
+        return FrozenSettings({**self._store.to_dict(), "env": self.env})
+
     def clear(self):
         self._store = Box()
+        self._pending_ssm = {}
+        self._sources = []
+        self._env_vars = set()
 
     def _set_value_from_config(self, name: str, value: Any, parent: str = None):
-        if name.upper() in os.environ and not parent:
-            self.set_attr(name, os.getenv(name.upper()), parent)
-        elif parent and f"{parent.upper()}_{name.upper()}" in os.environ:
-            attr = os.getenv(f"{parent.upper()}_{name.upper()}")
-            try:
-                if type(value) in self.TOML_TO_BUILTIN_MAP:
-                    attr = self.TOML_TO_BUILTIN_MAP[type(value)](attr)
-                elif type(value) == bool:
-                    attr = attr.lower() == "true"
-                else:
-                    attr = type(value)(attr)
-            except TypeError:
-                logger.info(f"Could not cast setting {parent}.{name} with value {attr} to type {type(value)}")
-                pass
-            self.set_attr(name, attr, parent)
-        elif isinstance(value, dict):
+        overridden = (name.upper() in os.environ and not parent
+                      or parent and f"{parent.upper()}_{name.upper()}" in os.environ)
+        if isinstance(value, dict) and not overridden:
             for k, v in value.items():
                 self._set_value_from_config(k, v, name)
+            return
+
+        self._set_from_source(name, self._source_from_config(name, value, parent), parent)
+
+    def _source_from_config(self, name: str, value: Any, parent: str = None) -> Optional[Source]:
+        """
+        Where the value of a setting comes from: `("value", value)`, `("env", var_name, cast)` or
+        `("ssm", param_name)`. Returns None if the setting is unset, e.g. a `${VAR}` whose variable is missing.
+        """
+        if parent:
+            self._env_vars.add(f"{parent.upper()}_{name.upper()}")
+        else:
+            self._env_vars.add(name.upper())
+
+        if name.upper() in os.environ and not parent:
+            return "env", name.upper(), None
+        elif parent and f"{parent.upper()}_{name.upper()}" in os.environ:
+            builtin = self.TOML_TO_BUILTIN_MAP.get(type(value), type(value))
+            return "env", f"{parent.upper()}_{name.upper()}", builtin.__name__ if builtin in self.CASTS else None
         elif isinstance(value, int) or isinstance(value, float):
-            self.set_attr(name, value, parent)
+            return "value", self.TOML_TO_BUILTIN_MAP.get(type(value), type(value))(value)
         elif isinstance(value, str) and value.startswith("${") and value.endswith("}"):
             # Expecting environment variable with the value between ${}
             var_name = re.findall(r'\${(.*?)}', value)[0]
+            self._env_vars.add(var_name)
 
             if var_name in os.environ:
-                self.set_attr(name, os.getenv(var_name), parent)
+                return "env", var_name, None
+            return None
         elif isinstance(value, str) and value.startswith("ssm:"):
-            try:
-                param = self._ssm.get_parameter(
-                    Name=value.replace("ssm:", ""),
-                    WithDecryption=True
-                )
-
-                if param.get("Parameter"):
-                    self.set_attr(name, param["Parameter"]["Value"], parent)
-            except ClientError as e:
-                # Best effort to load parameter
-                logger.error(e)
+            return "ssm", value.replace("ssm:", "")
+        else:
+            if type(value) in self.TOML_TO_BUILTIN_MAP:
+                value = self.TOML_TO_BUILTIN_MAP[type(value)](value)
+            return "value", value
+
+    def _set_from_source(self, name: str, source: Optional[Source], parent: str = None):
+        self._sources.append((parent, name, source))
+        # A later table overrides any `ssm:` value collected for this setting
+        self._pending_ssm.pop((parent, name), None)
+        if source is None:
+            return
+
+        kind = source[0]
+        if kind == "env":
+            _, var_name, cast = source
+            self.set_attr(name, self._cast(os.getenv(var_name), cast, f"{parent}.{name}"), parent)
+        elif kind == "ssm":
+            # Resolved in batches once the whole file is read, see `_resolve_ssm_parameters`
+            self._pending_ssm[(parent, name)] = source[1]
         else:
-            self.set_attr(name, value, parent)
+            self.set_attr(name, source[1], parent)
+
+    @classmethod
+    def _cast(cls, value: str, cast: Optional[str], setting: str) -> Any:
+        if cast is None or value is None:
+            return value
+        if cast == "bool":
+            return value.lower() == "true"
+        try:
+            return cls.CASTS[cast](value)
+        except (TypeError, ValueError):
+            logger.info(f"Could not cast setting {setting} with value {value} to type {cast}")
+            return value
+
+    def _resolve_ssm_parameters(self):
+        if not self._pending_ssm:
+            return
+
+        names = sorted(set(self._pending_ssm.values()))
+        parameters = self._ssm_cache.load() if self._ssm_cache else {}
+        missing = [name for name in names if name not in parameters]
+
+        if missing:
+            fetched = self._get_ssm_parameters(missing)
+            parameters.update(fetched)
+            if self._ssm_cache and fetched:
+                self._ssm_cache.save(fetched)
+
+        for (parent, name), param_name in self._pending_ssm.items():
+            if param_name in parameters:
+                self.set_attr(name, parameters[param_name], parent)
+            else:
+                logger.error(f"Could not load SSM parameter {param_name} for setting {name}")
+        self._pending_ssm = {}
+
+    def _get_ssm_parameters(self, names: List[str]) -> Dict[str, str]:
+        """Fetch parameters with batched GetParameters calls, run concurrently when there is more than one batch."""
+        if self._ssm is None:
+            self._ssm = boto3.client("ssm", region_name="us-east-1")
+
+        batches = [names[i:i + self.SSM_BATCH_SIZE] for i in range(0, len(names), self.SSM_BATCH_SIZE)]
+        if len(batches) == 1:
+            results = [self._get_ssm_parameter_batch(batches[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(batches), self.SSM_MAX_WORKERS)) as executor:
+                results = list(executor.map(self._get_ssm_parameter_batch, batches))
+
+        return {name: value for result in results for name, value in result.items()}
+
+    def _get_ssm_parameter_batch(self, names: List[str]) -> Dict[str, str]:
+        try:
+            response = self._ssm.get_parameters(Names=names, WithDecryption=True)
+        except ClientError as e:
+            # Best effort to load parameters
+            logger.error(e)
+            return {}
+
+        if response.get("InvalidParameters"):
+            logger.error(f"Invalid SSM parameters: {response['InvalidParameters']}")
+        return {param["Name"]: param["Value"] for param in response.get("Parameters", [])}
 
     def set_attr(self, name: str, value: Any, parent: str = None):
         if type(value) in self.TOML_TO_BUILTIN_MAP:
@@ -170,5 +352,126 @@ class Settings:
         return self._store.values()
 
 
+class FrozenSettings:
+    """Immutable snapshot of Settings for one environment, built by `Settings.compile()`.
+
+    Values are stored as plain instance attributes, so `settings.database.pool_size` is two ordinary
+    attribute loads instead of a `__getattr__` call into a Box. Nested tables are FrozenSettings too.
+    Supports the same read access as Settings: dot notation, `settings['key']`, `get`, `in` and iteration.
+    """
+
+    def __init__(self, values: Dict[str, Any]):
+        for name, value in values.items():
+            object.__setattr__(self, name, FrozenSettings(value) if isinstance(value, dict) else value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Cannot set {name}, settings are read-only. Use a Settings instance instead.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Cannot delete {name}, settings are read-only.")
+
+    def __contains__(self, item):
+        """Respond to `item in settings`"""
+        return item.upper() in self.__dict__ or item.lower() in self.__dict__
+
+    def __getitem__(self, item):
+        """Allow getting variables as dict keys `settings['KEY']`"""
+        value = self.__dict__.get(item)
+        if value is None:
+            raise KeyError(f"{item} does not exist")
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.__dict__
+
+    def __repr__(self):
+        return f"FrozenSettings({', '.join(self.__dict__)})"
+
+    def get(self, item: str, default: Any = None) -> Any:
+        return self.__dict__.get(item, default)
+
+    def items(self):
+        return self.__dict__.items()
+
+    def keys(self):
+        return self.__dict__.keys()
+
+    def values(self):
+        return self.__dict__.values()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: v.to_dict() if isinstance(v, FrozenSettings) else v for k, v in self.__dict__.items()}
+
+
+# Bump when the snapshot format changes, so stale snapshots are ignored
+SNAPSHOT_VERSION = 1
+
+
+def compile_settings(config_filepath: str, env: str = os.getenv("PROJECT_ENV", "local"),
+                     cache_dir: Optional[str] = None, **kwargs) -> FrozenSettings:
+    """
+    Load and compile the settings for `env`, reusing an on-disk snapshot when nothing changed.
+
+    The snapshot records where each value comes from rather than the values themselves, so secrets from
+    environment variables and SSM are never written to disk: they're re-read on every start, SSM through
+    the usual batched calls and optional parameter cache. It's reused while the settings file has the same
+    mtime and size, and the same environment variables the settings refer to are set. Otherwise the file is
+    parsed and the snapshot rewritten.
+
+    Snapshots live in `cache_dir`, `$SETTINGS_CACHE_DIR`, or `.settings_cache` next to the settings file.
+    Set `SETTINGS_CACHE_DIR=""` to disable them. `kwargs` are passed on to `Settings`.
+    """
+    if cache_dir is None:
+        cache_dir = os.getenv(
+            "SETTINGS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(config_filepath)), ".settings_cache")
+        )
+
+    settings = Settings(env=env, **kwargs)
+    if not cache_dir or not os.path.exists(config_filepath):
+        settings.load(config_filepath)
+        return settings.compile()
+
+    path_hash = hashlib.sha256(os.path.abspath(config_filepath).encode()).hexdigest()[:16]
+    snapshot_path = os.path.join(cache_dir, f"{env}-{path_hash}.json")
+    stat = os.stat(config_filepath)
+    key = {"version": SNAPSHOT_VERSION, "env": env, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    snapshot = _read_snapshot(snapshot_path)
+    if (snapshot and all(snapshot.get(k) == v for k, v in key.items())
+            and snapshot["env_vars"] == {name: name in os.environ for name in snapshot["env_vars"]}):
+        settings.load_sources(snapshot["sources"])
+        return settings.compile()
+
+    settings.load(config_filepath)
+    _write_snapshot(snapshot_path, {
+        **key,
+        "env_vars": {name: name in os.environ for name in settings.env_vars},
+        "sources": settings.sources,
+    })
+    return settings.compile()
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path: str, snapshot: Dict[str, Any]):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        # Best effort, e.g. a read-only filesystem or values JSON can't represent
+        logger.warning(f"Could not write settings snapshot {path}: {e!r}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 # Global singleton object that can be imported anywhere
-settings = Settings(config_filepath="settings.toml")
+settings = compile_settings("settings.toml")
@@ -1,22 +1,256 @@
+import atexit
 import logging
+import threading
+import time
+from collections import OrderedDict
 from distutils.util import strtobool
-from typing import Dict, Any, List
+from queue import Empty, Full, Queue
+from typing import Any, Dict, List, Optional, Tuple
 
 from src.core.settings import Settings
 from slack import WebClient
 from slack.errors import SlackApiError
+from slack.web.slack_response import SlackResponse
 
 logger = logging.getLogger(__name__)
 
+# Slack renders at most 100 attachments per message
+MAX_ATTACHMENTS = 100
+
+# Queue markers asking the dispatcher thread to send what it has collected, or to send it and stop
+_FLUSH = object()
+_STOP = object()
+
+
+class SlackAlertDispatcher:
+    """Posts alerts to Slack from a background thread, so callers never wait on the Slack API.
+
+    `submit` only puts the alert on a queue of `max_queue` alerts, and drops it if the queue is full. The
+    thread collects alerts for `window` seconds after the first one arrives, then posts them per channel, in
+    as few messages as possible. Identical alerts within the window are sent once, with the number of times
+    they were raised. Posts that fail with a rate limit (429), a server error or a connection error are
+    retried up to `max_retries` times, after Slack's `Retry-After` when given and an exponential backoff from
+    `backoff` seconds otherwise. `flush` sends pending alerts right away, and `close` (also run at exit) sends
+    them and stops the thread.
+    """
+
+    def __init__(self, client: WebClient, window: float = 5, max_queue: int = 1000, max_retries: int = 5,
+                 backoff: float = 1, max_backoff: float = 60):
+        self.client = client
+        self.window = window
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: Queue = Queue(max_queue)
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._registered = False
+        self._lock = threading.Lock()
+
+    def submit(self, channel: str, attachment: Dict[str, Any]):
+        self._start()
+        with self._idle:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((channel, attachment))
+        except Full:
+            self._done(1)
+            self.dropped += 1
+            logger.warning("Slack alert queue is full, dropping alert.")
+
+    def flush(self, timeout: float = None) -> bool:
+        """Send the pending alerts now and wait up to `timeout` seconds for them. Returns whether all were sent."""
+        if self._thread is None:
+            return True
+        try:
+            self._queue.put(_FLUSH, timeout=timeout)
+        except Full:
+            return False
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout: float = None) -> bool:
+        """Send the pending alerts and stop the thread, waiting up to `timeout` seconds."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return True
+
+        start = time.monotonic()
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except Full:
+            logger.error(f"Could not send {self._pending} Slack alerts before shutting down.")
+            return False
+        thread.join(None if timeout is None else max(timeout - (time.monotonic() - start), 0))
+        if thread.is_alive():
+            logger.error(f"Could not send {self._pending} Slack alerts before shutting down.")
+            return False
+        return True
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slack-alerts", daemon=True)
+                self._thread.start()
+                if not self._registered:
+                    atexit.register(self.close)
+                    self._registered = True
+
+    def _done(self, count: int):
+        with self._idle:
+            self._pending -= count
+            self._idle.notify_all()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _FLUSH:
+                continue
+            if item is _STOP:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            stop = False
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except Empty:
+                    break
+                if item is _FLUSH:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._send(batch)
+            if stop:
+                return
+
+    def _send(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        try:
+            channels = coalesce(batch)
+            self.coalesced += len(batch) - sum(len(attachments) for attachments in channels.values())
+            for channel, attachments in channels.items():
+                for i in range(0, len(attachments), MAX_ATTACHMENTS):
+                    self._post(channel, attachments[i:i + MAX_ATTACHMENTS])
+        except Exception:
+            # Never let one batch stop the thread
+            logger.exception("Error sending slack alert.")
+        finally:
+            self._done(len(batch))
+
+    def _post(self, channel: str, attachments: List[Dict[str, Any]]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.client.chat_postMessage(channel=channel, attachments=attachments)
+                self.sent += len(attachments)
+                return
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt == self.max_retries:
+                    self.failed += len(attachments)
+                    logger.exception(f"Error sending {len(attachments)} slack alerts.")
+                    return
+                logger.warning(f"Error sending slack alert, retrying in {delay:.1f}s: {e!r}")
+                time.sleep(delay)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying after `error`, or None if retrying won't help."""
+        backoff = min(self.backoff * 2 ** attempt, self.max_backoff)
+        if not isinstance(error, SlackApiError):
+            # Connection errors and timeouts
+            return backoff
+
+        status_code = getattr(error.response, "status_code", None)
+        if status_code == 429:
+            headers = {k.lower(): v for k, v in (getattr(error.response, "headers", None) or {}).items()}
+            retry_after = headers.get("retry-after")
+            try:
+                return float(retry_after)
+            except (TypeError, ValueError):
+                return backoff
+        if status_code is not None and status_code >= 500:
+            return backoff
+        # e.g. invalid_auth or channel_not_found
+        return None
+
+
+def coalesce(batch: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Group attachments by channel, merging identical ones into one that says how many times it was raised."""
+    counts: "OrderedDict[Tuple[str, str, str], int]" = OrderedDict()
+    attachments = {}
+    for channel, attachment in batch:
+        key = (channel, attachment.get("pretext", ""), attachment.get("text", ""))
+        counts[key] = counts.get(key, 0) + 1
+        attachments.setdefault(key, attachment)
+
+    channels: Dict[str, List[Dict[str, Any]]] = {}
+    for key, count in counts.items():
+        attachment = attachments[key]
+        if count > 1:
+            attachment = {**attachment, "footer": f"Raised {count} times"}
+        channels.setdefault(key[0], []).append(attachment)
+    return channels
+
+
+class FakeWebClient:
+    """
+    Stand-in for `slack.WebClient` in tests and local runs: records the messages posted instead of sending
+    them. Pass `errors` to fail the next posts, e.g. `FakeWebClient(errors=[FakeWebClient.rate_limited(1)])`.
+    """
+
+    def __init__(self, errors: List[Exception] = None):
+        self.messages: List[Dict[str, Any]] = []
+        self.calls = 0
+        self.errors = list(errors or [])
+
+    def chat_postMessage(self, *, channel: str, **kwargs) -> SlackResponse:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        self.messages.append({"channel": channel, **kwargs})
+        return self._response({"ok": True, "channel": channel}, 200)
+
+    @classmethod
+    def rate_limited(cls, retry_after: float) -> SlackApiError:
+        return cls.error("ratelimited", 429, {"Retry-After": str(retry_after)})
+
+    @classmethod
+    def error(cls, error: str, status_code: int = 200, headers: Dict[str, str] = None) -> SlackApiError:
+        return SlackApiError(error, cls._response({"ok": False, "error": error}, status_code, headers))
+
+    @classmethod
+    def _response(cls, data: Dict[str, Any], status_code: int, headers: Dict[str, str] = None) -> SlackResponse:
+        return SlackResponse(client=cls, http_verb="POST", api_url="https://slack.com/api/chat.postMessage",
+                             req_args={}, data=data, headers=headers or {}, status_code=status_code)
+
 
 class SlackConnector:
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, client: Any = None):
         self.settings = settings
         self.environment = settings.environment
-        self.client = WebClient(token=self.settings.slack.api_token)
+        self.client = client or WebClient(token=self.settings.slack.get("api_token"))
+        self.dispatcher = SlackAlertDispatcher(
+            self.client,
+            window=self.settings.slack.get("window", 5),
+            max_queue=self.settings.slack.get("max_queue", 1000),
+            max_retries=self.settings.slack.get("max_retries", 5),
+        )
 
     def send_slack_alert(self, message: str, app_name: str = None, job_owner_id: str = None):
-        if not bool(strtobool(self.settings.slack.enabled)):
+        """Queue an alert to the default channel. It's sent in the background, see `SlackAlertDispatcher`."""
+        enabled = self.settings.slack.enabled
+        if not (enabled if isinstance(enabled, bool) else bool(strtobool(enabled))):
             logger.info("Trying to send message to Slack but it is not enabled.")
             return
 
@@ -31,19 +265,10 @@ class SlackConnector:
 
         # Send to default channel
         channel = self.settings.slack.channel_id
-        self._slack_post_message(channel, [attachment])
-
-    def _slack_post_message(self, channel: str, attachments: List[Dict[str, Any]],
-                            retry_count: int = 3):
-        retries = retry_count
+        self.dispatcher.submit(channel, attachment)
 
-        while retries > 0:
-            try:
-                self.client.chat_postMessage(channel=channel, attachments=attachments)
-                break
-            except SlackApiError as e:
-                retries -= 1
-                logger.exception("Error sending slack alert.")
+    def flush(self, timeout: float = None) -> bool:
+        return self.dispatcher.flush(timeout)
 
-                if retries == 0:
-                    raise e
+    def close(self, timeout: float = None) -> bool:
+        return self.dispatcher.close(self.settings.slack.get("shutdown_timeout", 10) if timeout is None else timeout)
@@ -1,12 +1,29 @@
+import logging
+import time
+from typing import Optional
+
 import uvicorn
 from fastapi import FastAPI
 from mangum import Mangum
+from starlette.datastructures import MutableHeaders
 from starlette.middleware.cors import CORSMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from src.api.api_v1.api import api_router
+from src.api.deps import auth
 from src.core import settings, init_logging
+from src.orm.instrumentation import QueryStats, current_query_stats
 
-init_logging(is_lambda=False, loggers=settings.logging)
+init_logging(
+    is_lambda=False,
+    loggers=settings.logging,
+    log_format=settings.log_output.format,
+    caller=settings.log_output.caller,
+    queue=settings.log_output.queue,
+    queue_size=settings.log_output.queue_size,
+    rate_limits=settings.get("log_rate_limits"),
+    sample_rates=settings.get("log_sampling"),
+)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -25,6 +42,69 @@ if settings.backend_cors_origins:
 
 app.include_router(api_router, prefix=settings.api_v1_str)
 
+
+class SQLInstrumentationMiddleware:
+    """
+    Count the queries each request runs and the time spent in them (see `src.orm.instrumentation`), add a
+    `Server-Timing` header and log them. A plain ASGI middleware rather than `@app.middleware("http")`,
+    which would run every request in an extra task.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True, repeated_query_threshold: int = 0):
+        self.app = app
+        self.server_timing = server_timing
+        self.repeated_query_threshold = repeated_query_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        start = time.perf_counter()
+        status_code = None
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", stats.server_timing(time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_query_stats.reset(token)
+            self.log(scope, status_code, stats, time.perf_counter() - start)
+
+    def log(self, scope: Scope, status_code: Optional[int], stats: QueryStats, elapsed: float):
+        if stats.count:
+            logger.info(
+                f"{scope['method']} {scope['path']} {status_code} queries={stats.count} "
+                f"db_ms={stats.total_time * 1000:.2f} total_ms={elapsed * 1000:.2f} "
+                f"slowest_ms={stats.slowest_time * 1000:.2f} slowest={stats.slowest_statement!r}"
+            )
+        if self.repeated_query_threshold:
+            for shape, count in stats.repeated(self.repeated_query_threshold):
+                logger.warning(f"Possible N+1 queries in {scope['method']} {scope['path']}: ran {count} times: {shape}")
+
+
+if settings.sql_instrumentation.enabled:
+    app.add_middleware(
+        SQLInstrumentationMiddleware,
+        server_timing=settings.sql_instrumentation.server_timing,
+        repeated_query_threshold=settings.sql_instrumentation.repeated_query_threshold,
+    )
+
+
+@app.on_event("shutdown")
+def shutdown():
+    auth.shutdown()
+
+
 # Uncomment to run inside AWS Lambda
 # handler = Mangum(app)
 
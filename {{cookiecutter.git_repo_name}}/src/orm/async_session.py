@@ -0,0 +1,36 @@
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.core import settings
+from src.orm.instrumentation import instrument_queries
+from src.orm.pool import InstrumentedAsyncAdaptedQueuePool, ping_idle_connections
+from src.orm.session import db_url, engine_options, slow_query_log
+
+# Async driver to use for each database backend
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "mysql": "aiomysql",
+    "postgresql": "asyncpg",
+}
+
+
+def to_async_url(url: str) -> URL:
+    """Swap the driver in a database URL for its async counterpart, e.g. mysql+pymysql -> mysql+aiomysql."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend: {backend}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+async_engine = create_async_engine(
+    to_async_url(db_url), **engine_options(db_url, poolclass=InstrumentedAsyncAdaptedQueuePool)
+)
+ping_idle_connections(async_engine.sync_engine, settings.database.ping_idle_seconds)
+instrument_queries(async_engine.sync_engine, slow_query_log)
+# Objects are not expired on commit so they can still be read (e.g. serialized) without lazy loading,
+# which an AsyncSession can't do implicitly.
+AsyncSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, class_=AsyncSession, bind=async_engine
+)
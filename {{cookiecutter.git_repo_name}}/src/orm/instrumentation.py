@@ -0,0 +1,80 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Collapse runs of bind parameters, e.g. the expanded list of an IN clause, so those statements share a shape
+_PARAMS_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with whitespace and bind parameter lists normalized, used to spot repeated queries."""
+    return _PARAMS_LIST.sub("(?)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class QueryStats:
+    """Queries run while handling one request: count, total DB time and the slowest statement."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.shapes: Counter = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.total_time += seconds
+        if seconds >= self.slowest_time:
+            self.slowest_time = seconds
+            self.slowest_statement = statement
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Statement shapes run more than `threshold` times, a sign of N+1 queries."""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+    def server_timing(self, app_time: float) -> str:
+        """`Server-Timing` header value, splitting the request time between the database and the app."""
+        db_ms = self.total_time * 1000
+        app_ms = max(app_time * 1000 - db_ms, 0)
+        return f'db;dur={db_ms:.2f};desc="{self.count} queries", app;dur={app_ms:.2f}'
+
+
+# Set for the duration of a request by the middleware in main.py. Tasks and threadpool calls made while
+# handling the request copy the context, and so record into the same object.
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+
+def instrument_queries(engine: Engine, slow_query_log: Any = None):
+    """
+    Record the duration of every statement the engine runs into the current request's QueryStats, and
+    pass slow statements to `slow_query_log` (a `src.orm.slow_query_log.SlowQueryLog`) if given.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_start_time = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "query_start_time", None)
+        if start is None:
+            return
+
+        elapsed = time.perf_counter() - start
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.record(statement, elapsed)
+        if slow_query_log is not None and slow_query_log.should_capture(elapsed):
+            streaming = bool(context.execution_options.get("stream_results"))
+            slow_query_log.capture(conn, statement, parameters, executemany, elapsed, streaming=streaming)
@@ -1,7 +1,7 @@
 import re
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, event
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Index, event
 from sqlalchemy.dialects import sqlite
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
@@ -23,6 +23,16 @@ class Base:
 
     __mapper_args__ = {"version_id_col": version}
 
+    # Serve the `deleted == False` filter and `(created, id)` ordering used by BaseCrud list queries, and the
+    # `(modified, id)` order of BaseCrud.get_changed_since. Models that define their own __table_args__
+    # should include these indexes too.
+    @declared_attr
+    def __table_args__(cls):
+        return (
+            Index(f"ix_{cls.__tablename__}_deleted_created_id", "deleted", "created", "id"),
+            Index(f"ix_{cls.__tablename__}_modified_id", "modified", "id"),
+        )
+
 
 # Callbacks for updates and inserts
 def entity_update_listener(mapper, connection, target):
@@ -52,3 +62,12 @@ class User(Base):
     email_enabled = Column(Boolean(), default=True)
     is_active = Column(Boolean(), default=True)
     is_superuser = Column(Boolean(), default=False)
+
+
+class JobWatermark(Base):
+    """How far a script has processed the rows changed in a table, see `Script.run_incremental`."""
+    id = Column(Integer, primary_key=True)
+    job = Column(String(64), unique=True, index=True, nullable=False)
+    # `(modified, id)` of the last row processed
+    last_modified = Column(DateTime)
+    last_id = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolStats:
+    """Checkout counters and a checkout latency histogram for a connection pool."""
+
+    # Upper bounds of the latency histogram buckets, in milliseconds. The last bucket is unbounded.
+    BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.pings = 0
+        self.ping_failures = 0
+        self.histogram = [0] * (len(self.BUCKETS_MS) + 1)
+        self._lock = threading.Lock()
+
+    def record_checkout(self, seconds: float, timed_out: bool = False):
+        milliseconds = seconds * 1000
+        bucket = next((i for i, bound in enumerate(self.BUCKETS_MS) if milliseconds <= bound), len(self.BUCKETS_MS))
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_time += seconds
+            self.max_wait_time = max(self.max_wait_time, seconds)
+            self.histogram[bucket] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        labels = [f"<={bound}ms" for bound in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_time_total_ms": round(self.wait_time * 1000, 3),
+            "wait_time_max_ms": round(self.max_wait_time * 1000, 3),
+            "pings": self.pings,
+            "ping_failures": self.ping_failures,
+            "checkout_latency": dict(zip(labels, self.histogram)),
+        }
+
+
+class InstrumentedPoolMixin:
+    """Times every checkout, including any wait for a free connection and liveness checks."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.record_checkout(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record_checkout(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # Keep the stats when the engine is disposed and the pool is recreated
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def status_dict(self) -> Dict[str, Any]:
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": self.overflow(),
+            **self.stats.as_dict(),
+        }
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def ping_idle_connections(engine: Engine, idle_seconds: float):
+    """
+    Check that a connection is alive before checkout only if it has been idle for at least `idle_seconds`.
+    Unlike `pool_pre_ping`, recently used connections skip the round trip. A failed check invalidates the
+    connection and the pool retries with a fresh one.
+    """
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.get("checked_in_at")
+        if checked_in_at is None or time.monotonic() - checked_in_at < idle_seconds:
+            return
+
+        stats = getattr(engine.pool, "stats", None)
+        if stats:
+            stats.pings += 1
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+        except Exception as e:
+            if stats:
+                stats.ping_failures += 1
+            raise exc.DisconnectionError() from e
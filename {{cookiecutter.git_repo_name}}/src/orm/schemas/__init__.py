@@ -1 +1,2 @@
+from .bulk import *
 from .user import *
@@ -0,0 +1,11 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+# Outcome of one item of a bulk create, update or delete
+class BulkResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    success: bool
+    detail: Optional[str] = None
@@ -1,5 +1,5 @@
 import pytz
-from typing import Optional
+from typing import List, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, EmailStr, validator
@@ -43,6 +43,11 @@ class UserUpdate(UserBase):
     pass
 
 
+# Properties to receive via API on bulk update
+class UserBulkUpdate(UserUpdate):
+    id: int
+
+
 class UserInDBBase(UserBase, DBBase):
     pass
 
@@ -50,3 +55,9 @@ class UserInDBBase(UserBase, DBBase):
 # Additional properties to return via API
 class User(UserInDBBase):
     sub: UUID
+
+
+# Page of users returned by cursor pagination
+class UserPage(BaseModel):
+    items: List[User]
+    next_cursor: Optional[str]
@@ -1,15 +1,63 @@
+import os
 import sys
+import tempfile
+from typing import Any, Dict, Optional
 
 import pymysql.converters
 import pendulum
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker
 
 from src.core import settings
+from src.orm.instrumentation import instrument_queries
+from src.orm.pool import InstrumentedQueuePool, ping_idle_connections
+from src.orm.slow_query_log import SlowQueryLog
 
 # Set converter for Pendulum date type.
 pymysql.converters.conversions[pendulum.DateTime] = pymysql.converters.escape_datetime
 
+
+def engine_options(url: Any, poolclass: type = InstrumentedQueuePool) -> Dict[str, Any]:
+    """Connection pool options from the `database` settings. SQLite keeps its default pool."""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.database.pool_size,
+        "max_overflow": settings.database.max_overflow,
+        "pool_recycle": settings.database.pool_recycle,
+        "pool_timeout": settings.database.pool_timeout,
+    }
+
+
+def pool_status(engine: Engine) -> Dict[str, Any]:
+    """Current checkouts, overflow and checkout latency stats of the engine's pool."""
+    if hasattr(engine.pool, "status_dict"):
+        return engine.pool.status_dict()
+    return {"status": engine.pool.status()}
+
+
+def create_slow_query_log() -> Optional[SlowQueryLog]:
+    """Slow query log from the `slow_query_log` settings, if enabled."""
+    options = settings.slow_query_log
+    if not options.enabled:
+        return None
+
+    return SlowQueryLog(
+        options.path or os.path.join(tempfile.gettempdir(), "slow_queries.log"),
+        threshold_ms=options.threshold_ms,
+        sample_rate=options.sample_rate,
+        explain=options.explain,
+        max_bytes=options.max_bytes,
+        backup_count=options.backup_count,
+    )
+
+
+slow_query_log = create_slow_query_log()
 db_url = "sqlite://" if "pytest" in sys.modules else settings.database_url
-engine = create_engine(db_url, pool_pre_ping=True)
+engine = create_engine(db_url, **engine_options(db_url))
+ping_idle_connections(engine, settings.database.ping_idle_seconds)
+instrument_queries(engine, slow_query_log)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,120 @@
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, List, Optional
+
+from src.core.cache import LRUCache
+from src.orm.instrumentation import statement_shape
+
+logger = logging.getLogger(__name__)
+
+# How to ask each dialect for a query plan without running the statement
+EXPLAIN_PREFIXES = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "mysql": "EXPLAIN ",
+    "postgresql": "EXPLAIN ",
+}
+
+# Quoted literals in plans, e.g. a Postgres filter on a bound value
+_QUOTED_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+def redact(parameters: Any, executemany: bool = False) -> Any:
+    """Replace bound values with their type, so the log never holds user data."""
+    if executemany:
+        return f"<{len(parameters)} rows>"
+    if isinstance(parameters, dict):
+        return {k: _redact_value(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_redact_value(v) for v in parameters]
+    return _redact_value(parameters)
+
+
+def _redact_value(value: Any) -> Optional[str]:
+    return None if value is None else f"<{type(value).__name__}>"
+
+
+def call_site() -> Optional[str]:
+    """The innermost app frame that ran the query, e.g. a BaseCrud method, skipping the ORM layer."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("src.") and not module.startswith("src.orm."):
+            return f"{module}:{frame.f_lineno} {frame.f_code.co_name}()"
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryLog:
+    """Captures queries slower than `threshold_ms` to a rotating JSON lines file at `path`.
+
+    Each entry has the statement, its redacted parameters, the call site and the dialect's EXPLAIN output.
+    Only a `sample_rate` fraction of slow queries is captured, and the plan of a statement shape is reused
+    for `explain_ttl` seconds, so a burst of slow queries doesn't turn into a burst of EXPLAINs. The query
+    itself is never re-run, EXPLAIN only plans it, and only SELECTs are explained. Streamed queries
+    (`stream_results`) aren't explained: their server-side cursor is still open on the connection, and e.g.
+    MySQL can't run another statement on it until the results are read.
+    """
+
+    def __init__(self, path: str, threshold_ms: float = 200, sample_rate: float = 1.0, explain: bool = True,
+                 explain_ttl: float = 600, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.explain = explain
+        self.plans = LRUCache(maxsize=256, ttl=explain_ttl)
+        self.captured = 0
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self._lock = threading.Lock()
+
+    def should_capture(self, seconds: float) -> bool:
+        return seconds >= self.threshold and (self.sample_rate >= 1 or random.random() < self.sample_rate)
+
+    def capture(self, conn: Any, statement: str, parameters: Any, executemany: bool, seconds: float,
+                streaming: bool = False):
+        try:
+            entry = {
+                "time": datetime.utcnow().isoformat(),
+                "duration_ms": round(seconds * 1000, 3),
+                "statement": statement,
+                "parameters": redact(parameters, executemany),
+                "call_site": call_site(),
+                "explain": (self._plan(conn, statement, parameters)
+                            if self.explain and not executemany and not streaming else None),
+            }
+            self._handler.handle(logging.makeLogRecord({"msg": json.dumps(entry, default=str)}))
+            with self._lock:
+                self.captured += 1
+        except Exception:
+            # Never fail the query because of the log
+            logger.exception("Could not capture slow query")
+
+    def _plan(self, conn: Any, statement: str, parameters: Any) -> Optional[List[List[str]]]:
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        if prefix is None or not statement.lstrip().upper().startswith("SELECT"):
+            return None
+
+        shape = statement_shape(statement)
+        plan = self.plans.get(shape)
+        if plan is not None:
+            return plan
+
+        plan = [[_QUOTED_LITERAL.sub("'?'", value) for value in row] for row in explain(conn, statement, parameters)]
+        self.plans.set(shape, plan)
+        return plan
+
+
+def explain(conn: Any, statement: str, parameters: Any) -> List[List[str]]:
+    """The dialect's EXPLAIN output for a statement, run on `conn`'s raw DBAPI connection so the EXPLAIN
+    isn't instrumented (or captured) itself."""
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(EXPLAIN_PREFIXES[conn.dialect.name] + statement, parameters)
+        return [[str(value) for value in row] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
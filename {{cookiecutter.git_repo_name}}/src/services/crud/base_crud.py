@@ -1,16 +1,78 @@
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import (
+    Any, AsyncIterator, Callable, Dict, Generic, Iterable, Iterator, List, Optional, Tuple, Type, TypeVar, Union
+)
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import Table, and_, bindparam, case, insert, inspect, or_, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Dialect, Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.sql import Insert, Select
 
 from src.orm.models import Base
+from src.orm.schemas.bulk import BulkResult
 
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+def encode_cursor(created: datetime, id: int) -> str:
+    """Encode the `(created, id)` position of the last row of a page as an opaque cursor."""
+    data = json.dumps([created.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created, id = json.loads(data)
+        return datetime.fromisoformat(created), int(id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def insert_returning(dialect: Dialect) -> bool:
+    """Whether the dialect supports INSERT ... RETURNING. SQLAlchemy 1.4 calls it `full_returning`."""
+    if hasattr(dialect, "insert_returning"):
+        return dialect.insert_returning
+    return getattr(dialect, "full_returning", False)
+
+
+def upsert_statement(table: Table, natural_key: str, columns: Iterable[str], dialect: str) -> Insert:
+    """
+    Insert of `columns` that updates them, except `natural_key`, `created` and `version`, on the row with the
+    same `natural_key` instead, and increments its `version`. See `BaseCrud.bulk_upsert`.
+    """
+    updated = [column for column in columns if column not in (natural_key, "created", "version")]
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql if dialect == "postgresql" else sqlite).insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=[natural_key],
+            set_={**{column: stmt.excluded[column] for column in updated}, "version": table.c.version + 1},
+            where=or_(*(
+                table.c[column].is_distinct_from(stmt.excluded[column]) for column in updated if column != "modified"
+            )),
+        )
+    if dialect == "mysql":
+        stmt = mysql.insert(table)
+        # ON DUPLICATE KEY UPDATE fires on a conflict on any unique column, so only the row with the same natural
+        # key is updated. A row that conflicts with another one on e.g. email is left as it was.
+        same_key = table.c[natural_key] == stmt.inserted[natural_key]
+        return stmt.on_duplicate_key_update({
+            **{column: case((same_key, stmt.inserted[column]), else_=table.c[column]) for column in updated},
+            "version": case((same_key, table.c.version + 1), else_=table.c.version),
+        })
+    raise Exception(f"Upserts aren't supported on {dialect}")
+
+
 class BaseCrud(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def __init__(self, model: Type[ModelType], db: Session):
         """
@@ -24,6 +86,9 @@ class BaseCrud(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         self.model = model
         self.db = db
 
+    # Unique column used to look up the ids of bulk created rows, e.g. "sub" for users
+    natural_key: Optional[str] = None
+
     def get(self, id: Any) -> Optional[ModelType]:
         return self.db.query(self.model) \
             .filter(self.model.id == id) \
@@ -35,9 +100,74 @@ class BaseCrud(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def get_multi(self, *, offset: int = 0, limit: int = 100) -> List[ModelType]:
         return self.db.query(self.model) \
             .filter(self.model.deleted == False) \
-            .order_by(self.model.created.asc()) \
+            .order_by(self.model.created.asc(), self.model.id.asc()) \
             .offset(offset).limit(limit).all()
 
+    def get_page(self, *, cursor: Optional[str] = None, limit: int = 100) -> Tuple[List[ModelType], Optional[str]]:
+        """
+        Keyset (cursor) pagination ordered by `(created, id)`. Unlike `get_multi`, the cost of a page
+        doesn't grow with its depth and rows aren't skipped or repeated when rows are inserted between
+        requests. Pass the returned cursor to get the next page, it is None on the last page.
+
+        Raises ValueError if the cursor is invalid.
+        """
+        query = self.db.query(self.model).filter(self.model.deleted == False)
+
+        if cursor:
+            created, id = decode_cursor(cursor)
+            # Expanded form of (created, id) > (:created, :id), which not all databases can use an index for
+            query = query.filter(or_(
+                self.model.created > created,
+                and_(self.model.created == created, self.model.id > id),
+            ))
+
+        rows = query.order_by(self.model.created.asc(), self.model.id.asc()).limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, encode_cursor(rows[-1].created, rows[-1].id)
+        return rows, None
+
+    def get_changed_since(self, *, modified: Optional[datetime] = None, id: int = 0,
+                          until: Optional[datetime] = None, limit: int = 1000) -> List[ModelType]:
+        """
+        Rows changed after the `(modified, id)` position, including soft deleted ones, in `(modified, id)` order.
+        Pass the `(modified, id)` of the last row to get the next batch. Rows modified at or after `until` are
+        left for later. Reads a range of the `(modified, id)` index, so the cost depends on the number of
+        changed rows rather than the size of the table.
+        """
+        query = self.db.query(self.model)
+        if modified is not None:
+            # Expanded form of (modified, id) > (:modified, :id), see get_page
+            query = query.filter(or_(
+                self.model.modified > modified,
+                and_(self.model.modified == modified, self.model.id > id),
+            ))
+        if until is not None:
+            query = query.filter(self.model.modified < until)
+
+        return query.order_by(self.model.modified.asc(), self.model.id.asc()).limit(limit).all()
+
+    def stream_statement(self, *, columns: Optional[List[str]] = None) -> Select:
+        """Select of `columns` (default: all) of the non-deleted rows in id order, see `stream_batches`."""
+        table = self.model.__table__
+        selected = [table.c[column] for column in columns] if columns else [table]
+        return select(*selected).where(table.c.deleted == False).order_by(table.c.id.asc())
+
+    def stream_batches(self, *, columns: Optional[List[str]] = None,
+                       batch_size: int = 1000) -> Iterator[List[Row]]:
+        """
+        All non-deleted rows in lists of `batch_size`, e.g. to export a table. Rows are read through a
+        server-side cursor where the driver supports one, and are Core rows rather than ORM objects, so
+        nothing accumulates in the session and memory use doesn't grow with the size of the table.
+        """
+        result = self.db.execute(
+            self.stream_statement(columns=columns).execution_options(stream_results=True, max_row_buffer=batch_size)
+        )
+        try:
+            yield from result.partitions(batch_size)
+        finally:
+            result.close()
+
     def create(self, *, obj_in: CreateSchemaType, commit: bool = True) -> ModelType:
         obj_in_data = jsonable_encoder(obj_in)
         db_obj = self.model(**obj_in_data)  # type: ignore
@@ -45,17 +175,47 @@ class BaseCrud(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         self.db.commit()
         return db_obj
 
+    def create_unique(self, *, obj_in: CreateSchemaType, commit: bool = True) -> ModelType:
+        """
+        Create a row with a single INSERT, leaving the table's unique constraints to reject duplicates instead of
+        looking for an existing row first, which also can't race with a concurrent insert. Raises IntegrityError
+        on a conflict; the session then has to be rolled back.
+
+        The row comes back with the INSERT where the dialect supports RETURNING, otherwise it is built from the
+        inserted values and primary key. The returned object is attached to the session as if it was loaded,
+        after the commit, so reading it doesn't need a refresh query.
+        """
+        table = self.model.__table__
+        now = datetime.utcnow()
+        stmt = insert(table).values(**jsonable_encoder(obj_in), created=now, modified=now, version=1)
+        if insert_returning(self.db.get_bind().dialect):
+            row = dict(self.db.execute(stmt.returning(*table.columns)).one()._mapping)
+        else:
+            result = self.db.execute(stmt)
+            row = {**result.last_inserted_params(),
+                   **dict(zip(table.primary_key.columns.keys(), result.inserted_primary_key))}
+        if commit:
+            self.db.commit()
+
+        db_obj = self.model(**row)  # type: ignore
+        make_transient_to_detached(db_obj)
+        self.db.add(db_obj)
+        return db_obj
+
     def update(self, *, db_obj: ModelType,
                obj_in: Union[UpdateSchemaType, Dict[str, Any]],
                commit: bool = True) -> ModelType:
-        obj_data = jsonable_encoder(db_obj)
-        if isinstance(obj_in, dict):
-            update_data = obj_in
-        else:
-            update_data = obj_in.dict(exclude_unset=True)
-        for field in obj_data:
-            if field in update_data:
-                setattr(db_obj, field, update_data[field])
+        """
+        Apply a partial update. Pass a schema (only fields that were set are used) or a dict.
+        Only columns whose value changes are written. If nothing changes, the object isn't added to the
+        session and nothing is flushed or committed, so `modified` and `version` stay as they are.
+        """
+        changes = self.changed_fields(db_obj=db_obj, obj_in=obj_in)
+        if not changes:
+            return db_obj
+
+        for field, value in changes.items():
+            setattr(db_obj, field, value)
         self.db.add(db_obj)
 
         if commit:
@@ -63,8 +223,300 @@ class BaseCrud(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
 
         return db_obj
 
+    def changed_fields(self, *, db_obj: ModelType,
+                       obj_in: Union[UpdateSchemaType, Dict[str, Any]]) -> Dict[str, Any]:
+        """Columns of `db_obj` that `obj_in` sets to a different value."""
+        update_data = obj_in if isinstance(obj_in, dict) else obj_in.dict(exclude_unset=True)
+        columns = inspect(self.model).column_attrs.keys()
+        return {
+            field: value for field, value in update_data.items()
+            if field in columns and getattr(db_obj, field) != value
+        }
+
     def remove(self, *, id: int) -> ModelType:
         obj = self.db.query(self.model).get(id)
         obj.deleted = True
         self.db.commit()
         return obj
+
+    # Bulk operations use Core executemany statements and commit once per chunk. ORM events (including the
+    # `created`/`modified` listeners on Base and `version_id_col`) don't fire for Core statements, so
+    # the same bookkeeping is applied explicitly, and `after_bulk_write` is called before each commit.
+
+    def bulk_create(self, *, objs_in: List[CreateSchemaType], chunk_size: int = 1000) -> List[BulkResult]:
+        results = []
+        for start in range(0, len(objs_in), chunk_size):
+            now = datetime.utcnow()
+            rows = [
+                {**obj_in.dict(), "created": now, "modified": now, "version": 1}
+                for obj_in in objs_in[start:start + chunk_size]
+            ]
+            try:
+                self.db.execute(insert(self.model.__table__), rows)
+                self.db.commit()
+                chunk_results = [BulkResult(index=start + i, success=True) for i in range(len(rows))]
+            except IntegrityError:
+                # Retry the chunk row by row to find which rows conflict
+                self.db.rollback()
+                chunk_results = self._create_rows(rows, start)
+
+            self._set_created_ids(rows, chunk_results)
+            results.extend(chunk_results)
+        return results
+
+    def bulk_upsert(self, *, objs_in: List[CreateSchemaType], chunk_size: int = 1000) -> List[BulkResult]:
+        """
+        Insert rows, or update the row with the same `natural_key`, with the dialect's native upsert:
+        `INSERT ... ON CONFLICT DO UPDATE` on Postgres and SQLite, `ON DUPLICATE KEY UPDATE` on MySQL. Each chunk
+        is an executemany per set of fields, of statements compiled once, which the drivers send as multi-row
+        inserts. Only the fields set on an item are written, so an update leaves the other columns as they are.
+        Updated rows keep their `id` and `created` and get a new `modified` and `version`. On Postgres and
+        SQLite, rows whose values don't change aren't written. Rows that conflict with another row on a unique
+        column, e.g. email, fail on every dialect.
+        """
+        if not self.natural_key:
+            raise Exception(f"{type(self).__name__} has no natural_key to upsert on")
+
+        table = self.model.__table__
+        dialect = self.db.get_bind().dialect.name
+
+        def statement(row: Dict[str, Any]) -> Insert:
+            return upsert_statement(table, self.natural_key, sorted(row), dialect)
+
+        results = []
+        for start in range(0, len(objs_in), chunk_size):
+            now = datetime.utcnow()
+            rows = [
+                {**obj_in.dict(exclude_unset=True), "created": now, "modified": now, "version": 1}
+                for obj_in in objs_in[start:start + chunk_size]
+            ]
+            chunk_results = [BulkResult(index=start + i, success=True) for i in range(len(rows))]
+            if dialect == "mysql":
+                # Other unique columns don't raise on MySQL, see `upsert_statement`
+                for i, detail in self._unique_conflicts(rows).items():
+                    chunk_results[i].success = False
+                    chunk_results[i].detail = detail
+            pending = [(row, result) for row, result in zip(rows, chunk_results) if result.success]
+
+            # A multi-row insert can't change the same row twice, so only the last row of each key is sent
+            last = {row[self.natural_key]: i for i, (row, _) in enumerate(pending)}
+            # executemany needs the same columns for every row, so group rows by the columns they set
+            groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+            for i, (row, _) in enumerate(pending):
+                if last[row[self.natural_key]] == i:
+                    groups.setdefault(tuple(sorted(row)), []).append(row)
+            try:
+                for group in groups.values():
+                    self.db.execute(statement(group[0]), group)
+            except IntegrityError:
+                # Retry the chunk row by row to find which rows conflict, e.g. on another unique column
+                self.db.rollback()
+                retried = self._create_rows([row for row, _ in pending], start, statement)
+                for (_, result), retried_result in zip(pending, retried):
+                    result.success, result.detail = retried_result.success, retried_result.detail
+
+            self._set_created_ids(rows, chunk_results)
+            for result in chunk_results:
+                if result.success and result.id is None:
+                    # Left out by the MySQL update, another row took one of its unique values in the meantime
+                    result.success = False
+                    result.detail = "Conflicts with another row on a unique column"
+            self.after_bulk_write([result.id for result in chunk_results if result.id is not None])
+            self.db.commit()
+            results.extend(chunk_results)
+        return results
+
+    def bulk_update(self, *, objs_in: List[Dict[str, Any]], chunk_size: int = 1000) -> List[BulkResult]:
+        """Update rows by `id`. Each item is a dict of the `id` and the columns to set."""
+        table = self.model.__table__
+        results = []
+        for start in range(0, len(objs_in), chunk_size):
+            chunk = objs_in[start:start + chunk_size]
+            existing_ids = self._existing_ids([obj_in["id"] for obj_in in chunk])
+
+            updates = []
+            for i, obj_in in enumerate(chunk):
+                result = BulkResult(index=start + i, id=obj_in["id"], success=obj_in["id"] in existing_ids)
+                if result.success:
+                    updates.append((result, {**{k: v for k, v in obj_in.items() if k != "id"}, "_id": obj_in["id"]}))
+                else:
+                    result.detail = "Not found"
+                results.append(result)
+
+            stmt = update(table).where(table.c.id == bindparam("_id")).values(
+                modified=datetime.utcnow(), version=table.c.version + 1
+            )
+            # executemany needs the same columns for every row, so group rows by the columns they set
+            groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+            for _, row in updates:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+
+            try:
+                for rows in groups.values():
+                    self.db.execute(stmt, rows)
+                self.after_bulk_write([result.id for result, _ in updates])
+                self.db.commit()
+            except IntegrityError:
+                # Retry the chunk row by row to find which rows conflict
+                self.db.rollback()
+                for result, row in updates:
+                    try:
+                        self.db.execute(stmt, row)
+                        self.after_bulk_write([result.id])
+                        self.db.commit()
+                    except IntegrityError as e:
+                        self.db.rollback()
+                        result.success = False
+                        result.detail = str(e.orig)
+        return results
+
+    def bulk_remove(self, *, ids: List[int], chunk_size: int = 1000) -> List[BulkResult]:
+        """Soft delete rows by `id`."""
+        results = []
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            existing_ids = self._existing_ids(chunk)
+
+            self.db.execute(
+                update(self.model.__table__)
+                .where(self.model.id.in_(existing_ids))
+                .values(deleted=True, modified=datetime.utcnow(), version=self.model.version + 1)
+            )
+            self.after_bulk_write(list(existing_ids))
+            self.db.commit()
+
+            results.extend(
+                BulkResult(index=start + i, id=id, success=id in existing_ids,
+                           detail=None if id in existing_ids else "Not found")
+                for i, id in enumerate(chunk)
+            )
+        return results
+
+    def after_bulk_write(self, ids: List[int]):
+        """Override to react to rows changed by bulk updates and deletes, called before each chunk commits."""
+        pass
+
+    def _existing_ids(self, ids: List[int]) -> set:
+        return {
+            id for id, in self.db.query(self.model.id)
+            .filter(self.model.id.in_(ids))
+            .filter(self.model.deleted == False)
+        }
+
+    def _create_rows(self, rows: List[Dict[str, Any]], start: int,
+                     statement: Optional[Callable[[Dict[str, Any]], Insert]] = None) -> List[BulkResult]:
+        results = []
+        for i, row in enumerate(rows):
+            try:
+                self.db.execute(insert(self.model.__table__) if statement is None else statement(row), row)
+                self.db.commit()
+                results.append(BulkResult(index=start + i, success=True))
+            except IntegrityError as e:
+                self.db.rollback()
+                results.append(BulkResult(index=start + i, success=False, detail=str(e.orig)))
+        return results
+
+    def _unique_conflicts(self, rows: List[Dict[str, Any]]) -> Dict[int, str]:
+        """Positions of the rows that have the value of another unique column of a row with another natural key."""
+        key_column = self.model.__table__.c[self.natural_key]
+        conflicts = {}
+        for column in self.model.__table__.columns:
+            if not column.unique or column.name == self.natural_key:
+                continue
+            values = {row[column.name] for row in rows if row.get(column.name) is not None}
+            owners = dict(self.db.query(column, key_column).filter(column.in_(values))) if values else {}
+            for i, row in enumerate(rows):
+                owner = owners.get(row.get(column.name))
+                if owner is not None and owner != row[self.natural_key]:
+                    conflicts.setdefault(i, f"Duplicate {column.name} of another row")
+        return conflicts
+
+    def _set_created_ids(self, rows: List[Dict[str, Any]], results: List[BulkResult]):
+        if not self.natural_key:
+            return
+
+        key_column = getattr(self.model, self.natural_key)
+        keys = [row[self.natural_key] for row, result in zip(rows, results) if result.success]
+        ids = dict(self.db.query(key_column, self.model.id).filter(key_column.in_(keys))) if keys else {}
+        for row, result in zip(rows, results):
+            if result.success:
+                result.id = ids.get(row[self.natural_key])
+
+
+class AsyncBaseCrud(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
+    def __init__(self, model: Type[ModelType], db: AsyncSession):
+        """
+        Async CRUD object with the same methods as BaseCrud.
+
+        Each method runs the BaseCrud implementation against the AsyncSession's underlying sync session
+        with `run_sync`, so all database I/O is awaited on the async driver without duplicating the
+        CRUD logic.
+
+        **Parameters**
+
+        * `model`: A SQLAlchemy model class
+        * `db`: An AsyncSession
+        """
+        self.model = model
+        self.db = db
+
+    def sync_crud(self, session: Session) -> BaseCrud:
+        """Override to return the sync CRUD object this class wraps."""
+        return BaseCrud(self.model, session)
+
+    async def run_sync(self, method: str, *args, **kwargs) -> Any:
+        return await self.db.run_sync(lambda session: getattr(self.sync_crud(session), method)(*args, **kwargs))
+
+    async def get(self, id: Any) -> Optional[ModelType]:
+        return await self.run_sync("get", id)
+
+    async def get_with_deleted(self, id: Any) -> Optional[ModelType]:
+        return await self.run_sync("get_with_deleted", id)
+
+    async def get_multi(self, *, offset: int = 0, limit: int = 100) -> List[ModelType]:
+        return await self.run_sync("get_multi", offset=offset, limit=limit)
+
+    async def get_page(self, *, cursor: Optional[str] = None,
+                       limit: int = 100) -> Tuple[List[ModelType], Optional[str]]:
+        return await self.run_sync("get_page", cursor=cursor, limit=limit)
+
+    async def get_changed_since(self, *, modified: Optional[datetime] = None, id: int = 0,
+                                until: Optional[datetime] = None, limit: int = 1000) -> List[ModelType]:
+        return await self.run_sync("get_changed_since", modified=modified, id=id, until=until, limit=limit)
+
+    async def stream_batches(self, *, columns: Optional[List[str]] = None,
+                             batch_size: int = 1000) -> AsyncIterator[List[Row]]:
+        """Like BaseCrud.stream_batches, reading from the async driver's server-side cursor."""
+        statement = self.sync_crud(self.db.sync_session).stream_statement(columns=columns)
+        result = await self.db.stream(statement.execution_options(max_row_buffer=batch_size))
+        try:
+            async for partition in result.partitions(batch_size):
+                yield partition
+        finally:
+            await result.close()
+
+    async def create(self, *, obj_in: CreateSchemaType, commit: bool = True) -> ModelType:
+        return await self.run_sync("create", obj_in=obj_in, commit=commit)
+
+    async def create_unique(self, *, obj_in: CreateSchemaType, commit: bool = True) -> ModelType:
+        return await self.run_sync("create_unique", obj_in=obj_in, commit=commit)
+
+    async def update(self, *, db_obj: ModelType,
+                     obj_in: Union[UpdateSchemaType, Dict[str, Any]],
+                     commit: bool = True) -> ModelType:
+        return await self.run_sync("update", db_obj=db_obj, obj_in=obj_in, commit=commit)
+
+    async def remove(self, *, id: int) -> ModelType:
+        return await self.run_sync("remove", id=id)
+
+    async def bulk_create(self, *, objs_in: List[CreateSchemaType], chunk_size: int = 1000) -> List[BulkResult]:
+        return await self.run_sync("bulk_create", objs_in=objs_in, chunk_size=chunk_size)
+
+    async def bulk_upsert(self, *, objs_in: List[CreateSchemaType], chunk_size: int = 1000) -> List[BulkResult]:
+        return await self.run_sync("bulk_upsert", objs_in=objs_in, chunk_size=chunk_size)
+
+    async def bulk_update(self, *, objs_in: List[Dict[str, Any]], chunk_size: int = 1000) -> List[BulkResult]:
+        return await self.run_sync("bulk_update", objs_in=objs_in, chunk_size=chunk_size)
+
+    async def bulk_remove(self, *, ids: List[int], chunk_size: int = 1000) -> List[BulkResult]:
+        return await self.run_sync("bulk_remove", ids=ids, chunk_size=chunk_size)
@@ -1,18 +1,56 @@
-from typing import Optional
+from typing import List, Optional
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from src.services.crud.base_crud import BaseCrud
+from src.services.crud.base_crud import AsyncBaseCrud, BaseCrud
 from src.orm.models import User
 from src.orm.schemas import UserCreate, UserUpdate
+from src.services.user_cache import user_cache
 
 
 class UserCrud(BaseCrud[User, UserCreate, UserUpdate]):
+    natural_key = "sub"
+
     def __init__(self, db: Session):
         super(UserCrud, self).__init__(User, db)
 
     def get_by_sub(self, *, sub: str) -> Optional[User]:
         return self.db.query(self.model).filter(User.sub == sub).first()
 
+    def get_by_sub_cached(self, *, sub: str) -> Optional[User]:
+        """Like `get_by_sub`, but served from the in-process user cache when possible."""
+        snapshot = user_cache.get(sub)
+        if snapshot is not None:
+            # Attach a copy to this session without querying, the snapshot itself stays detached
+            return self.db.merge(snapshot, load=False)
+
+        user = self.get_by_sub(sub=sub)
+        if user is not None:
+            user_cache.set(user)
+        return user
+
     def get_by_email(self, *, email: str) -> Optional[User]:
         return self.db.query(self.model).filter(User.email == email).first()
+
+    def after_bulk_write(self, ids: List[int]):
+        # Core statements don't trigger the user cache's ORM listener
+        for sub, version in self.db.query(User.sub, User.version).filter(User.id.in_(ids)):
+            user_cache.invalidate(sub, version)
+
+
+class AsyncUserCrud(AsyncBaseCrud[User, UserCreate, UserUpdate]):
+    def __init__(self, db: AsyncSession):
+        super(AsyncUserCrud, self).__init__(User, db)
+
+    def sync_crud(self, session: Session) -> UserCrud:
+        return UserCrud(session)
+
+    async def get_by_sub(self, *, sub: str) -> Optional[User]:
+        return await self.run_sync("get_by_sub", sub=sub)
+
+    async def get_by_sub_cached(self, *, sub: str) -> Optional[User]:
+        return await self.run_sync("get_by_sub_cached", sub=sub)
+
+    async def get_by_email(self, *, email: str) -> Optional[User]:
+        return await self.run_sync("get_by_email", email=email)
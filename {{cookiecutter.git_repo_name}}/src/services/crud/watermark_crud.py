@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from src.orm.models import JobWatermark
+from src.services.crud.base_crud import BaseCrud
+
+
+class WatermarkCrud(BaseCrud[JobWatermark, BaseModel, BaseModel]):
+    def __init__(self, db: Session):
+        super(WatermarkCrud, self).__init__(JobWatermark, db)
+
+    def get_or_create(self, *, job: str) -> JobWatermark:
+        """The job's watermark. A new job starts before the first row, the watermark is flushed but not committed."""
+        watermark = self.db.query(JobWatermark).filter(JobWatermark.job == job).first()
+        if watermark is None:
+            watermark = JobWatermark(job=job, last_modified=None, last_id=0)
+            self.db.add(watermark)
+            self.db.flush()
+        return watermark
+
+    def advance(self, *, watermark: JobWatermark, modified: datetime, id: int) -> JobWatermark:
+        """
+        Move the watermark to `(modified, id)`. Not committed, so it commits with the batch it follows. The
+        versioned UPDATE raises StaleDataError if another run of the job advanced it in the meantime.
+        """
+        watermark.last_modified = modified
+        watermark.last_id = id
+        self.db.add(watermark)
+        return watermark
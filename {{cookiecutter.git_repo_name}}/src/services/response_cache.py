@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.core.cache import LRUCache
+from src.core.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    status_code: int
+    media_type: Optional[str]
+    headers: Dict[str, str]
+
+
+class MemoryBackend:
+    """Per-process LRU backend. Each entry records the generation of the tables it was built from, and
+    invalidating a table bumps its generation, so stale entries are dropped on their next read."""
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 30):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        generations, response = entry
+        if any(self._generations.get(table, 0) != generation for table, generation in generations):
+            self.entries.pop(key)
+            return None
+        return response
+
+    def set(self, key: str, response: CachedResponse, tables: Iterable[str], generations: Dict[str, int] = None):
+        generations = generations or self.generations(tables)
+        self.entries.set(key, (tuple(generations.items()), response))
+
+    def generations(self, tables: Iterable[str]) -> Dict[str, int]:
+        return {table: self._generations.get(table, 0) for table in tables}
+
+    def invalidate(self, table: str):
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self.entries.stats()}
+
+
+class SQLiteBackend:
+    """Backend in a local SQLite file, shared by all workers on the host, so a write handled by one worker
+    invalidates the entries of all of them. Table generations are kept in the file too, see MemoryBackend.
+    When there are more than `maxsize` entries, the ones expiring first are evicted."""
+
+    def __init__(self, path: str, maxsize: int = 1000, ttl: float = 30):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, tables TEXT NOT NULL, meta TEXT NOT NULL, body BLOB NOT NULL, "
+                "expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_expires_at ON response_cache (expires_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache_generation ("
+                "table_name TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            row = self._connection().execute(
+                "SELECT meta, body FROM response_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e!r}")
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        status_code, media_type, headers = json.loads(row[0])
+        return CachedResponse(row[1], status_code, media_type, headers)
+
+    def set(self, key: str, response: CachedResponse, tables: Iterable[str], generations: Dict[str, int] = None):
+        meta = json.dumps([response.status_code, response.media_type, response.headers])
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Skip the entry if any of its tables was invalidated while the response was built
+                if generations is None or self._generations(conn, tables) == generations:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO response_cache (key, tables, meta, body, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, f",{','.join(tables)},", meta, response.body, time.time() + self.ttl),
+                    )
+                    conn.execute(
+                        "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                        "ORDER BY expires_at LIMIT max(0, (SELECT count(*) FROM response_cache) - ?))",
+                        (self.maxsize,),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Best effort, the response is served either way
+            logger.warning(f"Response cache write failed: {e!r}")
+
+    def generations(self, tables: Iterable[str]) -> Dict[str, int]:
+        try:
+            return self._generations(self._connection(), tables)
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read failed: {e!r}")
+            return {}
+
+    @staticmethod
+    def _generations(conn: sqlite3.Connection, tables: Iterable[str]) -> Dict[str, int]:
+        tables = list(tables)
+        rows = dict(conn.execute(
+            f"SELECT table_name, generation FROM response_cache_generation "
+            f"WHERE table_name IN ({','.join('?' * len(tables))})",
+            tables,
+        ).fetchall())
+        return {table: rows.get(table, 0) for table in tables}
+
+    def invalidate(self, table: str):
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO response_cache_generation (table_name, generation) VALUES (?, 1) "
+                    "ON CONFLICT (table_name) DO UPDATE SET generation = generation + 1",
+                    (table,),
+                )
+                conn.execute("DELETE FROM response_cache WHERE tables LIKE ?", (f"%,{table},%",))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.error(f"Response cache invalidation of {table} failed: {e!r}")
+
+    def clear(self):
+        self._connection().execute("DELETE FROM response_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "size": self._connection().execute("SELECT count(*) FROM response_cache").fetchone()[0],
+            "maxsize": self.maxsize,
+        }
+
+
+class ResponseCache:
+    """Cache of rendered responses for read routes.
+
+    Entries are keyed by path, query params and the caller's privilege, so only cache routes whose response
+    is the same for every caller with that privilege. Each entry lists the tables it was read from and is
+    invalidated when a session commits a write to any of them (see the session listeners below). That covers
+    BaseCrud create/update/remove as well as bulk Core statements run through the session.
+    """
+
+    def __init__(self, backend: Any):
+        self.backend = backend
+
+    @staticmethod
+    def key(request: Request, privilege: str) -> str:
+        query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+        return f"{privilege}:{request.url.path}?{query}"
+
+    def get(self, key: str) -> Optional[Response]:
+        cached = self.backend.get(key)
+        if cached is None:
+            return None
+        return Response(cached.body, status_code=cached.status_code, headers=cached.headers,
+                        media_type=cached.media_type)
+
+    def generations(self, *tables: str) -> Dict[str, int]:
+        """Call before reading from `tables` and pass to `set`, so a write committed in between isn't missed."""
+        return self.backend.generations(tables)
+
+    def set(self, key: str, response: Response, tables: Iterable[str], generations: Dict[str, int] = None):
+        if response.status_code != 200:
+            return
+        headers = {k: v for k, v in response.headers.items() if k not in ("content-length", "content-type")}
+        self.backend.set(key, CachedResponse(response.body, response.status_code, response.media_type, headers),
+                         tables, generations)
+
+    def invalidate(self, *tables: str):
+        for table in tables:
+            self.backend.invalidate(table)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.backend.stats()
+
+
+def create_backend(backend: str, maxsize: int, ttl: float, path: str = None) -> Any:
+    if backend == "sqlite":
+        return SQLiteBackend(path or os.path.join(tempfile.gettempdir(), "response_cache.db"), maxsize, ttl)
+    if backend == "memory":
+        return MemoryBackend(maxsize, ttl)
+    raise ValueError(f"Unknown response cache backend: {backend}")
+
+
+response_cache = ResponseCache(create_backend(
+    settings.response_cache.backend,
+    maxsize=settings.response_cache.maxsize,
+    ttl=settings.response_cache.ttl,
+    path=settings.response_cache.path,
+))
+
+
+# Tables written in a session are collected until it commits, then their entries are invalidated.
+def _written_tables(session: Session) -> set:
+    return session.info.setdefault("response_cache_tables", set())
+
+
+def response_cache_flush_listener(session, flush_context):
+    tables = _written_tables(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table:
+            tables.add(table)
+
+
+def response_cache_execute_listener(orm_execute_state):
+    # Core insert/update/delete statements run with Session.execute, e.g. by the BaseCrud bulk methods
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None:
+            _written_tables(orm_execute_state.session).add(table.name)
+
+
+def response_cache_commit_listener(session):
+    response_cache.invalidate(*session.info.pop("response_cache_tables", ()))
+
+
+def response_cache_rollback_listener(session):
+    session.info.pop("response_cache_tables", None)
+
+
+event.listen(Session, 'after_flush', response_cache_flush_listener)
+event.listen(Session, 'do_orm_execute', response_cache_execute_listener)
+event.listen(Session, 'after_commit', response_cache_commit_listener)
+event.listen(Session, 'after_rollback', response_cache_rollback_listener)
@@ -0,0 +1,63 @@
+from typing import Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from src.core.cache import LRUCache
+from src.core.settings import settings
+from src.orm.models import User
+
+
+class UserCache:
+    """In-process cache of users by `sub`, used to skip the user query on every authenticated request.
+
+    Entries are detached snapshots that are never attached to a session, callers get their own copy with
+    `session.merge(snapshot, load=False)`. Writes to a user (see the `after_update` listener below) drop its
+    entry and record the row's new `version`, so a snapshot older than the last write on this node is never
+    served or stored, even if a concurrent request read the row before the write committed.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        # Latest version written per sub. Kept for as long as an entry could live.
+        self._min_versions = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, sub: str) -> Optional[User]:
+        snapshot = self.entries.get(sub)
+        if snapshot is not None and snapshot.version < self._min_versions.get(sub, 0):
+            self.entries.pop(sub)
+            return None
+        return snapshot
+
+    def set(self, user: User):
+        if user.version < self._min_versions.get(user.sub, 0):
+            return
+        self.entries.set(user.sub, self._snapshot(user))
+
+    def invalidate(self, sub: str, version: int = 0):
+        self._min_versions.set(sub, max(version, self._min_versions.get(sub, 0)))
+        self.entries.pop(sub)
+
+    def clear(self):
+        self.entries.clear()
+        self._min_versions.clear()
+
+    @staticmethod
+    def _snapshot(user: User) -> User:
+        snapshot = User(**{attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+        make_transient_to_detached(snapshot)
+        return snapshot
+
+
+user_cache = UserCache(maxsize=settings.user_cache.maxsize, ttl=settings.user_cache.ttl)
+
+
+def user_update_listener(mapper, connection, target):
+    # Also covers soft deletes (BaseCrud.remove), which update the `deleted` column
+    user_cache.invalidate(target.sub, target.version)
+    for previous_sub in inspect(target).attrs.sub.history.deleted or ():
+        user_cache.invalidate(previous_sub)
+
+
+event.listen(User, 'after_update', user_update_listener)
+event.listen(User, 'after_delete', user_update_listener)
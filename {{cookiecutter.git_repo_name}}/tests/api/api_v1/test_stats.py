@@ -0,0 +1,12 @@
+def test_read_stats(db_session, client, auth_user):
+    response = client.get("/api/v1/stats/")
+    assert response.status_code == 400
+
+    auth_user.is_superuser = True
+    db_session.commit()
+
+    response = client.get("/api/v1/stats/")
+    assert response.status_code == 200
+    stats = response.json()
+    assert set(stats["pools"]) == {"sync", "async"}
+    assert stats["caches"]["user"]["size"] >= 1
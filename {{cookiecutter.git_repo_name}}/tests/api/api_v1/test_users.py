@@ -1,7 +1,19 @@
+import asyncio
+import csv
+import io
+import json
+import tracemalloc
+from datetime import datetime
+from typing import Tuple
 from uuid import uuid4
 
+import pytest
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy import insert
+
 from src.orm.models import User
+from tests.conftest import async_engine
+from tests.utils import capture_statements
 
 
 def test_create_user(db_session, client, user_sub):
@@ -37,6 +49,7 @@ def test_create_user(db_session, client, user_sub):
         'created': jsonable_encoder(user.created),
         'modified': jsonable_encoder(user.modified),
         'deleted': False,
+        'version': 1,
     }
 
     user = db_session.query(User).one_or_none()
@@ -76,6 +89,46 @@ def test_create_user_already_exists(db_session, client, user_sub):
     assert response.status_code == 400
 
 
+def test_create_user_email_taken(db_session, client, user_sub):
+    db_session.add(User(sub=str(uuid4()), email="joe.test@email.com", full_name="test user", given_name="test"))
+    db_session.commit()
+
+    user_data = {
+        "sub": user_sub,
+        "full_name": "Joe Test",
+        "given_name": "Joe",
+        "email": "joe.test@email.com",
+        "timezone": "America/New_York",
+    }
+
+    response = client.post("/api/v1/users/", json=user_data)
+    assert response.status_code == 400
+    assert db_session.query(User).count() == 1
+
+
+def test_create_user_single_statement(db_session, client, user_sub):
+    user_data = {
+        "sub": user_sub,
+        "full_name": "Joe Test",
+        "given_name": "Joe",
+        "email": "joe.test@email.com",
+        "timezone": "America/New_York",
+    }
+
+    with capture_statements(async_engine.sync_engine) as statements:
+        response = client.post("/api/v1/users/", json=user_data)
+
+    assert response.status_code == 200
+    # No duplicate check before the insert, and no refresh after it
+    assert len(statements) == 1
+    assert statements[0].startswith("INSERT")
+
+    user = db_session.query(User).one()
+    assert response.json()["id"] == user.id
+    assert response.json()["created"] == jsonable_encoder(user.created)
+    assert response.json()["version"] == user.version == 1
+
+
 def test_read_users(db_session, client, user_sub):
     user = User(sub=user_sub, email="test@email.com", full_name="test user", given_name="test", is_superuser=False)
     db_session.add(user)
@@ -194,4 +247,239 @@ def test_update_user_by_id(db_session, client, user_sub):
     response = client.patch(f"/api/v1/users/{user_2.id}", json=update_data)
     assert response.status_code == 200
 
+    # The API updated the row through its own session
+    db_session.refresh(user_2)
+    assert not user_2.is_active
+
+
+def test_read_users_cursor_pagination(db_session, client, user_sub):
+    user = User(sub=user_sub, email="test@email.com", full_name="test user", given_name="test", is_superuser=True)
+    db_session.add(user)
+    db_session.commit()
+    for i in range(2):
+        db_session.add(User(sub=str(uuid4()), email=f"test{i}@email.com", full_name="test user", given_name="test"))
+        db_session.commit()
+
+    response = client.get("/api/v1/users/", params={"cursor": "", "limit": 2})
+    assert response.status_code == 200
+    page = response.json()
+    assert [u["sub"] for u in page["items"]][0] == user_sub
+    assert len(page["items"]) == 2
+    assert page["next_cursor"]
+
+    response = client.get("/api/v1/users/", params={"cursor": page["next_cursor"], "limit": 2})
+    assert response.status_code == 200
+    next_page = response.json()
+    assert len(next_page["items"]) == 1
+    assert next_page["items"][0]["email"] == "test1@email.com"
+    assert next_page["next_cursor"] is None
+
+    # Offset pagination still returns a plain list
+    response = client.get("/api/v1/users/", params={"offset": 1, "limit": 1})
+    assert response.json()[0]["email"] == "test0@email.com"
+
+    response = client.get("/api/v1/users/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_create_users_bulk(db_session, client, auth_user):
+    users_data = [
+        {
+            "sub": str(uuid4()),
+            "full_name": f"Joe Test {i}",
+            "given_name": "Joe",
+            "email": f"joe.test{i}@email.com",
+            "timezone": "America/New_York",
+        }
+        for i in range(3)
+    ]
+    # Conflicts with the existing user
+    users_data[1]["email"] = auth_user.email
+
+    response = client.post("/api/v1/users/bulk", json=users_data)
+    assert response.status_code == 400
+
+    auth_user.is_superuser = True
+    db_session.commit()
+
+    response = client.post("/api/v1/users/bulk", json=users_data)
+    assert response.status_code == 200
+
+    results = response.json()
+    assert [r["success"] for r in results] == [True, False, True]
+    assert results[1]["detail"]
+
+    for result, user_data in zip(results[::2], users_data[::2]):
+        user = db_session.query(User).filter(User.sub == user_data["sub"]).one()
+        assert result["id"] == user.id
+        assert user.version == 1
+        assert user.created == user.modified
+        assert user.notifications_enabled
+
+
+def test_update_users_bulk(db_session, client, auth_user):
+    auth_user.is_superuser = True
+    user_2 = User(sub=str(uuid4()), email="test2@email.com", full_name="test user 2", given_name="test 2")
+    db_session.add(user_2)
+    db_session.commit()
+
+    update_data = [
+        {"id": user_2.id, "is_active": False},
+        {"id": auth_user.id, "age": 40, "gender": 1},
+        {"id": 1000, "age": 40},
+    ]
+    assert client.get("/api/v1/users/me").json()["age"] is None
+
+    response = client.patch("/api/v1/users/bulk", json=update_data)
+    assert response.status_code == 200
+    assert [r["success"] for r in response.json()] == [True, True, False]
+
+    db_session.refresh(user_2)
+    db_session.refresh(auth_user)
     assert not user_2.is_active
+    assert user_2.version == 2
+    assert auth_user.age == 40
+
+    # The current user cache was invalidated
+    assert client.get("/api/v1/users/me").json()["age"] == 40
+
+
+def test_read_user_me_conditional(db_session, client, auth_user):
+    response = client.get("/api/v1/users/me")
+    etag = response.headers["etag"]
+    assert etag == f'"{auth_user.id}-{auth_user.version}"'
+    assert response.headers["last-modified"].endswith(" GMT")
+
+    response = client.get("/api/v1/users/me", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert not response.content
+
+    response = client.get("/api/v1/users/me", headers={"If-Modified-Since": response.headers["last-modified"]})
+    assert response.status_code == 304
+
+    # A write changes the version and so the ETag
+    client.patch("/api/v1/users/me", json={"age": 30})
+    response = client.get(f"/api/v1/users/{auth_user.id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_update_user_if_match(db_session, client, auth_user):
+    etag = client.get("/api/v1/users/me").headers["etag"]
+
+    response = client.patch("/api/v1/users/me", json={"age": 30}, headers={"If-Match": etag})
+    assert response.status_code == 200
+    new_etag = response.headers["etag"]
+    assert new_etag != etag
+
+    # The stale ETag no longer matches and nothing is written
+    response = client.patch("/api/v1/users/me", json={"age": 31}, headers={"If-Match": etag})
+    assert response.status_code == 412
+    db_session.refresh(auth_user)
+    assert auth_user.age == 30
+    assert f'"{auth_user.id}-{auth_user.version}"' == new_etag
+
+    auth_user.is_superuser = True
+    db_session.commit()
+    response = client.patch(f"/api/v1/users/{auth_user.id}", json={"age": 31}, headers={"If-Match": new_etag})
+    assert response.status_code == 412
+
+
+def test_export_users(db_session, client, auth_user):
+    response = client.get("/api/v1/users/export")
+    assert response.status_code == 400
+
+    auth_user.is_superuser = True
+    db_session.commit()
+    for i in range(3):
+        db_session.add(User(sub=str(uuid4()), email=f"test{i}@email.com", full_name="test user", given_name="test"))
+    db_session.commit()
+
+    users = client.get("/api/v1/users/", params={"limit": 10}).json()
+    response = client.get("/api/v1/users/export", params={"batch_size": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == users
+
+    response = client.get("/api/v1/users/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["email"] for row in rows] == [user["email"] for user in users]
+    assert rows[0]["sub"] == users[0]["sub"]
+
+    response = client.get("/api/v1/users/export", params={"format": "xml"})
+    assert response.status_code == 422
+
+
+def export(app, query_string: bytes, disconnect_after: int = None) -> Tuple[int, int]:
+    """
+    Call the export endpoint straight through ASGI, discarding the body as it's sent, unlike TestClient
+    which collects it. Returns the number of body chunks and bytes sent.
+    """
+    disconnected = asyncio.Event()
+    chunks, size = 0, 0
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/api/v1/users/export", "root_path": "", "query_string": query_string,
+        "headers": [(b"host", b"testserver")], "client": ("testclient", 50000), "server": ("testserver", 80),
+    }
+
+    async def receive():
+        if not chunks:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal chunks, size
+        if message["type"] == "http.response.body":
+            chunks += 1
+            size += len(message.get("body", b""))
+            if disconnect_after and chunks >= disconnect_after:
+                disconnected.set()
+
+    # A private loop rather than asyncio.run, which would unset the main thread's loop used by TestClient
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(app(scope, receive, send))
+    finally:
+        loop.close()
+    return chunks, size
+
+
+@pytest.fixture
+def many_users(db_session, auth_user):
+    auth_user.is_superuser = True
+    db_session.commit()
+    now = datetime.utcnow()
+    db_session.execute(insert(User.__table__), [
+        {"sub": str(uuid4()), "email": f"user{i}@email.com", "full_name": "Test User", "given_name": "Test",
+         "timezone": "Europe/London", "version": 1, "created": now, "modified": now, "deleted": False}
+        for i in range(20000)
+    ])
+    db_session.commit()
+
+
+def test_export_users_memory_stays_flat(client, many_users):
+    tracemalloc.start()
+    try:
+        chunks, size = export(client.app, b"batch_size=500")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # One chunk per batch, plus the end of the body
+    assert chunks == 20001 // 500 + 2
+    assert size > 5 * 1024 * 1024
+    # Only a few batches are held at a time, not the whole export
+    assert peak < size / 3
+
+
+def test_export_users_stops_on_disconnect(client, many_users):
+    chunks, size = export(client.app, b"batch_size=500", disconnect_after=2)
+
+    # The batch read after the disconnect isn't sent, only the end of the body
+    assert chunks == 3
+    assert size < 1024 * 1024
@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+
+from src.api.jwks import JWKS, JWKSProvider
+
+KEY_1 = {"kid": "key-1", "kty": "RSA", "alg": "RS256", "e": "AQAB", "n": "abc"}
+KEY_2 = {"kid": "key-2", "kty": "RSA", "alg": "RS256", "e": "AQAB", "n": "def"}
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeHttp:
+    def __init__(self, *keys, delay: float = 0):
+        self.keys = list(keys)
+        self.delay = delay
+        self.calls = 0
+
+    def get(self, url, timeout=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        return FakeResponse({"keys": self.keys})
+
+
+def test_keys_loaded_lazily_and_cached():
+    http = FakeHttp(KEY_1)
+    provider = JWKSProvider("https://example.com/jwks.json", http=http)
+    assert http.calls == 0
+
+    assert provider.get_key("key-1") == KEY_1
+    assert provider.get_key("key-1") == KEY_1
+    assert http.calls == 1
+
+
+def test_unknown_kid_refetches_once():
+    http = FakeHttp(KEY_1)
+    provider = JWKSProvider("https://example.com/jwks.json", http=http, min_refetch_interval=0)
+    assert provider.get_key("key-1") == KEY_1
+
+    http.keys.append(KEY_2)
+    assert provider.get_key("key-2") == KEY_2
+    assert http.calls == 2
+
+    # Rate limited, so unknown kids can't trigger a fetch on every request
+    provider.min_refetch_interval = 60
+    assert provider.get_key("unknown") is None
+    assert http.calls == 2
+
+
+def test_concurrent_fetches_are_single_flight():
+    http = FakeHttp(KEY_1, delay=0.1)
+    provider = JWKSProvider("https://example.com/jwks.json", http=http)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(provider.get_key("key-1"))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [KEY_1] * 10
+    assert http.calls == 1
+
+
+def test_refreshes_in_background_when_due():
+    http = FakeHttp(KEY_1)
+    provider = JWKSProvider("https://example.com/jwks.json", http=http, ttl=60, refresh_ahead=60,
+                            min_refetch_interval=0)
+    assert provider.get_key("key-1") == KEY_1
+
+    http.keys = [KEY_2]
+    # The current keys are served while the refresh runs
+    assert provider.get_key("key-1") == KEY_1
+
+    deadline = time.time() + 2
+    while "key-2" not in provider.keys and time.time() < deadline:
+        time.sleep(0.01)
+    assert provider.keys == {"key-2": KEY_2}
+
+
+def test_file_and_static_sources(tmp_path):
+    path = tmp_path / "jwks.json"
+    path.write_text(json.dumps({"keys": [KEY_1]}))
+
+    assert JWKSProvider(path=str(path)).get_key("key-1") == KEY_1
+
+    static = JWKSProvider(jwks=JWKS(keys=[KEY_2]))
+    assert not static.needs_fetch("unknown")
+    assert static.get_key("key-2") == KEY_2
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jose import jwk, jwt
+from starlette.requests import Request
+
+from src.api.JWTBearer import JWKS, JWTBearer
+
+
+@pytest.fixture(scope="module")
+def rsa_key():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+@pytest.fixture(scope="module")
+def jwks(rsa_key):
+    public_jwk = jwk.construct(rsa_key, "RS256").public_key().to_dict()
+    return JWKS(keys=[{**{k: str(v) for k, v in public_jwk.items()}, "kid": "test-kid"}])
+
+
+def make_token(rsa_key: str, sub: str = "test-sub", exp: float = None) -> str:
+    claims = {"sub": sub, "exp": int(exp or time.time() + 3600)}
+    return jwt.encode(claims, rsa_key, algorithm="RS256", headers={"kid": "test-kid"})
+
+
+def make_request(token: str) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+    })
+
+
+def authenticate(bearer: JWTBearer, token: str):
+    # A private loop rather than asyncio.run, which would unset the main thread's loop used by TestClient
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(bearer(make_request(token)))
+    finally:
+        loop.close()
+
+
+def test_verified_tokens_are_cached(rsa_key, jwks):
+    bearer = JWTBearer(jwks)
+    token = make_token(rsa_key)
+
+    credentials = authenticate(bearer, token)
+    assert credentials.claims["sub"] == "test-sub"
+    assert authenticate(bearer, token) is credentials
+
+    stats = bearer.token_cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 1
+
+
+def test_invalid_signature_is_not_cached(rsa_key, jwks):
+    bearer = JWTBearer(jwks)
+    header, claims, _ = make_token(rsa_key).split(".")
+    _, _, other_signature = make_token(rsa_key, sub="other-sub").split(".")
+
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            authenticate(bearer, f"{header}.{claims}.{other_signature}")
+    assert len(bearer.token_cache) == 0
+
+
+def test_cached_token_expires_with_exp_claim(rsa_key, jwks, monkeypatch):
+    bearer = JWTBearer(jwks)
+    exp = int(time.time()) + 60
+    token = make_token(rsa_key, exp=exp)
+    cache_key = hashlib.sha256(token.encode()).digest()
+
+    authenticate(bearer, token)
+    assert bearer.token_cache.get(cache_key) is not None
+
+    # Move the clock past `exp` rather than sleeping until then
+    monkeypatch.setattr(time, "time", lambda: exp + 1)
+    assert bearer.token_cache.get(cache_key) is None
+
+
+@pytest.mark.parametrize("verify_in", ["thread", "process"])
+def test_verification_offloaded_to_pool(rsa_key, jwks, verify_in):
+    bearer = JWTBearer(jwks, token_cache_size=0, verify_in=verify_in, verify_workers=1)
+    try:
+        assert authenticate(bearer, make_token(rsa_key)).claims["sub"] == "test-sub"
+
+        header, claims, _ = make_token(rsa_key).split(".")
+        _, _, other_signature = make_token(rsa_key, sub="other-sub").split(".")
+        with pytest.raises(HTTPException):
+            authenticate(bearer, f"{header}.{claims}.{other_signature}")
+    finally:
+        bearer.shutdown()
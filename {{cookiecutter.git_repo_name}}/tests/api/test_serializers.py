@@ -0,0 +1,55 @@
+from datetime import datetime
+from typing import Dict
+from uuid import uuid4
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+from src.api.serializers import OrmSerializer, get_serializer
+from src.orm import schemas
+from src.orm.models import User
+
+
+def make_user(id: int, **kwargs) -> User:
+    return User(**{
+        "id": id,
+        "sub": str(uuid4()).upper(),
+        "full_name": "Zoë Tëst",
+        "given_name": "Zoë",
+        "email": f"user{id}@email.com",
+        "timezone": "Europe/Paris",
+        "notifications_enabled": True,
+        "email_enabled": False,
+        "is_active": True,
+        "is_superuser": False,
+        "created": datetime(2021, 1, 2, 3, 4, 5, 678901),
+        "modified": datetime(2021, 1, 2, 3, 4, 5),
+        "deleted": False,
+        "version": 1,
+        **kwargs,
+    })
+
+
+def test_output_identical_to_response_model():
+    users = [make_user(1), make_user(2, age=42, gender=1, full_name=None)]
+
+    expected = JSONResponse(jsonable_encoder([schemas.User.from_orm(user) for user in users])).body
+    assert get_serializer(schemas.User).dumps(users) == expected
+
+    page = {"items": users, "next_cursor": "abc"}
+    expected = JSONResponse(jsonable_encoder(schemas.UserPage(items=page["items"], next_cursor="abc"))).body
+    assert get_serializer(schemas.UserPage).dumps(page) == expected
+
+
+def test_serializer_built_once_per_schema():
+    assert get_serializer(schemas.User) is get_serializer(schemas.User)
+
+
+def test_unsupported_field_type():
+    class Unsupported(BaseModel):
+        data: Dict[str, int]
+
+    with pytest.raises(TypeError):
+        OrmSerializer(Unsupported)
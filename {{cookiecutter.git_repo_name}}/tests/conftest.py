@@ -1,31 +1,48 @@
 import os
+import tempfile
 from datetime import datetime, timedelta
 from typing import Any, Generator
 from uuid import uuid4
 
 import pytest
-from src.orm.models import Base, Competition, Organization, Cause, CompetitionMember
+from src.orm.models import Base
 from src.main import app as main_app
-from src.api.deps import get_db, auth
+from src.api.deps import get_async_db, get_db, auth
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from src.api.JWTBearer import JWTAuthorizationCredentials
+from src.orm.async_session import to_async_url
+from src.orm.instrumentation import instrument_queries
 from src.orm.models import User
+from src.services.response_cache import response_cache
 
 
-# Default to using sqlite in memory for fast tests.
+# Default to using a sqlite file for fast tests, so the sync engine used to set up test data and the
+# async (aiosqlite) engine used by the app see the same database.
 # Can be overridden by environment variable for testing in CI against other
 # database engines
-SQLALCHEMY_DATABASE_URL = os.getenv('TEST_DATABASE_URL', "sqlite://")
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    'TEST_DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+)
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+# NullPool since async connections can't be shared between the event loops of different test clients.
+async_engine = create_async_engine(to_async_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+
+instrument_queries(engine)
+instrument_queries(async_engine.sync_engine)
 
 Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestSession = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, class_=AsyncSession, bind=async_engine
+)
 
 
 @pytest.fixture(autouse=True)
@@ -37,37 +54,27 @@ def app() -> Generator[FastAPI, Any, None]:
     _app = main_app
     yield _app
     Base.metadata.drop_all(engine)
+    response_cache.clear()
 
 
 @pytest.fixture(autouse=True)
 def db_session(app: FastAPI) -> Generator[Session, Any, None]:
     """
-    Creates a fresh sqlalchemy session for each test that operates in a
-    transaction. The transaction is rolled back at the end of each test ensuring
-    a clean state.
+    Creates a fresh sqlalchemy session for each test. Commits are visible to the
+    app's async sessions, and the `app` fixture drops all tables at the end of
+    each test ensuring a clean state.
     """
-
-    # connect to the database
-    connection = engine.connect()
-    # begin a non-ORM transaction
-    transaction = connection.begin()
-    # bind an individual Session to the connection
-    session = Session(bind=connection)
+    session = Session()
     yield session  # use the session in tests.
     session.close()
-    # rollback - everything that happened with the
-    # Session above (including calls to commit())
-    # is rolled back.
-    transaction.rollback()
-    # return connection to the Engine
-    connection.close()
 
 
 @pytest.fixture()
 def client(app: FastAPI, db_session: Session, user_sub) -> Generator[TestClient, Any, None]:
     """
     Create a new FastAPI TestClient that uses the `db_session` fixture to override
-    the `get_db` dependency that is injected into routes.
+    the `get_db` dependency, and the test database for the `get_async_db` dependency
+    that is injected into routes.
     """
 
     def _get_test_db():
@@ -76,6 +83,10 @@ def client(app: FastAPI, db_session: Session, user_sub) -> Generator[TestClient,
         finally:
             pass
 
+    async def _get_test_async_db():
+        async with AsyncTestSession() as session:
+            yield session
+
     def _override_auth():
         return JWTAuthorizationCredentials(
             claims={"sub": user_sub},
@@ -87,6 +98,7 @@ def client(app: FastAPI, db_session: Session, user_sub) -> Generator[TestClient,
 
     app.dependency_overrides[auth] = _override_auth
     app.dependency_overrides[get_db] = _get_test_db
+    app.dependency_overrides[get_async_db] = _get_test_async_db
     with TestClient(app) as client:
         yield client
 
@@ -0,0 +1,150 @@
+import contextlib
+import io
+import json
+import logging
+import sys
+import time
+
+import pytest
+
+from src.core import init_logging
+from src.core import logging as core_logging
+from src.core.logging import JsonFormatter, RateLimitFilter, SamplingFilter, stop_logging
+
+
+@pytest.fixture
+def restore_logging():
+    yield
+    stop_logging()
+    # Against the real stdout: a capsys one is closed once the test is over
+    with contextlib.redirect_stdout(sys.__stdout__):
+        init_logging()
+
+
+def make_record(level: int = logging.INFO, msg: str = "Hello %s", args: tuple = ("world",), exc_info=None):
+    return logging.LogRecord("test", level, "test_logging.py", 12, msg, args, exc_info, func="handler")
+
+
+def test_json_formatter():
+    entry = json.loads(JsonFormatter().format(make_record()))
+
+    assert entry["message"] == "Hello world"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "test"
+    assert "caller" not in entry
+
+
+def test_json_formatter_caller_and_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record(level=logging.ERROR, exc_info=sys.exc_info())
+
+    entry = json.loads(JsonFormatter(caller=True).format(record))
+
+    assert entry["caller"] == "test_logging.py:12|handler()"
+    assert "ValueError: boom" in entry["exc_info"]
+
+
+def test_rate_limit_filter():
+    rate_limit = RateLimitFilter(rate=0.001, burst=2)
+
+    passed = [rate_limit.filter(make_record()) for _ in range(5)]
+
+    assert passed == [True, True, False, False, False]
+    assert rate_limit.dropped == 3
+    # Warnings are never dropped
+    assert rate_limit.filter(make_record(level=logging.WARNING))
+
+
+def test_sampling_filter():
+    assert not SamplingFilter(rate=0).filter(make_record())
+    assert SamplingFilter(rate=0).filter(make_record(level=logging.ERROR))
+    assert SamplingFilter(rate=1).filter(make_record())
+    # Only the named logger and its children are sampled
+    assert SamplingFilter(rate=0, name="other").filter(make_record())
+    assert SamplingFilter(rate=0, name="te").filter(make_record())
+    assert not SamplingFilter(rate=0, name="test").filter(make_record())
+
+
+def test_filters_apply_to_child_loggers(capsys, restore_logging):
+    init_logging(caller=False, sample_rates={"test.parent": 0}, rate_limits={"test.limited": 0.001})
+
+    logging.getLogger("test.parent.child").info("Sampled out")
+    logging.getLogger("test.parent").info("Sampled out")
+    logging.getLogger("test.parent.child").warning("Kept warning")
+    logging.getLogger("test.parentless").info("Kept")
+    for i in range(3):
+        logging.getLogger("test.limited.child").info(f"Limited {i}")
+
+    lines = capsys.readouterr().out.splitlines()
+    assert not any("Sampled out" in line for line in lines)
+    assert [line.rsplit("|", 1)[-1] for line in lines] == ["Kept warning", "Kept", "Limited 0"]
+
+
+def test_init_logging_json_without_caller(capsys, restore_logging):
+    init_logging(log_format="json", caller=False)
+
+    logging.getLogger("test").info("Hello %s", "world")
+
+    entry = json.loads(capsys.readouterr().out)
+    assert entry["message"] == "Hello world"
+    assert "caller" not in entry
+    assert logging._srcfile is None
+
+
+def test_init_logging_queue(capsys, restore_logging):
+    init_logging(queue=True, caller=False, sample_rates={"test.sampled": 0})
+    args = ["world"]
+
+    logging.getLogger("test").info("Hello %s", args)
+    # The record is queued with its message already rendered
+    args.append("again")
+    logging.getLogger("test.sampled").info("Dropped")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("test").exception("Failed")
+    stop_logging()
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].endswith("|INFO|test|Hello ['world']")
+    assert lines[1].endswith("|ERROR|test|Failed")
+    assert "ValueError: boom" in lines[-1]
+    assert not any("Dropped" in line for line in lines)
+
+
+class SlowStream(io.StringIO):
+    def write(self, s: str) -> int:
+        time.sleep(0.001)
+        return super().write(s)
+
+
+def test_stop_logging_full_queue(monkeypatch, restore_logging):
+    stream = SlowStream()
+    monkeypatch.setattr(sys, "stdout", stream)
+    init_logging(queue=True, queue_size=10, caller=False)
+    queue_handler = logging.getLogger().handlers[0]
+
+    for i in range(200):
+        logging.getLogger("test").info(f"Record {i}")
+    stop_logging()
+
+    assert core_logging._listener is None
+    assert queue_handler.dropped > 0
+    assert len(stream.getvalue().splitlines()) == 200 - queue_handler.dropped
+
+
+def test_init_logging_queue_filters_before_queueing(monkeypatch, restore_logging):
+    stream = SlowStream()
+    monkeypatch.setattr(sys, "stdout", stream)
+    init_logging(queue=True, queue_size=10, caller=False, sample_rates={"test.hot": 0})
+    queue_handler = logging.getLogger().handlers[0]
+
+    for i in range(200):
+        logging.getLogger("test.hot").info(f"Sampled out {i}")
+    logging.getLogger("test.hot").error("Kept error")
+    stop_logging()
+
+    assert queue_handler.dropped == 0
+    assert stream.getvalue().splitlines()[-1].endswith("|ERROR|test.hot|Kept error")
@@ -0,0 +1,200 @@
+import functools
+import json
+import os
+from datetime import datetime
+from typing import List
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import create_engine, func, insert, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from src.core.script import Checkpoint, Chunk, Script, id_ranges, key_ranges
+from src.orm.models import Base, User
+from src.services.crud.watermark_crud import WatermarkCrud
+
+
+def make_session(url: str) -> Session:
+    return sessionmaker(bind=create_engine(url))()
+
+
+def deactivate(session: Session, chunk: Chunk) -> int:
+    return session.execute(
+        update(User).where(User.id >= chunk.start, User.id < chunk.end).values(is_active=False)
+    ).rowcount
+
+
+@pytest.fixture
+def db_url(tmp_path) -> str:
+    url = f"sqlite:///{tmp_path / 'script.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # Every third id is missing
+        connection.execute(insert(User.__table__), [
+            {"id": i, "sub": str(uuid4()), "email": f"user{i}@email.com", "version": 1, "is_active": True}
+            for i in range(1, 301) if i % 3
+        ])
+    engine.dispose()
+    return url
+
+
+def active_users(db_url: str) -> int:
+    session = make_session(db_url)
+    try:
+        return session.execute(select(func.count()).where(User.is_active.is_(True))).scalar()
+    finally:
+        session.close()
+
+
+def make_script(db_url: str, *args: str) -> Script:
+    return Script(["--config", "settings.toml", *args], session_factory=functools.partial(make_session, db_url))
+
+
+def test_id_ranges():
+    assert id_ranges(1, 25, 10) == [Chunk(0, 1, 11), Chunk(1, 11, 21), Chunk(2, 21, 26)]
+    assert id_ranges(None, None, 10) == []
+
+
+def test_key_ranges(db_url):
+    session = make_session(db_url)
+
+    chunks = key_ranges(session, User.id, 50)
+
+    # 200 rows in chunks of 50 rows, despite the gaps in the ids
+    assert [(chunk.start, chunk.end) for chunk in chunks] == [(1, 76), (76, 151), (151, 226), (226, None)]
+    session.close()
+
+
+def test_run_chunks_in_threads(db_url):
+    sessions = []
+
+    def session_factory():
+        sessions.append(make_session(db_url))
+        return sessions[-1]
+
+    script = Script(["--config", "settings.toml", "--workers", "3"], session_factory=session_factory)
+
+    summary = script.run_chunks(deactivate, id_ranges(1, 300, 25))
+
+    assert summary["chunks"] == 12
+    assert summary["rows"] == 200
+    assert active_users(db_url) == 0
+    # One session per worker thread, not per chunk
+    assert len(sessions) <= 3
+
+
+def test_run_chunks_in_processes(db_url):
+    script = make_script(db_url, "--workers", "2", "--executor", "process")
+
+    summary = script.run_chunks(deactivate, id_ranges(1, 300, 100))
+
+    assert summary["rows"] == 200
+    assert active_users(db_url) == 0
+
+
+def test_run_chunks_resumes_from_checkpoint(db_url, tmp_path):
+    checkpoint_path = str(tmp_path / "job.checkpoint")
+    chunks = id_ranges(1, 300, 50)
+    processed = []
+
+    def fail_on_third_chunk(session: Session, chunk: Chunk) -> int:
+        if chunk.index == 2:
+            raise ValueError("boom")
+        processed.append(chunk.index)
+        return deactivate(session, chunk)
+
+    with pytest.raises(Exception, match="Run again to resume"):
+        make_script(db_url, "--checkpoint", checkpoint_path).run_chunks(fail_on_third_chunk, chunks)
+
+    # The failed chunk was rolled back, the chunks after it were cancelled
+    assert processed == [0, 1]
+    assert active_users(db_url) == 200 - 67
+    with open(checkpoint_path) as f:
+        assert len(json.load(f)["done"]) == 2
+
+    processed.clear()
+    summary = make_script(db_url, "--checkpoint", checkpoint_path).run_chunks(
+        lambda session, chunk: processed.append(chunk.index) or deactivate(session, chunk), chunks
+    )
+
+    assert processed == [2, 3, 4, 5]
+    assert summary["skipped_chunks"] == 2
+    assert active_users(db_url) == 0
+    # A finished run starts over next time
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_checkpoint_ignores_unreadable_file(tmp_path):
+    path = tmp_path / "job.checkpoint"
+    path.write_text("{not json")
+
+    checkpoint = Checkpoint(str(path))
+    checkpoint.mark_done(Chunk(0, 1, 11))
+
+    assert Checkpoint(str(path)).is_done(Chunk(0, 1, 11))
+    assert not Checkpoint(str(path)).is_done(Chunk(0, 1, 21))
+
+
+def test_run_incremental(db_url):
+    script = make_script(db_url, "--chunk-size", "30")
+    seen = []
+
+    def collect(session: Session, rows: List[User]) -> int:
+        seen.extend(row.id for row in rows)
+        return len(rows)
+
+    summary = script.run_incremental("collect", User, collect, settle_seconds=0)
+
+    assert summary["rows"] == 200
+    assert summary["chunks"] == 7
+    assert sorted(seen) == sorted(set(seen))
+
+    # Only rows changed since the last run are read
+    seen.clear()
+    assert script.run_incremental("collect", User, collect, settle_seconds=0)["rows"] == 0
+    session = make_session(db_url)
+    session.execute(update(User).where(User.id.in_([4, 5])).values(modified=datetime.utcnow()))
+    session.commit()
+    session.close()
+    assert script.run_incremental("collect", User, collect, settle_seconds=0)["rows"] == 2
+    assert seen == [4, 5]
+
+    # Other jobs have their own watermark
+    assert script.run_incremental("other", User, collect, settle_seconds=0)["rows"] == 200
+
+
+def test_run_incremental_advances_watermark_with_each_batch(db_url):
+    script = make_script(db_url, "--chunk-size", "50")
+    batches = []
+
+    def fail_on_third_batch(session: Session, rows: List[User]):
+        if len(batches) == 2:
+            raise ValueError("boom")
+        batches.append([row.id for row in rows])
+        session.execute(update(User).where(User.id.in_(batches[-1])).values(is_active=False))
+
+    with pytest.raises(ValueError):
+        script.run_incremental("deactivate", User, fail_on_third_batch, settle_seconds=0)
+    assert active_users(db_url) == 100
+
+    session = make_session(db_url)
+    watermark = WatermarkCrud(session).get_or_create(job="deactivate")
+    assert watermark.last_id == batches[1][-1]
+    session.close()
+
+    # The run resumes after the last committed batch
+    resumed = []
+    script.run_incremental("deactivate", User, lambda session, rows: resumed.extend(row.id for row in rows),
+                           settle_seconds=0)
+    assert not set(resumed[:100]) & set(batches[0] + batches[1])
+    # Rows the failed run changed got a new `modified`, so they come up again
+    assert resumed[100:] == batches[0] + batches[1]
+
+
+def test_run_incremental_leaves_recent_changes(db_url):
+    script = make_script(db_url)
+
+    summary = script.run_incremental("settle", User, lambda session, rows: len(rows), settle_seconds=60)
+
+    assert summary["rows"] == 0
@@ -0,0 +1,131 @@
+import importlib
+import os
+import threading
+
+import pytest
+from cryptography.fernet import Fernet
+
+from src.core.settings import FrozenSettings, Settings, SSMParameterCache, compile_settings
+
+# `src.core.settings` is shadowed by the global settings object re-exported from `src.core`
+settings_module = importlib.import_module("src.core.settings")
+
+
+class StubSSMClient:
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def get_parameters(self, Names, WithDecryption):
+        with self._lock:
+            self.calls.append(Names)
+        return {
+            "Parameters": [{"Name": name, "Value": self.parameters[name]} for name in Names if name in self.parameters],
+            "InvalidParameters": [name for name in Names if name not in self.parameters],
+        }
+
+
+def write_settings(tmp_path, count: int) -> str:
+    lines = ['[default]', 'project_name = "test"', '', '    [default.secrets]']
+    lines += [f'    secret_{i} = "ssm:/test/secret_{i}"' for i in range(count)]
+    lines += ['', '[local]', 'overridden = "plain"', '', '    [local.secrets]', '    secret_0 = "local value"']
+    path = tmp_path / "settings.toml"
+    path.write_text("\n".join(lines))
+    return str(path)
+
+
+def test_ssm_parameters_resolved_in_batches(tmp_path):
+    ssm = StubSSMClient({f"/test/secret_{i}": f"value {i}" for i in range(1, 25)})
+    settings = Settings(write_settings(tmp_path, 25), env="local", ssm_client=ssm)
+
+    # secret_0 is overridden by the local table, so it's never fetched
+    assert settings.secrets.secret_0 == "local value"
+    assert settings.secrets.secret_24 == "value 24"
+    assert sorted(len(names) for names in ssm.calls) == [4, 10, 10]
+
+
+def test_ssm_parameters_cached_locally(tmp_path):
+    config_filepath = write_settings(tmp_path, 3)
+    ssm_cache = SSMParameterCache(str(tmp_path / "ssm.cache"), Fernet.generate_key())
+    ssm = StubSSMClient({"/test/secret_1": "value 1", "/test/secret_2": "value 2"})
+
+    Settings(config_filepath, env="local", ssm_client=ssm, ssm_cache=ssm_cache)
+    assert len(ssm.calls) == 1
+    assert b"value 1" not in (tmp_path / "ssm.cache").read_bytes()
+
+    settings = Settings(config_filepath, env="local", ssm_client=ssm, ssm_cache=ssm_cache)
+    assert len(ssm.calls) == 1
+    assert settings.secrets.secret_2 == "value 2"
+
+    ssm_cache.ttl = 0
+    Settings(config_filepath, env="local", ssm_client=ssm, ssm_cache=ssm_cache)
+    assert len(ssm.calls) == 2
+
+
+def test_ssm_cache_keeps_fetch_time_of_cached_parameters(tmp_path, monkeypatch):
+    config_filepath = write_settings(tmp_path, 3)
+    ssm_cache = SSMParameterCache(str(tmp_path / "ssm.cache"), Fernet.generate_key(), ttl=100)
+    now = [1000.0]
+    monkeypatch.setattr(settings_module.time, "time", lambda: now[0])
+    # secret_2 doesn't exist yet, so the next load fetches it
+    ssm = StubSSMClient({"/test/secret_1": "value 1"})
+    Settings(config_filepath, env="local", ssm_client=ssm, ssm_cache=ssm_cache)
+
+    now[0] += 90
+    ssm.parameters.update({"/test/secret_1": "rotated", "/test/secret_2": "value 2"})
+    settings = Settings(config_filepath, env="local", ssm_client=ssm, ssm_cache=ssm_cache)
+    assert ssm.calls[-1] == ["/test/secret_2"]
+    assert settings.secrets.secret_1 == "value 1"
+
+    # Saving secret_2 didn't restart secret_1's TTL
+    now[0] += 20
+    settings = Settings(config_filepath, env="local", ssm_client=ssm, ssm_cache=ssm_cache)
+    assert ssm.calls[-1] == ["/test/secret_1"]
+    assert settings.secrets.secret_1 == "rotated"
+
+
+def test_compiled_settings_are_frozen(tmp_path, monkeypatch):
+    monkeypatch.setenv("SECRETS_TOKEN", "from env")
+    path = tmp_path / "settings.toml"
+    path.write_text('[default]\nproject_name = "test"\n\n    [default.secrets]\n    token = "default"\n    retries = 3\n')
+
+    settings = Settings(str(path), env="local").compile()
+    assert isinstance(settings.secrets, FrozenSettings)
+    assert settings.secrets.token == "from env"
+    assert settings["secrets"]["retries"] == 3
+    assert settings.env == "local"
+    with pytest.raises(AttributeError):
+        settings.project_name = "changed"
+
+
+def test_compiled_settings_snapshot_skips_parsing(tmp_path, monkeypatch):
+    config_filepath = write_settings(tmp_path, 2)
+    cache_dir = str(tmp_path / "cache")
+    ssm = StubSSMClient({"/test/secret_1": "value 1"})
+    monkeypatch.setenv("SECRETS_SECRET_0", "env value")
+
+    first = compile_settings(config_filepath, env="local", cache_dir=cache_dir, ssm_client=ssm)
+    snapshot = open(os.path.join(cache_dir, os.listdir(cache_dir)[0])).read()
+    assert "env value" not in snapshot and "value 1" not in snapshot
+
+    def fail_parse(*args):
+        raise AssertionError("settings file parsed")
+
+    monkeypatch.setattr(settings_module, "parse", fail_parse)
+    monkeypatch.setenv("SECRETS_SECRET_0", "new env value")
+    second = compile_settings(config_filepath, env="local", cache_dir=cache_dir, ssm_client=ssm)
+    assert second.to_dict() == {**first.to_dict(), "secrets": {"secret_0": "new env value", "secret_1": "value 1"}}
+    assert len(ssm.calls) == 2
+
+    # Unsetting a variable the settings refer to invalidates the snapshot
+    monkeypatch.delenv("SECRETS_SECRET_0")
+    with pytest.raises(AssertionError):
+        compile_settings(config_filepath, env="local", cache_dir=cache_dir, ssm_client=ssm)
+
+    monkeypatch.undo()
+    monkeypatch.setattr(settings_module, "parse", fail_parse)
+    with open(config_filepath, "a") as f:
+        f.write("\nadded = 1\n")
+    with pytest.raises(AssertionError):
+        compile_settings(config_filepath, env="local", cache_dir=cache_dir, ssm_client=ssm)
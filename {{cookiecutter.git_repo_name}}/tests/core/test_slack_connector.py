@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from src.core import FrozenSettings
+from src.core.slack_connector import FakeWebClient, SlackAlertDispatcher, SlackConnector
+
+
+def make_settings(**slack) -> FrozenSettings:
+    return FrozenSettings({
+        "environment": "test",
+        "project_name": "starter",
+        "slack": {"api_token": "", "enabled": True, "channel_id": "C123", "window": 0.05, **slack},
+    })
+
+
+@pytest.fixture
+def client():
+    return FakeWebClient()
+
+
+def test_send_slack_alert_does_not_block(client):
+    connector = SlackConnector(make_settings(window=10), client=client)
+
+    start = time.perf_counter()
+    connector.send_slack_alert("Something failed")
+    assert time.perf_counter() - start < 0.1
+    assert client.messages == []
+
+    assert connector.close(timeout=1)
+    assert len(client.messages) == 1
+    message = client.messages[0]
+    assert message["channel"] == "C123"
+    assert message["attachments"][0]["text"] == "Something failed"
+    assert message["attachments"][0]["pretext"] == "*Alert from `TEST` `starter`*"
+
+
+def test_send_slack_alert_disabled(client):
+    connector = SlackConnector(make_settings(enabled=False), client=client)
+
+    connector.send_slack_alert("Something failed")
+
+    assert connector.close(timeout=1)
+    assert client.calls == 0
+
+
+def test_alerts_in_window_are_batched_and_coalesced(client):
+    connector = SlackConnector(make_settings(window=10), client=client)
+
+    for _ in range(50):
+        connector.send_slack_alert("Same error")
+    connector.send_slack_alert("Other error")
+
+    assert connector.flush(timeout=1)
+    assert client.calls == 1
+    attachments = client.messages[0]["attachments"]
+    assert [a["text"] for a in attachments] == ["Same error", "Other error"]
+    assert attachments[0]["footer"] == "Raised 50 times"
+    assert "footer" not in attachments[1]
+    assert connector.dispatcher.coalesced == 49
+    connector.close()
+
+
+def test_rate_limited_post_is_retried_after_retry_after():
+    client = FakeWebClient(errors=[FakeWebClient.rate_limited(0.2)])
+    dispatcher = SlackAlertDispatcher(client, window=0)
+
+    start = time.perf_counter()
+    dispatcher.submit("C123", {"text": "Something failed"})
+    assert dispatcher.close(timeout=2)
+
+    assert time.perf_counter() - start >= 0.2
+    assert client.calls == 2
+    assert dispatcher.sent == 1
+
+
+def test_server_errors_back_off_exponentially():
+    client = FakeWebClient(errors=[FakeWebClient.error("internal_error", 500)] * 3)
+    dispatcher = SlackAlertDispatcher(client, window=0, max_retries=2, backoff=0.01)
+
+    dispatcher.submit("C123", {"text": "Something failed"})
+    assert dispatcher.close(timeout=2)
+
+    assert client.calls == 3
+    assert dispatcher.sent == 0
+    assert dispatcher.failed == 1
+
+
+def test_permanent_errors_are_not_retried():
+    client = FakeWebClient(errors=[FakeWebClient.error("channel_not_found")])
+    dispatcher = SlackAlertDispatcher(client, window=0)
+
+    dispatcher.submit("C123", {"text": "Something failed"})
+    assert dispatcher.close(timeout=1)
+
+    assert client.calls == 1
+    assert dispatcher.failed == 1
+
+
+def test_full_queue_drops_alerts():
+    posting, release = threading.Event(), threading.Event()
+
+    class SlowClient(FakeWebClient):
+        def chat_postMessage(self, **kwargs):
+            posting.set()
+            release.wait(1)
+            return super().chat_postMessage(**kwargs)
+
+    client = SlowClient()
+    dispatcher = SlackAlertDispatcher(client, window=0, max_queue=2)
+
+    # Keep the thread busy posting the first alert while the queue fills up
+    dispatcher.submit("C123", {"text": "Error"})
+    assert posting.wait(1)
+    for i in range(10):
+        dispatcher.submit("C123", {"text": f"Error {i}"})
+    release.set()
+
+    assert dispatcher.close(timeout=1)
+    assert dispatcher.dropped == 8
+    assert dispatcher.sent == 3
@@ -0,0 +1,33 @@
+import re
+
+from sqlalchemy import text
+
+from src.orm.instrumentation import QueryStats, current_query_stats, statement_shape
+
+
+def test_statement_shape_collapses_parameter_lists():
+    assert statement_shape("SELECT * FROM user\n WHERE id IN (?, ?, ?)") == "SELECT * FROM user WHERE id IN (?)"
+    assert statement_shape("SELECT * FROM user WHERE id IN (%(id_1)s, %(id_2)s)") == \
+        statement_shape("SELECT * FROM user WHERE id IN (%(id_1)s, %(id_2)s, %(id_3)s)")
+
+
+def test_queries_recorded_in_current_request(db_session):
+    stats = QueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        for i in range(3):
+            db_session.execute(text("SELECT :i"), {"i": i})
+    finally:
+        current_query_stats.reset(token)
+    db_session.execute(text("SELECT 1"))
+
+    assert stats.count == 3
+    assert stats.slowest_statement == "SELECT ?"
+    assert stats.repeated(2) == [("SELECT ?", 3)]
+    assert stats.repeated(3) == []
+
+
+def test_server_timing_header(client, auth_user):
+    response = client.get("/api/v1/users/me")
+    match = re.fullmatch(r'db;dur=[\d.]+;desc="(\d+) queries", app;dur=[\d.]+', response.headers["server-timing"])
+    assert match and int(match.group(1)) >= 1
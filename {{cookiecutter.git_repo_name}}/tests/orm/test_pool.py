@@ -0,0 +1,35 @@
+from sqlalchemy import create_engine
+
+from src.orm.pool import InstrumentedQueuePool, ping_idle_connections
+
+
+def make_engine(tmp_path, idle_seconds: float):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool,
+                           pool_size=1, max_overflow=0)
+    ping_idle_connections(engine, idle_seconds)
+    return engine
+
+
+def test_pool_records_checkouts(tmp_path):
+    engine = make_engine(tmp_path, idle_seconds=60)
+    for _ in range(3):
+        with engine.connect() as connection:
+            connection.exec_driver_sql("SELECT 1")
+
+    status = engine.pool.status_dict()
+    assert status["checkouts"] == 3
+    assert status["checked_out"] == 0
+    assert sum(status["checkout_latency"].values()) == 3
+    # Connections weren't idle long enough to be checked
+    assert status["pings"] == 0
+
+
+def test_idle_connections_are_pinged(tmp_path):
+    engine = make_engine(tmp_path, idle_seconds=0)
+    for _ in range(3):
+        with engine.connect() as connection:
+            connection.exec_driver_sql("SELECT 1")
+
+    # Every checkout after the first reuses an idle connection
+    assert engine.pool.stats.pings == 2
+    assert engine.pool.stats.ping_failures == 0
@@ -0,0 +1,79 @@
+import json
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from src.orm.instrumentation import instrument_queries
+from src.orm.models import Base, User
+from src.orm.slow_query_log import SlowQueryLog, redact
+from src.services.crud.user_crud import UserCrud
+
+
+def make_session(tmp_path, slow_query_log: SlowQueryLog) -> Session:
+    engine = create_engine(f"sqlite:///{tmp_path / 'slow.db'}")
+    Base.metadata.create_all(engine)
+    instrument_queries(engine, slow_query_log)
+    return Session(bind=engine)
+
+
+def read_log(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_slow_queries_captured_with_plan(tmp_path):
+    log_path = tmp_path / "slow_queries.log"
+    session = make_session(tmp_path, SlowQueryLog(str(log_path), threshold_ms=0))
+    session.add(User(sub="sub", email="secret@email.com", full_name="test user", given_name="test"))
+    session.commit()
+
+    UserCrud(session).get_multi(limit=10)
+    UserCrud(session).get_by_email(email="secret@email.com")
+
+    entries = read_log(log_path)
+    assert "secret@email.com" not in log_path.read_text()
+
+    get_multi = next(e for e in entries if "ORDER BY" in e["statement"])
+    assert get_multi["call_site"].startswith("src.services.crud.base_crud:")
+    assert get_multi["call_site"].endswith("get_multi()")
+    assert "ix_user_deleted_created_id" in json.dumps(get_multi["explain"])
+
+    get_by_email = next(e for e in entries if "user.email = ?" in e["statement"])
+    assert get_by_email["call_site"].startswith("src.services.crud.user_crud:")
+    assert "<str>" in get_by_email["parameters"]
+
+    # Inserts are logged without a plan
+    assert next(e for e in entries if e["statement"].startswith("INSERT"))["explain"] is None
+
+
+def test_streamed_queries_not_explained(tmp_path, monkeypatch):
+    log_path = tmp_path / "slow_queries.log"
+    slow_query_log = SlowQueryLog(str(log_path), threshold_ms=0)
+    session = make_session(tmp_path, slow_query_log)
+    session.add(User(sub="sub", email="test@email.com", full_name="test user", given_name="test"))
+    session.commit()
+
+    def fail_plan(*args):
+        raise AssertionError("streamed query explained")
+
+    monkeypatch.setattr(slow_query_log, "_plan", fail_plan)
+    batches = list(UserCrud(session).stream_batches(batch_size=10))
+
+    assert len(batches[0]) == 1
+    entry = next(e for e in read_log(log_path) if "ORDER BY user.id" in e["statement"])
+    assert entry["explain"] is None
+
+
+def test_slow_queries_sampled(tmp_path):
+    log_path = tmp_path / "slow_queries.log"
+    slow_query_log = SlowQueryLog(str(log_path), threshold_ms=0, sample_rate=0)
+    session = make_session(tmp_path, slow_query_log)
+
+    UserCrud(session).get_multi()
+    assert slow_query_log.captured == 0
+    assert not log_path.exists()
+
+
+def test_redact():
+    assert redact({"email": "a@b.com", "age": 3, "x": None}) == {"email": "<str>", "age": "<int>", "x": None}
+    assert redact([(1,), (2,)], executemany=True) == "<2 rows>"
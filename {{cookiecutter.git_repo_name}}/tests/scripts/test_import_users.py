@@ -0,0 +1,100 @@
+import csv
+import json
+from typing import List
+
+from sqlalchemy.orm import Session
+
+from scripts.import_users import ImportUsers
+from src.orm.models import User
+
+
+def user_row(i: int, **fields) -> dict:
+    return {"sub": f"sub-{i}", "full_name": "Test User", "given_name": "Test", "email": f"user{i}@email.com",
+            "timezone": "Europe/London", **fields}
+
+
+def write_ndjson(path, rows: List) -> str:
+    path.write_text("".join((row if isinstance(row, str) else json.dumps(row)) + "\n" for row in rows))
+    return str(path)
+
+
+def import_users(db_session, path: str, *args: str) -> dict:
+    script = ImportUsers(["--config", "settings.toml", path, *args],
+                         session_factory=lambda: Session(bind=db_session.get_bind()))
+    return script.import_file()
+
+
+def test_import_users(db_session, tmp_path):
+    existing = User(sub="sub-0", full_name="Old Name", given_name="Old", email="user0@email.com",
+                    timezone="Europe/London")
+    db_session.add(existing)
+    db_session.commit()
+    created, version = existing.created, existing.version
+
+    path = write_ndjson(tmp_path / "users.ndjson", [
+        user_row(0, full_name="New Name"),
+        user_row(1),
+        user_row(2, timezone="Mars/Olympus_Mons"),
+        "{not json",
+        user_row(3, email="user1@email.com"),
+        user_row(4, age=30),
+    ])
+
+    summary = import_users(db_session, path, "--chunk-size", "4")
+
+    assert summary["rows"] == 3
+    assert summary["rejected"] == 3
+    assert summary["chunks"] == 2
+    db_session.expire_all()
+    assert {user.sub: user.full_name for user in db_session.query(User)} == {
+        "sub-0": "New Name", "sub-1": "Test User", "sub-4": "Test User",
+    }
+    # Updated in place
+    assert (existing.created, existing.version) == (created, version + 1)
+
+    with open(f"{path}.rejected") as f:
+        rejected = [json.loads(line) for line in f]
+    assert [rejection["line"] for rejection in rejected] == [3, 4, 5]
+    assert rejected[0]["errors"][0]["loc"] == ["timezone"]
+    assert rejected[1]["row"] == "{not json"
+    # Conflicts with user 1's email
+    assert rejected[2]["row"]["sub"] == "sub-3"
+
+
+def test_import_users_csv(db_session, tmp_path):
+    path = tmp_path / "users.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["sub", "full_name", "given_name", "email", "timezone", "age"])
+        writer.writeheader()
+        writer.writerows([user_row(1, age=""), user_row(2, age="41")])
+
+    summary = import_users(db_session, str(path))
+
+    assert summary["rows"] == 2
+    assert summary["rejected"] == 0
+    assert not (tmp_path / "users.csv.rejected").exists()
+    assert dict(db_session.query(User.sub, User.age)) == {"sub-1": None, "sub-2": 41}
+
+
+def test_reimport_leaves_unchanged_users(db_session, tmp_path):
+    path = write_ndjson(tmp_path / "users.ndjson", [user_row(i, age=30) for i in range(5)])
+    import_users(db_session, path)
+    versions = dict(db_session.query(User.sub, User.version))
+
+    # A dump without ages leaves them as they are
+    path = write_ndjson(tmp_path / "users.ndjson", [user_row(2, age=50)] + [user_row(i) for i in (0, 1, 3, 4)])
+    summary = import_users(db_session, path)
+
+    assert summary["rows"] == 5
+    assert dict(db_session.query(User.sub, User.version)) == {**versions, "sub-2": versions["sub-2"] + 1}
+    assert dict(db_session.query(User.sub, User.age)) == {"sub-0": 30, "sub-1": 30, "sub-2": 50, "sub-3": 30,
+                                                          "sub-4": 30}
+
+
+def test_import_repeated_sub_keeps_last_row(db_session, tmp_path):
+    path = write_ndjson(tmp_path / "users.ndjson", [user_row(1, age=20), user_row(1, age=21)])
+
+    summary = import_users(db_session, path)
+
+    assert summary["rejected"] == 0
+    assert db_session.query(User.age).filter(User.sub == "sub-1").scalar() == 21
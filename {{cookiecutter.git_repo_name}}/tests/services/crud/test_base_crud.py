@@ -0,0 +1,130 @@
+import pytest
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import IntegrityError
+
+from src.orm import schemas
+from src.orm.models import User
+from src.services.crud.base_crud import upsert_statement
+from src.services.crud.user_crud import UserCrud
+from tests.utils import capture_statements
+
+
+def test_update_writes_only_changed_columns(db_session, auth_user):
+    version = auth_user.version
+
+    with capture_statements(db_session) as statements:
+        UserCrud(db_session).update(
+            db_obj=auth_user, obj_in=schemas.UserUpdate(full_name="new name", email=auth_user.email)
+        )
+
+    updates = [statement for statement in statements if statement.startswith("UPDATE")]
+    assert len(updates) == 1
+    assert "full_name=" in updates[0] and "email=" not in updates[0]
+    assert auth_user.version == version + 1
+
+
+def test_noop_update_skips_write(db_session, auth_user):
+    version, modified = auth_user.version, auth_user.modified
+
+    with capture_statements(db_session) as statements:
+        UserCrud(db_session).update(
+            db_obj=auth_user, obj_in=schemas.UserUpdate(full_name=auth_user.full_name, age=auth_user.age)
+        )
+        UserCrud(db_session).update(db_obj=auth_user, obj_in={"unknown": 1})
+
+    assert statements == []
+    assert not db_session.dirty
+    assert (auth_user.version, auth_user.modified) == (version, modified)
+
+
+def test_get_changed_since(db_session):
+    crud = UserCrud(db_session)
+    users = [
+        crud.create(obj_in=schemas.UserCreate(
+            sub=f"sub-{i}", full_name="Test User", given_name="Test", email=f"user{i}@email.com",
+            timezone="Europe/London",
+        ))
+        for i in range(5)
+    ]
+    crud.remove(id=users[1].id)
+    crud.update(db_obj=users[0], obj_in={"full_name": "changed"})
+    order = [users[2], users[3], users[4], users[1], users[0]]
+
+    changed = crud.get_changed_since(limit=3)
+    assert changed == order[:3]
+
+    last = changed[-1]
+    changed = crud.get_changed_since(modified=last.modified, id=last.id, limit=3)
+    # Soft deleted rows are changes too
+    assert changed == order[3:]
+
+    assert crud.get_changed_since(until=users[2].modified) == []
+
+
+def test_bulk_upsert(db_session):
+    crud = UserCrud(db_session)
+    users = [
+        schemas.UserCreate(sub=f"sub-{i}", full_name="Test User", given_name="Test", email=f"user{i}@email.com",
+                           timezone="Europe/London")
+        for i in range(3)
+    ]
+    existing = crud.create(obj_in=users[0])
+
+    with capture_statements(db_session) as statements:
+        results = crud.bulk_upsert(objs_in=users, chunk_size=3)
+
+    # One executemany for the items setting the same fields
+    assert len([statement for statement in statements if statement.startswith("INSERT")]) == 1
+    assert [result.success for result in results] == [True] * 3
+    assert results[0].id == existing.id
+    db_session.expire_all()
+    # Unchanged, so not written
+    assert existing.version == 1
+
+    results = crud.bulk_upsert(objs_in=[users[1].copy(update={"age": 40}),
+                                        users[2].copy(update={"email": "user0@email.com"})])
+
+    assert [result.success for result in results] == [True, False]
+    assert (crud.get_by_sub(sub="sub-1").age, crud.get_by_sub(sub="sub-1").version) == (40, 2)
+
+    # Fields that aren't set keep their value
+    crud.bulk_upsert(objs_in=[users[1]])
+    db_session.expire_all()
+    assert (crud.get_by_sub(sub="sub-1").age, crud.get_by_sub(sub="sub-1").version) == (40, 2)
+
+    crud.bulk_upsert(objs_in=[users[1].copy(update={"age": None})])
+    db_session.expire_all()
+    assert (crud.get_by_sub(sub="sub-1").age, crud.get_by_sub(sub="sub-1").version) == (None, 3)
+
+
+def test_mysql_upsert_only_updates_same_natural_key():
+    stmt = upsert_statement(User.__table__, "sub", ["sub", "email", "full_name", "modified", "created", "version"],
+                            "mysql")
+
+    sql = " ".join(str(stmt.compile(dialect=mysql.dialect())).split())
+
+    update = sql.split("ON DUPLICATE KEY UPDATE")[1]
+    same_sub = "CASE WHEN (user.sub = VALUES(sub))"
+    assert f"email = {same_sub} THEN VALUES(email) ELSE user.email END" in update
+    assert f"full_name = {same_sub} THEN VALUES(full_name) ELSE user.full_name END" in update
+    assert f"version = {same_sub} THEN user.version + %s ELSE user.version END" in update
+    # The natural key and `created` are never updated
+    assert "created" not in update and ", sub = " not in update and not update.startswith(" sub = ")
+
+
+def test_create_unique(db_session):
+    crud = UserCrud(db_session)
+    user_in = schemas.UserCreate(sub="sub-1", full_name="Test User", given_name="Test", email="user1@email.com",
+                                 timezone="Europe/London")
+
+    with capture_statements(db_session) as statements:
+        user = crud.create_unique(obj_in=user_in)
+        # Readable after the commit without a refresh
+        assert (user.sub, user.version, user.deleted, user.notifications_enabled) == ("sub-1", 1, False, True)
+
+    assert len(statements) == 1
+    assert user in db_session and user.id == crud.get_by_sub(sub="sub-1").id
+
+    with pytest.raises(IntegrityError):
+        crud.create_unique(obj_in=user_in.copy(update={"email": "user2@email.com"}))
+    db_session.rollback()
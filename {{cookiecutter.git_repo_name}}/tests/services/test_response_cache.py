@@ -0,0 +1,52 @@
+from uuid import uuid4
+
+from starlette.responses import Response
+
+from src.orm.models import User
+from src.services.response_cache import MemoryBackend, ResponseCache, SQLiteBackend, response_cache
+
+
+def test_read_users_cached_until_write(db_session, client, auth_user):
+    auth_user.is_superuser = True
+    db_session.commit()
+
+    first = client.get("/api/v1/users/", params={"limit": 10})
+    hits = response_cache.stats()["hits"]
+    assert client.get("/api/v1/users/", params={"limit": 10}).content == first.content
+    assert response_cache.stats()["hits"] == hits + 1
+
+    # Different query params are a different entry
+    assert len(client.get("/api/v1/users/", params={"limit": 10, "offset": 1}).json()) == 0
+
+    db_session.add(User(sub=str(uuid4()), email="test2@email.com", full_name="test user 2", given_name="test 2"))
+    db_session.commit()
+    assert len(client.get("/api/v1/users/", params={"limit": 10}).json()) == 2
+
+    # Bulk Core updates invalidate too
+    client.patch("/api/v1/users/bulk", json=[{"id": auth_user.id, "age": 40}])
+    assert client.get("/api/v1/users/", params={"limit": 10}).json()[0]["age"] == 40
+
+
+def test_entry_not_stored_after_concurrent_invalidation(tmp_path):
+    for backend in (MemoryBackend(), SQLiteBackend(str(tmp_path / "cache.db"))):
+        cache = ResponseCache(backend)
+        generations = cache.generations("user")
+        cache.invalidate("user")
+        cache.set("key", Response(b"stale"), ["user"], generations)
+        assert cache.get("key") is None
+
+
+def test_sqlite_backend_shared_between_workers(tmp_path):
+    path = str(tmp_path / "cache.db")
+    worker_1, worker_2 = ResponseCache(SQLiteBackend(path)), ResponseCache(SQLiteBackend(path))
+
+    worker_1.set("users", Response(b"[]", media_type="application/json", headers={"etag": '"1"'}), ["user"])
+    worker_1.set("other", Response(b"{}"), ["other"])
+    response = worker_2.get("users")
+    assert response.body == b"[]"
+    assert response.headers["etag"] == '"1"'
+    assert response.media_type == "application/json"
+
+    worker_2.invalidate("user")
+    assert worker_1.get("users") is None
+    assert worker_1.get("other") is not None
@@ -0,0 +1,46 @@
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from src.services.crud.user_crud import UserCrud
+from src.services.user_cache import user_cache
+
+
+def test_cached_user_is_detached_snapshot(db_session, auth_user, user_sub):
+    user = UserCrud(db_session).get_by_sub_cached(sub=user_sub)
+    assert user is auth_user
+    assert inspect(user_cache.get(user_sub)).detached
+
+    other_session = Session(bind=db_session.get_bind())
+    try:
+        cached_user = UserCrud(other_session).get_by_sub_cached(sub=user_sub)
+        assert cached_user is not user_cache.get(user_sub)
+        assert inspect(cached_user).persistent
+        assert cached_user.email == auth_user.email
+    finally:
+        other_session.close()
+
+
+def test_update_invalidates_cached_user(db_session, auth_user, user_sub):
+    UserCrud(db_session).get_by_sub_cached(sub=user_sub)
+    stale_snapshot = user_cache.get(user_sub)
+
+    UserCrud(db_session).update(db_obj=auth_user, obj_in={"full_name": "new name"})
+    assert user_cache.get(user_sub) is None
+
+    # A read from before the write can't repopulate the cache
+    user_cache.set(stale_snapshot)
+    assert user_cache.get(user_sub) is None
+
+    assert UserCrud(db_session).get_by_sub_cached(sub=user_sub).full_name == "new name"
+    assert user_cache.get(user_sub).full_name == "new name"
+
+
+def test_current_user_served_from_cache(client, auth_user, user_sub):
+    user_cache.clear()
+    for _ in range(3):
+        assert client.get("/api/v1/users/me").status_code == 200
+    assert user_cache.entries.hits >= 2
+
+    response = client.patch("/api/v1/users/me", json={"age": 30})
+    assert response.status_code == 200
+    assert client.get("/api/v1/users/me").json()["age"] == 30
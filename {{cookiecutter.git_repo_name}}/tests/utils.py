@@ -0,0 +1,21 @@
+from contextlib import contextmanager
+from typing import Any, List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+@contextmanager
+def capture_statements(bind: Any) -> List[str]:
+    """Collect the statements run on a session's engine, or on an engine, e.g. the async engine's sync_engine."""
+    statements = []
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = bind.get_bind() if isinstance(bind, Session) else bind
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)